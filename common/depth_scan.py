@@ -0,0 +1,217 @@
+"""
+  Depth "virtual scan" - percentile of depth in overlapping windows along the horizon
+
+  The band around the horizon is split into column blocks of `step` pixels. Every
+  block is sorted once and each window (`box_width // step` neighbouring blocks) gets
+  its order statistics by vectorized rank search over the sorted blocks, so all
+  windows are computed in one batched pass without copying the input frame.
+
+  Shared by dtc-systems, followme and roboorienteering (add this directory to sys.path).
+"""
+import time
+
+import numpy as np
+
+INVALID_REPLACE = 'replace'  # invalid (zero) pixels count as `invalid_value` (dtc.py, follow_person.py)
+INVALID_MASK = 'mask'  # invalid (zero) pixels are ignored, window without valid pixel is 0 (ro.py)
+
+MAX_DEPTH_BITS = 16  # uint16 depth in millimeters
+
+
+class DepthScan:
+    def __init__(self, horizon=200, above=30, below=30, box_width=160, step=20, start=0, end=640,
+                 percentile=5, invalid=INVALID_REPLACE, invalid_value=10000):
+        """
+        :param horizon: image row of the horizon
+        :param above, below: band of rows horizon-above:horizon+below used for the scan
+        :param box_width: width of a single window in pixels
+        :param step: shift between neighbouring windows, box_width has to be a multiple of it
+        :param start, end: columns covered by the windows, the last window may end at `end`
+        :param percentile: default percentile (0-100) reported for each window
+        :param invalid: INVALID_REPLACE or INVALID_MASK policy for zero depth pixels
+        :param invalid_value: value used instead of zero for INVALID_REPLACE
+        """
+        assert invalid in [INVALID_REPLACE, INVALID_MASK], invalid
+        assert box_width % step == 0, (box_width, step)
+        assert end - start >= box_width, (start, end, box_width)
+        self.line = horizon - above
+        self.line_end = horizon + below
+        self.box_width = box_width
+        self.step = step
+        self.start = start
+        self.percentile = percentile
+        self.invalid = invalid
+        self.invalid_value = invalid_value
+
+        self.num_windows = (end - start - box_width) // step + 1
+        self.blocks_per_window = box_width // step
+        self.num_blocks = self.num_windows - 1 + self.blocks_per_window
+        self.end = start + self.num_blocks * step
+        # block indices of every window (num_windows x blocks_per_window)
+        self.window_blocks = np.arange(self.num_windows)[:, None] + np.arange(self.blocks_per_window)[None, :]
+        # sorted blocks are stored in one flat array with block index in the upper bits,
+        # one extra bit is reserved for masked pixels (they are never counted)
+        self.value_bits = MAX_DEPTH_BITS + 1
+        self.masked = 1 << MAX_DEPTH_BITS
+        self.block_offsets = np.arange(self.num_blocks, dtype=np.int64) << self.value_bits
+
+    def windows(self):
+        """Return list of (first_column, last_column + 1) for all windows"""
+        return [(self.start + i * self.step, self.start + i * self.step + self.box_width)
+                for i in range(self.num_windows)]
+
+    def _sorted_blocks(self, depth):
+        band = depth[self.line:self.line_end, self.start:self.end]
+        assert band.shape[0] > 0 and band.shape[1] == self.num_blocks * self.step, band.shape
+        values = band.astype(np.int64)  # the only copy - a band of rows
+        if self.invalid == INVALID_REPLACE:
+            values[band == 0] = self.invalid_value
+        else:
+            values[band == 0] = self.masked
+        rows = band.shape[0]
+        blocks = values.reshape(rows, self.num_blocks, self.step).transpose(1, 0, 2).reshape(self.num_blocks, -1)
+        blocks.sort(axis=1)
+        return blocks
+
+    def _valid_counts(self, blocks):
+        block_valid = (blocks < self.masked).sum(axis=1)
+        return block_valid[self.window_blocks].sum(axis=1)
+
+    def _order_statistics(self, flat, ranks):
+        """Binary search for value of given rank (0 = smallest) for all windows at once"""
+        num_windows = self.num_windows
+        lo = np.zeros(ranks.shape, dtype=np.int64)
+        hi = np.full(ranks.shape, self.masked - 1, dtype=np.int64)
+        # query positions: windows x blocks, repeated for every requested rank
+        offsets = np.tile(self.block_offsets[self.window_blocks], (len(ranks) // num_windows, 1))
+        block_starts = np.searchsorted(flat, offsets, side='left')
+        while (lo < hi).any():
+            mid = (lo + hi) // 2
+            count = (np.searchsorted(flat, offsets + mid[:, None], side='right') - block_starts).sum(axis=1)
+            enough = count > ranks
+            hi = np.where(enough, mid, hi)
+            lo = np.where(enough, lo, mid + 1)
+        return lo
+
+    def percentiles(self, depth, q):
+        """
+        Compute percentile(s) of all windows, identical to np.percentile() of the window
+        :param depth: 2D uint16 depth image in millimeters
+        :param q: percentile or list of percentiles
+        :return: float array (num_windows,) or (len(q), num_windows), NaN for windows without valid pixels
+        """
+        blocks = self._sorted_blocks(depth)
+        flat = (blocks + self.block_offsets[:, None]).ravel()
+        if self.invalid == INVALID_REPLACE:
+            counts = np.full(self.num_windows, blocks.shape[1] * self.blocks_per_window)
+        else:
+            counts = self._valid_counts(blocks)
+
+        quantiles = np.atleast_1d(np.asarray(q, dtype=np.float64)) / 100
+        # 'linear' method of np.percentile()
+        virtual = (np.maximum(counts, 1) - 1)[None, :] * quantiles[:, None]
+        below = np.floor(virtual).astype(np.int64)
+        above = np.minimum(below + 1, np.maximum(counts - 1, 0)[None, :])
+        gamma = virtual - below
+        ranks = np.concatenate([below.ravel(), above.ravel()])
+        values = self._order_statistics(flat, ranks).astype(np.float64).reshape(2, len(quantiles), -1)
+        a, b = values
+        diff = b - a
+        ret = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+        ret[:, counts == 0] = np.nan
+        return ret if np.ndim(q) else ret[0]
+
+    def valid_counts(self, depth):
+        """Return number of valid (non-zero) pixels in every window"""
+        band = depth[self.line:self.line_end, self.start:self.end] != 0
+        block_valid = band.reshape(band.shape[0], self.num_blocks, self.step).sum(axis=(0, 2))
+        return block_valid[self.window_blocks].sum(axis=1)
+
+    def scan(self, depth):
+        """
+        Return virtual scan - list of int distances in millimeters, 0 for windows without valid pixels
+        """
+        ret = self.percentiles(depth, self.percentile)
+        return [0 if np.isnan(v) else int(v) for v in ret]
+
+
+def reference_scan(depth, horizon=200, above=30, below=30, box_width=160, step=20, start=0, end=640,
+                   percentile=5, invalid=INVALID_REPLACE, invalid_value=10000):
+    """Original per-window loop kept as reference for tests and benchmark"""
+    line, line_end = horizon - above, horizon + below
+    arr = []
+    for index in range(start, end + 1 - box_width, step):
+        window = depth[line:line_end, index:box_width + index]
+        if invalid == INVALID_REPLACE:
+            window = window.copy()
+            window[window == 0] = invalid_value
+            arr.append(int(np.percentile(window, percentile)))
+        else:
+            mask = window != 0
+            if mask.max():
+                arr.append(int(np.percentile(window[mask], percentile)))
+            else:
+                arr.append(0)
+    return arr
+
+
+def benchmark(frames, repeat=1, **kwargs):
+    """Return (reference, batched) average time per frame in milliseconds"""
+    scanner = DepthScan(**kwargs)
+    results = []
+    for func in [lambda depth: reference_scan(depth, **kwargs), scanner.scan]:
+        start_time = time.perf_counter()
+        for i in range(repeat):
+            for depth in frames:
+                func(depth)
+        results.append(1000 * (time.perf_counter() - start_time) / (repeat * len(frames)))
+    for depth in frames:
+        assert reference_scan(depth, **kwargs) == scanner.scan(depth)
+    return results
+
+
+def random_frames(count, width=640, height=400, invalid_ratio=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        depth = rng.integers(1, 12000, size=(height, width), dtype=np.uint16)
+        depth[rng.random((height, width)) < invalid_ratio] = 0
+        frames.append(depth)
+    return frames
+
+
+def load_frames(log_path, stream_name, count):
+    from osgar.logger import LogReader, lookup_stream_id
+    from osgar.lib.serialize import deserialize
+
+    frames = []
+    stream_id = lookup_stream_id(log_path, stream_name)
+    with LogReader(log_path, only_stream_id=stream_id) as log:
+        for timestamp, stream, raw in log:
+            frames.append(deserialize(raw))
+            if len(frames) >= count:
+                break
+    return frames
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log', help='OSGAR log with depth data (default random frames)')
+    parser.add_argument('--stream-name', default='oak.depth', help='Name of the depth data stream')
+    parser.add_argument('--count', type=int, default=100, help='number of frames')
+    parser.add_argument('--repeat', type=int, default=10, help='number of passes over all frames')
+    parser.add_argument('--mask', action='store_true', help='use INVALID_MASK policy')
+    args = parser.parse_args()
+
+    if args.log is None:
+        frames = random_frames(args.count)
+    else:
+        frames = load_frames(args.log, args.stream_name, args.count)
+    invalid = INVALID_MASK if args.mask else INVALID_REPLACE
+    before, after = benchmark(frames, repeat=args.repeat, invalid=invalid)
+    print(f'{len(frames)} frames x {args.repeat}, {invalid}')
+    print(f'per-window loop: {before:.3f} ms/frame')
+    print(f'batched scan:    {after:.3f} ms/frame ({before/after:.1f}x)')
+
+# vim: expandtab sw=4 ts=4
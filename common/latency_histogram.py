@@ -0,0 +1,73 @@
+"""
+  Latency histogram with logarithmic bins
+
+  Bin i counts durations in [min_latency * 2**(i-1), min_latency * 2**i), the first bin
+  everything below min_latency and the last bin everything above the top bound. The
+  histogram is a plain list of counts, so it is cheap to update on every call and easy
+  to publish or log.
+"""
+import math
+
+
+class LatencyHistogram:
+    def __init__(self, min_latency=0.001, num_bins=16):
+        """
+        :param min_latency: upper bound of the first bin in seconds
+        :param num_bins: number of bins, the last one is open-ended
+        """
+        self.min_latency = min_latency
+        self.counts = [0] * num_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bin_index(self, latency):
+        if latency < self.min_latency:
+            return 0
+        index = int(math.floor(math.log2(latency / self.min_latency))) + 1
+        return min(index, len(self.counts) - 1)
+
+    def upper_bound(self, index):
+        """Upper bound of the bin in seconds (inf for the last one)"""
+        if index >= len(self.counts) - 1:
+            return math.inf
+        return self.min_latency * 2 ** index
+
+    def record(self, latency):
+        """Add single duration in seconds"""
+        self.counts[self.bin_index(latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+    def percentile(self, q):
+        """Upper bound of the bin containing q-th percentile (0-100)"""
+        if self.count == 0:
+            return None
+        limit = q / 100 * self.count
+        acc = 0
+        for index, count in enumerate(self.counts):
+            acc += count
+            if acc >= limit and count > 0:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Summary suitable for publishing - non-empty bins as [upper_bound, count]"""
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'max': self.max,
+            'bins': [[self.upper_bound(i), c] for i, c in enumerate(self.counts) if c > 0],
+        }
+
+    def __str__(self):
+        if self.count == 0:
+            return 'no samples'
+        bins = ' '.join(f'<{self.upper_bound(i):g}s:{c}' for i, c in enumerate(self.counts) if c > 0)
+        return f'n={self.count} mean={self.mean():.3f}s max={self.max:.3f}s {bins}'
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,182 @@
+"""
+  Opt-in profiling of OSGAR node handlers
+
+  Enabled from the node config:
+    "profile": true  - wall-time histograms of all bus handlers on_<channel>(data)
+    "profile": {
+        "handlers": ["on_color", "on_pose2d"],  # timed handlers (default all bus handlers)
+        "deterministic": ["on_color"],  # cProfile of selected handlers
+        "sampling": ["on_depth"],  # statistical stack sampling of selected handlers
+        "sample_interval": 0.005,  # seconds
+        "period": 10.0,  # publication period in seconds (wall time)
+        "top": 10,  # number of functions in profile statistics
+        "channel": "debug_profiler"
+    }
+  The node creates the profiler in its __init__ via NodeProfiler.from_config(self, config).
+  Handlers are wrapped on the instance, so Node.update() dispatch is not changed. The
+  statistics of the last period are published as dictionary into the OSGAR log:
+    {'period': sec, 'handlers': {name: LatencyHistogram.to_dict()},
+     'profiles': {name: cProfile text}, 'samples': {name: sampling text}}  # 'samples' only with sampling
+"""
+import inspect
+import sys
+import time
+from collections import Counter
+from cProfile import Profile
+from functools import wraps
+from io import StringIO
+from pstats import SortKey, Stats
+from threading import Lock, RLock, Thread, get_ident
+
+from latency_histogram import LatencyHistogram
+
+
+def profile_stats(profile, top=10):
+    """Text of top cumulative functions from cProfile.Profile"""
+    s = StringIO()
+    Stats(profile, stream=s).strip_dirs().sort_stats(SortKey.CUMULATIVE).print_stats(top)
+    return s.getvalue()
+
+
+def bus_handlers(node):
+    """
+    Names of on_<channel>(data) methods dispatched by Node.update(), i.e. without on_* callbacks
+    of futures or threads like on_analysis_done(..., future)
+    """
+    return [name for name in dir(type(node)) if name.startswith('on_') and callable(getattr(node, name))
+            and list(inspect.signature(getattr(node, name)).parameters) == ['data']]
+
+
+class StackSampler:
+    """
+    Statistical profiler - samples the stack of the thread running a selected handler
+    Counts are inclusive, i.e. function is counted if it is anywhere on the stack below the handler.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.active = {}  # thread id -> (handler name, frame of the handler wrapper)
+        self.counts = {}  # handler name -> Counter of functions
+        self.num_samples = Counter()
+        self.lock = Lock()
+        self.thread = None
+
+    def enter(self, name):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.active[get_ident()] = (name, sys._getframe(1))
+
+    def exit(self):
+        self.active.pop(get_ident(), None)
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, (name, handler_frame) in list(self.active.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                functions = set()
+                while frame is not None and frame is not handler_frame:
+                    code = frame.f_code
+                    functions.add(f'{code.co_filename.split("/")[-1]}:{code.co_firstlineno}({code.co_name})')
+                    frame = frame.f_back
+                self.counts.setdefault(name, Counter()).update(functions)
+                self.num_samples[name] += 1
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+    def pop_stats(self, top=10):
+        """Text statistics per handler since the last call"""
+        with self.lock:
+            counts, num_samples = self.counts, self.num_samples
+            self.counts, self.num_samples = {}, Counter()
+        ret = {}
+        for name, counter in counts.items():
+            lines = [f'{num_samples[name]} samples every {self.interval}s']
+            for function, count in counter.most_common(top):
+                lines.append(f'{count:8d} {100 * count / num_samples[name]:5.1f}% {function}')
+            ret[name] = '\n'.join(lines)
+        return ret
+
+
+class NodeProfiler:
+    def __init__(self, node, handlers=None, deterministic=(), sampling=(), sample_interval=0.005,
+                 period=10.0, top=10, channel='debug_profiler'):
+        if handlers is None:
+            handlers = bus_handlers(node)
+        self.node = node
+        self.period = period
+        self.top = top
+        self.channel = channel
+        self.histograms = {}
+        self.profiles = {name: Profile() for name in deterministic}
+        self.sampler = StackSampler(sample_interval) if sampling else None
+        self.sampling = set(sampling)
+        self.last_publish_time = time.monotonic()
+        self.lock = RLock()
+        node.bus.register(channel)
+        for name in set(handlers) | set(deterministic) | self.sampling:
+            setattr(node, name, self.wrap(name, getattr(node, name)))
+
+    @classmethod
+    def from_config(cls, node, config):
+        """Return profiler according to "profile" config entry or None if profiling is not enabled"""
+        params = config.get('profile')
+        if not params:
+            return None
+        if params is True:
+            params = {}
+        return cls(node, **params)
+
+    def wrap(self, name, handler):
+        self.histograms.setdefault(name, LatencyHistogram())
+        profile = self.profiles.get(name)
+        sampler = self.sampler if name in self.sampling else None
+
+        @wraps(handler)
+        def timed_handler(*args, **kwargs):
+            if sampler is not None:
+                sampler.enter(name)
+            if profile is not None:
+                profile.enable()
+            start_time = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start_time
+                if profile is not None:
+                    profile.disable()
+                if sampler is not None:
+                    sampler.exit()
+                with self.lock:  # explicitly selected handlers can be called also from worker threads
+                    self.histograms[name].record(duration)
+                    if time.monotonic() - self.last_publish_time >= self.period:
+                        self.publish()
+        return timed_handler
+
+    def publish(self):
+        """Publish statistics collected since the last publication and start new period"""
+        with self.lock:
+            now = time.monotonic()
+            report = {
+                'period': now - self.last_publish_time,
+                'handlers': {name: hist.to_dict() for name, hist in self.histograms.items() if hist.count > 0},
+                'profiles': {},
+            }
+            self.last_publish_time = now
+            self.histograms = {name: LatencyHistogram() for name in self.histograms}
+            for name, profile in self.profiles.items():
+                stats = profile.getstats()
+                if len(stats) > 0:
+                    report['profiles'][name] = profile_stats(profile, self.top)
+                    profile.clear()
+            if self.sampler is not None:
+                report['samples'] = self.sampler.pop_stats(self.top)
+            self.node.publish(self.channel, report)
+        return report
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from depth_scan import DepthScan, INVALID_MASK, random_frames, reference_scan
+
+
+class DepthScanTest(unittest.TestCase):
+
+    def test_replace_invalid(self):
+        scanner = DepthScan(horizon=200)
+        self.assertEqual(scanner.num_windows, 25)
+        for depth in random_frames(5):
+            self.assertEqual(scanner.scan(depth), reference_scan(depth, horizon=200))
+
+    def test_mask_invalid(self):
+        # roboorienteering setup - band under the image center
+        params = dict(horizon=200, above=0, below=30, invalid=INVALID_MASK)
+        scanner = DepthScan(**params)
+        for depth in random_frames(5, invalid_ratio=0.5, seed=1):
+            self.assertEqual(scanner.scan(depth), reference_scan(depth, **params))
+
+    def test_no_valid_pixels(self):
+        depth = np.zeros((400, 640), dtype=np.uint16)
+        depth[:, 600:] = 1234
+        self.assertEqual(DepthScan(invalid=INVALID_MASK).scan(depth), [0] * 23 + [1234] * 2)
+        self.assertEqual(DepthScan().scan(depth), [10000] * 23 + [1234] * 2)
+
+    def test_percentiles(self):
+        scanner = DepthScan(start=320, end=480, step=160, invalid=INVALID_MASK)
+        self.assertEqual(scanner.windows(), [(320, 480)])
+        depth = random_frames(1, invalid_ratio=0.3, seed=2)[0]
+        window = depth[170:230, 320:480]
+        expected = [np.percentile(window[window != 0], q) for q in [5, 10, 50]]
+        self.assertEqual(scanner.percentiles(depth, [5, 10, 50])[:, 0].tolist(), expected)
+        self.assertEqual(scanner.valid_counts(depth).tolist(), [(window != 0).sum()])
+
+    def test_input_not_modified(self):
+        depth = random_frames(1)[0]
+        orig = depth.copy()
+        DepthScan().scan(depth)
+        self.assertTrue(np.array_equal(depth, orig))
+
+
+if __name__ == '__main__':
+    unittest.main()
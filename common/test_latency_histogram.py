@@ -0,0 +1,32 @@
+import math
+import unittest
+
+from latency_histogram import LatencyHistogram
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_bins(self):
+        h = LatencyHistogram(min_latency=0.001, num_bins=5)
+        for latency in [0.0005, 0.001, 0.0015, 0.003, 0.007, 1.0]:
+            h.record(latency)
+        self.assertEqual(h.counts, [1, 2, 1, 1, 1])
+        self.assertEqual(h.upper_bound(1), 0.002)
+        self.assertEqual(h.upper_bound(4), math.inf)
+        self.assertEqual(h.count, 6)
+        self.assertEqual(h.max, 1.0)
+        self.assertAlmostEqual(h.mean(), 1.013 / 6)
+        self.assertEqual(h.percentile(50), 0.002)
+        self.assertEqual(h.percentile(100), 1.0)
+        self.assertEqual(h.to_dict()['bins'][0], [0.001, 1])
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        self.assertIsNone(h.mean())
+        self.assertIsNone(h.percentile(50))
+        self.assertEqual(str(h), 'no samples')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,80 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from node_profiler import NodeProfiler
+from osgar.node import Node
+
+
+def busy_wait(duration):
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfiledNode(Node):
+    def __init__(self, config, bus):
+        super().__init__(config, bus)
+        bus.register('out')
+        self.profiler = NodeProfiler.from_config(self, config)
+
+    def on_fast(self, data):
+        self.publish('out', data)
+
+    def on_slow(self, data):
+        busy_wait(0.02)
+
+    def on_done(self, future):
+        """Callback of executor thread, not a bus handler"""
+        self.publish('out', future)
+
+
+class NodeProfilerTest(unittest.TestCase):
+    def test_disabled(self):
+        node = ProfiledNode(config={}, bus=MagicMock())
+        self.assertIsNone(node.profiler)
+        self.assertEqual(node.on_fast.__func__, ProfiledNode.on_fast)
+
+    def test_histograms(self):
+        bus = MagicMock()
+        node = ProfiledNode(config={'profile': True}, bus=bus)
+        bus.register.assert_called_with('debug_profiler')
+        for i in range(3):
+            node.on_fast(i)
+        node.on_slow(None)
+        bus.publish.assert_called_with('out', 2)  # handler still works
+        report = node.profiler.publish()
+        bus.publish.assert_called_with('debug_profiler', report)
+        self.assertEqual(report['handlers']['on_fast']['count'], 3)
+        self.assertGreaterEqual(report['handlers']['on_slow']['max'], 0.02)
+        self.assertEqual(report['profiles'], {})
+        self.assertEqual(node.on_done.__func__, ProfiledNode.on_done)
+        # new period starts empty
+        self.assertEqual(node.profiler.publish()['handlers'], {})
+
+    def test_periodic_publish(self):
+        bus = MagicMock()
+        node = ProfiledNode(config={'profile': {'handlers': ['on_slow'], 'period': 0.05}}, bus=bus)
+        for i in range(4):
+            node.on_slow(None)
+            node.on_fast(i)
+        reports = [args[1] for args, kwargs in bus.publish.call_args_list if args[0] == 'debug_profiler']
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(list(reports[0]['handlers'].keys()), ['on_slow'])
+        self.assertEqual(reports[0]['handlers']['on_slow']['count'], 3)
+
+    def test_profiles(self):
+        bus = MagicMock()
+        node = ProfiledNode(config={'profile': {'deterministic': ['on_slow'], 'sampling': ['on_slow'],
+                                                'sample_interval': 0.001}}, bus=bus)
+        for i in range(5):
+            node.on_slow(None)
+        report = node.profiler.publish()
+        self.assertIn('busy_wait', report['profiles']['on_slow'])
+        self.assertIn('busy_wait', report['samples']['on_slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,47 @@
+import math
+import unittest
+
+from waypoints import Waypoints
+
+
+class WaypointsTest(unittest.TestCase):
+
+    def test_nearest(self):
+        # m04-dtc-night-251002_020022.log - first 20s, see test_dtc.py
+        pos1 = 32.50053483, -83.75835683
+        pos2 = 32.500504, -83.758347
+        waypoints = Waypoints([pos2, (32.6, -83.7)])
+        index, dist = waypoints.nearest(pos1)
+        self.assertEqual(index, 0)
+        self.assertAlmostEqual(dist, 3.5517766580136345, delta=0.01)  # dtc.py rounds to milliseconds
+        self.assertEqual(len(waypoints.distances(pos1)), 2)
+
+    def test_empty(self):
+        waypoints = Waypoints()
+        self.assertEqual(waypoints.nearest((50.0, 14.0)), (None, None))
+        waypoints.append((50.0, 14.0))
+        self.assertEqual(waypoints.origin, (50.0, 14.0))
+        self.assertEqual(waypoints.nearest((50.0, 14.0)), (0, 0.0))
+
+    def test_remove(self):
+        waypoints = Waypoints([(50.0, 14.0), (50.001, 14.0), (50.002, 14.0)])
+        del waypoints[1]
+        self.assertEqual(list(waypoints), [(50.0, 14.0), (50.002, 14.0)])
+        index, dist = waypoints.nearest((50.0009, 14.0))
+        self.assertEqual(index, 0)
+        waypoints.clear()
+        self.assertEqual(len(waypoints), 0)
+        waypoints.append((50.1, 14.1))
+        self.assertEqual(waypoints[0], (50.1, 14.1))
+        self.assertEqual(waypoints.origin, (50.0, 14.0))
+
+    def test_bearing(self):
+        waypoints = Waypoints([(50.0, 14.0), (50.0, 14.001)])
+        self.assertAlmostEqual(waypoints.bearing((50.0, 14.0), 0, min_dist=0.0), 0.0)  # same point
+        self.assertIsNone(waypoints.bearing((50.0, 14.0), 0))
+        self.assertAlmostEqual(waypoints.bearing((50.0, 14.0), 1), 0.0)  # east
+        self.assertAlmostEqual(waypoints.bearing((49.999, 14.001), 1), math.pi / 2)  # north
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+  GPS waypoints projected into local metric frame
+
+  Waypoints are projected once (x east, y north in meters) relative to a fixed origin,
+  so nearest-waypoint and bearing queries are vectorized numpy operations on every
+  GPS fix instead of per-waypoint spherical computations.
+"""
+import math
+
+import numpy as np
+
+METERS_PER_DEGREE = 40000000 / 360  # the same approximation as geo_length() in dtc.py
+
+
+class Waypoints:
+    def __init__(self, waypoints=(), origin=None):
+        """
+        :param waypoints: list of (lat, lon) in degrees
+        :param origin: (lat, lon) of local frame origin, default is the first waypoint
+        """
+        self.latlon = []
+        self.xy = np.zeros((0, 2))
+        self.origin = None
+        self.x_scale = None
+        if origin is not None:
+            self.set_origin(origin)
+        self.extend(waypoints)
+
+    def set_origin(self, origin):
+        assert self.origin is None, self.origin
+        self.origin = tuple(origin)
+        self.x_scale = math.cos(math.radians(origin[0])) * METERS_PER_DEGREE
+
+    def project(self, latlon):
+        """Return local (x, y) in meters for single (lat, lon) or array of positions"""
+        latlon = np.asarray(latlon, dtype=np.float64)
+        x = (latlon[..., 1] - self.origin[1]) * self.x_scale
+        y = (latlon[..., 0] - self.origin[0]) * METERS_PER_DEGREE
+        return np.stack([x, y], axis=-1)
+
+    def append(self, latlon):
+        self.extend([latlon])
+
+    def extend(self, waypoints):
+        waypoints = [tuple(p) for p in waypoints]
+        if len(waypoints) == 0:
+            return
+        if self.origin is None:
+            self.set_origin(waypoints[0])
+        self.latlon.extend(waypoints)
+        self.xy = np.concatenate([self.xy, self.project(waypoints)])
+
+    def clear(self):
+        self.latlon = []
+        self.xy = self.xy[:0]
+
+    def __delitem__(self, index):
+        del self.latlon[index]
+        self.xy = np.delete(self.xy, index, axis=0)
+
+    def __getitem__(self, index):
+        return self.latlon[index]
+
+    def __len__(self):
+        return len(self.latlon)
+
+    def __iter__(self):
+        return iter(self.latlon)
+
+    def __repr__(self):
+        return repr(self.latlon)
+
+    def distances(self, latlon):
+        """Return distances in meters from given position to all waypoints"""
+        if len(self.latlon) == 0:
+            return np.zeros(0)
+        diff = self.xy - self.project(latlon)
+        return np.hypot(diff[:, 0], diff[:, 1])
+
+    def nearest(self, latlon):
+        """Return (index, distance in meters) of the closest waypoint or (None, None) for empty list"""
+        if len(self.latlon) == 0:
+            return None, None
+        dist = self.distances(latlon)
+        index = int(np.argmin(dist))
+        return index, float(dist[index])
+
+    def bearing(self, latlon, index, min_dist=1.0):
+        """Return direction (radians, 0 = east, counter-clockwise) to waypoint or None if closer than min_dist"""
+        dx, dy = self.xy[index] - self.project(latlon)
+        if math.hypot(dx, dy) < min_dist:
+            return None
+        return math.atan2(dy, dx)
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,14 @@
+"""
+  Make the shared modules of the repository common/ directory importable
+
+  Import this module before the shared ones:
+    import common_path  # noqa: F401
+"""
+import os
+import sys
+
+COMMON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common'))
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
+
+# vim: expandtab sw=4 ts=4
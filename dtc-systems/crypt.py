@@ -2,16 +2,15 @@
   Decryption and encryption of serial communication via LoRa module
 """
 # the original example was crated by Helena/AI
-import os
-import hmac
-import hashlib
 import base64
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+import hashlib
+import hmac
+import os
 
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from osgar.drivers.lora import parse_lora_packet
 from osgar.node import Node
-from osgar.drivers.lora import split_lora_buffer, parse_lora_packet
-
 
 # --- CONFIGURATION ---
 ENC_KEY = os.urandom(32)
@@ -24,6 +23,150 @@ TAG_SIZE = 4
 # The AES block size is always 16 bytes.
 AES_BLOCK_SIZE = 16
 
+# Frames encoded by Ascii85 start with one of these characters, which are neither in Base64
+# nor Ascii85 alphabet (both also avoid '|', '\r' and '\n' used by LoRa).
+FRAME_MARKER = b'~'  # single message
+BATCH_MARKER = b'}'  # several messages, each prefixed by its length
+MAX_FRAME_MESSAGE_SIZE = 255  # 1 byte length prefix
+MAX_LORA_MESSAGE_SIZE = 40  # limit of osgar.drivers.lora
+
+
+class CryptContext:
+    """
+    Pre-keyed AES and HMAC state for repeated encryption/decryption with the same keys.
+
+    AES-CTR keystream is generated by a single AES-ECB encryptor (key schedule is computed
+    only once) over counter blocks, so it is compatible with Cipher(AES, CTR(nonce)).
+    """
+    def __init__(self, enc_key: bytes, mac_key: bytes):
+        self.ecb = Cipher(algorithms.AES(enc_key), mode=modes.ECB(), backend=default_backend()).encryptor()
+        self.hmac = hmac.new(mac_key, digestmod=hashlib.sha256)
+
+    def keystream(self, short_nonces, sizes):
+        """Return list of CTR keystreams for given nonces and message sizes (one AES call)"""
+        blocks = []
+        for short_nonce, size in zip(short_nonces, sizes):
+            for counter in range((size + AES_BLOCK_SIZE - 1) // AES_BLOCK_SIZE):
+                # the short nonce is padded by zeros - counter is in the lower 8 bytes
+                blocks.append(short_nonce + counter.to_bytes(AES_BLOCK_SIZE - TRANSMITTED_NONCE_SIZE, 'big'))
+        stream = self.ecb.update(b''.join(blocks))
+        ret = []
+        pos = 0
+        for size in sizes:
+            ret.append(stream[pos:pos + size])
+            pos += (size + AES_BLOCK_SIZE - 1) // AES_BLOCK_SIZE * AES_BLOCK_SIZE
+        return ret
+
+    def tag(self, short_nonce, ciphertext):
+        h = self.hmac.copy()
+        h.update(short_nonce)
+        h.update(ciphertext)
+        return h.digest()[:TAG_SIZE]
+
+    @staticmethod
+    def xor(data, key):
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(len(data), 'big')
+
+    def encrypt(self, plaintext_bytes: bytes) -> bytes:
+        """Return binary blob: short nonce + ciphertext + tag"""
+        if len(plaintext_bytes) == 0:
+            raise ValueError("Plaintext cannot be empty.")
+        short_nonce = os.urandom(TRANSMITTED_NONCE_SIZE)
+        ciphertext = self.xor(plaintext_bytes, self.keystream([short_nonce], [len(plaintext_bytes)])[0])
+        return short_nonce + ciphertext + self.tag(short_nonce, ciphertext)
+
+    def decrypt_many(self, encrypted_blobs):
+        """
+        Verifies and decrypts several binary blobs at once.
+        Returns list of plaintext bytes or ValueError instance for invalid messages.
+        """
+        ret = [None] * len(encrypted_blobs)
+        valid = []
+        for i, encrypted_blob in enumerate(encrypted_blobs):
+            if len(encrypted_blob) < TRANSMITTED_NONCE_SIZE + TAG_SIZE:
+                ret[i] = ValueError("Invalid encrypted data format.")
+                continue
+            short_nonce = encrypted_blob[:TRANSMITTED_NONCE_SIZE]
+            ciphertext = encrypted_blob[TRANSMITTED_NONCE_SIZE:-TAG_SIZE]
+            if not hmac.compare_digest(encrypted_blob[-TAG_SIZE:], self.tag(short_nonce, ciphertext)):
+                ret[i] = ValueError("Invalid authentication tag. Message integrity compromised.")
+                continue
+            valid.append((i, short_nonce, ciphertext))
+        streams = self.keystream([nonce for _, nonce, _ in valid], [len(ciphertext) for _, _, ciphertext in valid])
+        for (i, _, ciphertext), key in zip(valid, streams):
+            ret[i] = self.xor(ciphertext, key)
+        return ret
+
+    def encrypt_to_text(self, plaintext_bytes: bytes) -> str:
+        """See encrypt_to_text()"""
+        return base64.b64encode(self.encrypt(plaintext_bytes)).decode('ascii')
+
+    def decrypt_from_text(self, base64_string) -> bytes:
+        """See decrypt_from_text()"""
+        try:
+            encrypted_blob = base64.b64decode(base64_string)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid Base64 string.")
+        ret = self.decrypt_many([encrypted_blob])[0]
+        if isinstance(ret, ValueError):
+            raise ret
+        return ret
+
+
+def encode_frame(context: CryptContext, messages) -> bytes:
+    """
+    Encrypts one or more messages into one authenticated frame encoded by Ascii85 (25% overhead
+    instead of 33% for Base64).
+    """
+    if len(messages) == 1:
+        return FRAME_MARKER + base64.a85encode(context.encrypt(messages[0]))
+    plaintext = b''
+    for message in messages:
+        if not 0 < len(message) <= MAX_FRAME_MESSAGE_SIZE:
+            raise ValueError(f"Invalid message size {len(message)}.")
+        plaintext += bytes([len(message)]) + message
+    return BATCH_MARKER + base64.a85encode(context.encrypt(plaintext))
+
+
+def encoded_frame_size(message_sizes):
+    """
+    Upper bound of encode_frame() output length for messages of given sizes
+    (Ascii85 abbreviation of zero groups can make the frame shorter)
+    """
+    if len(message_sizes) == 1:
+        size = message_sizes[0]
+    else:
+        size = sum(1 + s for s in message_sizes)
+    size += TRANSMITTED_NONCE_SIZE + TAG_SIZE
+    return len(FRAME_MARKER) + size + (size + 3) // 4
+
+
+def decode_text(text: bytes):
+    """
+    Return (binary blob, is_batch) for received text - Ascii85 frame or single Base64 message.
+    """
+    try:
+        if text.startswith(FRAME_MARKER):
+            return base64.a85decode(text[len(FRAME_MARKER):]), False
+        if text.startswith(BATCH_MARKER):
+            return base64.a85decode(text[len(BATCH_MARKER):]), True
+        return base64.b64decode(text), False
+    except (ValueError, TypeError):
+        raise ValueError("Invalid encoding.")
+
+
+def split_batch(plaintext: bytes):
+    """Return list of messages of decrypted batch frame"""
+    messages = []
+    pos = 0
+    while pos < len(plaintext):
+        size = plaintext[pos]
+        if size == 0 or pos + 1 + size > len(plaintext):
+            raise ValueError("Invalid frame format.")
+        messages.append(plaintext[pos + 1:pos + 1 + size])
+        pos += 1 + size
+    return messages
+
 
 def encrypt_to_text(plaintext_bytes: bytes, enc_key: bytes, mac_key: bytes) -> str:
     """
@@ -98,25 +241,70 @@ class Crypt(Node):
                      )
         self.enc_key = bytes.fromhex(config['enc_key'])  # must be distributed among robots and basestation
         self.mac_key = bytes.fromhex(config['mac_key'])
-        self.buf = b''
+        self.context = CryptContext(self.enc_key, self.mac_key)
+        # optional collection of outgoing messages into a single frame, requires 'tick' input
+        self.batch_time = config.get('batch_time')  # seconds or None for immediate send
+        self.max_frame_size = config.get('max_frame_size', MAX_LORA_MESSAGE_SIZE)  # encoded frame bytes
+        self.pending = []
+        self.pending_time = None
+        self.buf = bytearray()
+        self.scan_pos = 0  # buffer before this position does not contain '\n'
+
+    def split_packets(self, data):
+        """
+        Append serial data and return list of all complete packets (terminated by '\n')
+        """
+        self.buf += data
+        packets = []
+        start = 0
+        end = self.buf.find(b'\n', self.scan_pos)
+        while end >= 0:
+            packets.append(bytes(self.buf[start:end + 1]))
+            start = end + 1
+            end = self.buf.find(b'\n', start)
+        del self.buf[:start]
+        self.scan_pos = len(self.buf)
+        return packets
 
     def on_raw(self, data):
         """
         raw data from serial stream, to be split by '\n' in to packets and decrypted
         """
-        self.buf, packet = split_lora_buffer(self.buf + data)
-        while len(packet) > 0:
-            # process packet
+        packets = self.split_packets(data)
+        if len(packets) == 0:
+            return
+        parsed = []
+        for packet in packets:
             assert packet[-1] == ord('\n'), packet
             assert packet[-2] == ord('\r'), packet  # LoRa is for some reason adding both \r\n
             assert b'|' in packet, packet
-            addr, to_decode = parse_lora_packet(packet)
+            parsed.append(parse_lora_packet(packet))
+        blobs, batches = [], []
+        for addr, to_decode in parsed:
             try:
-                plaintext = decrypt_from_text(to_decode, self.enc_key, self.mac_key)
-                self.publish('decrypted', [addr, plaintext])
+                blob, is_batch = decode_text(to_decode)
+            except ValueError:
+                blob, is_batch = b'', False  # rejected by decrypt_many()
+            blobs.append(blob)
+            batches.append(is_batch)
+        # decrypt the whole burst at once
+        results = self.context.decrypt_many(blobs)
+        for packet, (addr, to_decode), is_batch, plaintext in zip(packets, parsed, batches, results):
+            try:
+                if isinstance(plaintext, ValueError):
+                    raise plaintext
+                messages = split_batch(plaintext) if is_batch else [plaintext]
             except ValueError:
                 print(f'Skipping msg {packet}')
-            self.buf, packet = split_lora_buffer(self.buf)
+                continue
+            for message in messages:
+                self.publish('decrypted', [addr, message])
+
+    def flush(self):
+        if len(self.pending) > 0:
+            self.publish('encrypted', encode_frame(self.context, self.pending) + b'\n')
+            self.pending = []
+            self.pending_time = None
 
     def on_packet(self, data):
         """
@@ -125,8 +313,42 @@ class Crypt(Node):
         # LoRa cmd packet has to end with \n character
         assert data[-1] == ord('\n'), data
         # encrypt data without cmd character
-        encrypted_text = encrypt_to_text(data[:-1], self.enc_key, self.mac_key)
-        self.publish('encrypted', bytes(encrypted_text, 'ascii') + b'\n')
+        message = data[:-1]
+        if encoded_frame_size([len(m) for m in self.pending] + [len(message)]) > self.max_frame_size:
+            self.flush()
+        self.pending.append(message)
+        if self.pending_time is None:
+            self.pending_time = self.time
+        if self.batch_time is None:
+            self.flush()
+
+    def on_tick(self, data):
+        if self.pending_time is not None and (self.time - self.pending_time).total_seconds() >= self.batch_time:
+            self.flush()
+
+
+def airtime_benchmark(count=1000, batch_sizes=(1, 2, 3, 5)):
+    """Print average number of transmitted bytes per DTC report (without LoRa address prefix)"""
+    import random
+
+    from report import OPTIONAL_FIELDS, DTCReport, pack_data
+
+    rnd = random.Random(0)
+    reports = []
+    for i in range(count):
+        r = DTCReport(f'm0{rnd.randint(1, 5)}-', rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+        if rnd.random() < 0.5:
+            # casualty report, otherwise position beacon
+            r.casualty_id = rnd.randrange(1, 256)
+            for name, bits in OPTIONAL_FIELDS:
+                setattr(r, name, rnd.randrange(1 << bits))
+        reports.append(pack_data(r))
+    context = CryptContext(ENC_KEY, MAC_KEY)
+    size = sum(len(context.encrypt_to_text(data)) + 1 for data in reports)
+    print(f'Base64, single report: {size / count:.1f} bytes per report')
+    for batch in batch_sizes:
+        size = sum(len(encode_frame(context, reports[i:i + batch])) + 1 for i in range(0, count, batch))
+        print(f'Ascii85 frame, {batch} report(s): {size / count:.1f} bytes per report')
 
 
 # --- DEMONSTRATION ---
@@ -143,3 +365,6 @@ if __name__ == "__main__":
         print(f"Decrypted message: '{decrypted_bytes.decode('ascii')}'")
     except ValueError as e:
         print(f"Decryption failed: {e}")
+
+    print()
+    airtime_benchmark()
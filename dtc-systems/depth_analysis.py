@@ -3,33 +3,33 @@
 """
 import argparse
 
-import numpy as np
-
 from osgar.logger import LogReader, lookup_stream_id
 from osgar.lib.serialize import deserialize
 
+import common_path  # noqa: F401
+from depth_scan import DepthScan, INVALID_MASK
+
 
 def extract_depth(log_path, stream_name):
-    line = 400 // 2
-    line_end = 400 // 2 + 30
+    index = 320
     box_width = 160
+    # single window of the RoboOrienteering scan
+    scanner = DepthScan(horizon=400 // 2, above=0, below=30, start=index, end=index + box_width, step=box_width,
+                        invalid=INVALID_MASK)
 
     arr = []
     stream_id = lookup_stream_id(log_path, stream_name)
     with LogReader(log_path, only_stream_id=stream_id) as log:
-        index = 320
         for i, (timestamp, stream, raw) in enumerate(log):
             data = deserialize(raw)
-            mask = data[line:line_end, index:box_width + index] != 0
-            if mask.max():
-                dist5 = int(np.percentile( data[line:line_end, index:box_width + index][mask], 5))
-                dist10 = int(np.percentile( data[line:line_end, index:box_width + index][mask], 10))
-                dist50 = int(np.percentile( data[line:line_end, index:box_width + index][mask], 50))
+            valid = int(scanner.valid_counts(data)[0])
+            if valid > 0:
+                dist5, dist10, dist50 = [int(v) for v in scanner.percentiles(data, [5, 10, 50])[:, 0]]
             else:
                 dist5, dist10, dist50 = 0, 0, 0
-#            print(timestamp, dist5, dist10, dist50, mask.sum())
+#            print(timestamp, dist5, dist10, dist50, valid)
 #            arr.append((timestamp.total_seconds(), dist5, dist10, dist50))
-            arr.append((timestamp.total_seconds(), mask.sum()))
+            arr.append((timestamp.total_seconds(), valid))
             if i > 1000:
                 break
         return arr
@@ -1,71 +1,389 @@
 """
   Module for medical evaluation - name "doctor" is in memory of GLB (that time to take care of other modules)
 """
-from io import StringIO
-from pathlib import Path
-from cProfile import Profile
-from pstats import SortKey, Stats
+import time
+_import_start_time = time.perf_counter()  # the following imports are part of the measured startup
+from collections.abc import Sequence  # noqa: E402
+from pathlib import Path  # noqa: E402
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait  # noqa: E402
+from functools import partial  # noqa: E402
+from threading import Lock  # noqa: E402
+import multiprocessing  # noqa: E402
+from cProfile import Profile  # noqa: E402
 
-import cv2
-import wave
-from ultralytics import YOLO
+import wave  # noqa: E402
 
-from osgar.node import Node
-from wav2txt import is_coherent_speech
-from report import DTCReport, pack_data
+from osgar.node import Node  # noqa: E402
+from osgar.bus import BusShutdownException  # noqa: E402
+from wav2txt import SpeechService, StreamingTranscription  # noqa: E402
+from report import DTCReport, pack_data  # noqa: E402
 
-import sys
-import importlib
+import sys  # noqa: E402
+import importlib  # noqa: E402
 fb_module = str(Path(__file__).parent.parent.parent / 'dtc-video-analysis')
 if fb_module not in sys.path:
     sys.path.append(fb_module)
-fb_main = importlib.import_module('detect-and-stream').main
 
-from dtc_common import DTC_QUERY_SOUND
+import common_path  # noqa: E402,F401
+from dtc_common import DTC_QUERY_SOUND  # noqa: E402
+from node_profiler import NodeProfiler, profile_stats  # noqa: E402
 
 AUDIO_OUTPUT_ROOT = Path(__file__).parent / 'dtc_report' / 'audio'
 VIDEO_OUTPUT_ROOT = Path(__file__).parent / 'dtc_report' / 'video'
 
+# TODO get audio_info directly from source Node
+AUDIO_CHANNELS = 1
+AUDIO_SAMPLE_WIDTH = 2
+AUDIO_RATE = 44100
+
+POSE_MODEL_PATH = 'models/yolo11n-pose.onnx'  # parametrize?
+
+# heavy modules and models are loaded lazily (in background after node start),
+# time of each import/load is collected for the startup report
+STARTUP_TIMES = {}
+
+speech_service = None  # one per process, the Whisper model is loaded only once
+fb_main_name = 'detect-and-stream:main'  # external video analysis "module:function", see init_video_analysis()
+fb_main = None  # loaded fb_main_name, see load_fb_main()
+
+
+def timed_import(name):
+    start_time = time.perf_counter()
+    module = importlib.import_module(name)
+    STARTUP_TIMES.setdefault(f'import {name}', time.perf_counter() - start_time)
+    return module
+
+
+def startup_times(keyword):
+    return {name: t for name, t in STARTUP_TIMES.items() if keyword in name}
+
+
+def init_video_analysis(name):
+    """Select external video analysis "module:function" (also initializer of worker processes)"""
+    global fb_main_name, fb_main
+    if name != fb_main_name:
+        fb_main_name, fb_main = name, None
+
+
+def load_fb_main():
+    global fb_main
+    if fb_main is None:
+        module_name, function_name = fb_main_name.split(':')
+        fb_main = getattr(timed_import(module_name), function_name)
+    return fb_main
+
+
+def warm_up_fb_main():
+    """Import video analysis in the worker process, return its startup times"""
+    load_fb_main()
+    return startup_times('detect-and-stream')
+
+
+def warm_up_video_triage():
+    timed_import('video_triage')
+    return startup_times('video_triage')
+
+
+def load_pose_model():
+    yolo = timed_import('ultralytics').YOLO
+    start_time = time.perf_counter()
+    model = yolo(POSE_MODEL_PATH)
+    STARTUP_TIMES['load pose model'] = time.perf_counter() - start_time
+    return model
+
+
+def init_speech_service(model_name):
+    global speech_service
+    speech_service = SpeechService(model_name, sample_rate=AUDIO_RATE, sample_width=AUDIO_SAMPLE_WIDTH, load=False)
+
+
+def load_speech_model():
+    """Load Whisper model, return its startup times"""
+    start_time = time.perf_counter()
+    speech_service.load()
+    return {f'load speech model {speech_service.model_name}': time.perf_counter() - start_time}
+
+
+def transcribe_chunk(pcm):
+    return speech_service.transcribe(pcm)
+
+
+def speech_latency():
+    """Latency histogram of all transcriptions of the speech service (in the worker process)"""
+    return speech_service.latency.to_dict()
+
+
+def fb_value(fb_report, key, values, default):
+    """DTC report value of fb_main() report item, None for unknown item"""
+    if fb_report[key] is None:
+        return None
+    return values.get(fb_report[key], default)
+
+
+class SpeechAnalysis(Sequence):
+    """
+    [is_coherent, text] of speech analysis running in parallel,
+    the access to items waits for the result
+    """
+    def __init__(self, future):
+        self.future = future
+
+    def __getitem__(self, index):
+        return list(self.future.result())[index]
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        if self.future.done():
+            return repr(list(self.future.result()))
+        return '<SpeechAnalysis pending>'
+
+
+class QueueFuture:
+    """
+    Result delivered to the worker process via (manager) queue, with Future-like interface
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.value = None
+
+    def done(self):
+        return self.value is not None
+
+    def result(self):
+        if self.value is None:
+            self.value = self.queue.get()
+        return self.value
+
+
+def triage_casualty(video_triage, speech):
+    """
+    Final aggregation of streaming video triage, the report is compatible with fb_main()
+    """
+    start_time = time.monotonic()
+    fb_report = video_triage.finish(speech)
+    print(f'Video triage {time.monotonic() - start_time:.1f}s')
+    return fb_report
+
+
+def complete_report(fb_report, triage_future):
+    """
+    Report of fb_main() with unknown values (None) taken from the streaming video triage
+    """
+    if fb_report is None or triage_future.exception() is not None:
+        return fb_report
+    stream_report = triage_future.result()
+    return {key: stream_report.get(key) if value is None else value for key, value in fb_report.items()}
+
+
+def analyze_casualty(speech, video_filename, debug=False):
+    """
+    Video analysis of one recorded casualty, executed in the worker process
+    The speech is transcribed in parallel (during recording) and fb_main gets its result
+    [is_coherent, text] via future-like `speech`.
+    Returns fb_report and profiler statistics of the video analysis
+    """
+    start_time = time.monotonic()
+    with Profile() as profile:
+        fb_report = load_fb_main()(video_filename, SpeechAnalysis(speech), debug=debug)
+    print(f'Video analysis {time.monotonic() - start_time:.1f}s')
+    return fb_report, profile_stats(profile)
+
 
 class Doctor(Node):
     def __init__(self, config, bus):
         super().__init__(config, bus)
-        bus.register('report', 'lora_report', 'audio_analysis', 'debug_profiler')
+        bus.register('report', 'lora_report', 'audio_analysis', 'speech_latency', 'debug_profiler',
+                     'ready')  # startup report when all models are loaded
         self.system_name = config.get('env', {}).get('OSGAR_LOGS_PREFIX', 'm01-')
         self.is_scanning = False
         self.is_playing = False
         self.report_index = 0
         self.wav_fd = None
+        self.transcription = None
         self.h265_fd = None
         self.key_frame_detected = False
         AUDIO_OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
         VIDEO_OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
-        self.onnx_model = YOLO('models/yolo11n-pose.onnx')  # parametrize?
+        self._pose_model = None  # loaded on demand, see pose_model()
+        self.pose_model_lock = Lock()
         self.verbose = False  # TODO move to Node default
         self.last_location = None
+        # analysis of recorded casualties runs in worker processes, 0 = inside bus callback
+        self.analysis_workers = config.get('analysis_workers', 1)
+        self.max_pending_jobs = config.get('max_pending_jobs', 2)
+        self.executor = None
+        self.pending_jobs = set()
+        self.pending_lock = Lock()
+        self.manager = None
+        self.speech_executor = None
+        self.speech_model = config.get('speech_model', 'base.en')
+        self.speech_chunk_sec = config.get('speech_chunk_sec', 3.0)
+        # worker processes are not forked from the multi-threaded node process by default
+        self.mp_context = multiprocessing.get_context(config.get('mp_start_method', 'spawn'))
+        self.fb_main_name = config.get('fb_main', fb_main_name)
+        # 'file' = fb_main() on recorded video file, 'stream' = the same with values unknown to fb_main()
+        # taken from StreamingVideoTriage during scanning
+        self.video_analysis = config.get('video_analysis', 'file')
+        assert self.video_analysis in ['file', 'stream'], self.video_analysis
+        self.archive_video = config.get('archive_video', True) or self.video_analysis == 'file'
+        # streaming triage does not cover all report values, fb_main() needs the archived video
+        assert self.archive_video, 'video_analysis "stream" requires archive_video'
+        self.stream_pose = config.get('stream_pose', False)  # pose model in streaming triage
+        self.video_triage = None
+        self.triage_executor = None
+        self.loader = None  # background loading in node process
+        self.startup_times = {}
+        init_speech_service(self.speech_model)
+        init_video_analysis(self.fb_main_name)
+        self.profiler = NodeProfiler.from_config(self, config)  # optional "profile" of on_* handlers
+
+    def pose_model(self):
+        with self.pose_model_lock:
+            if self._pose_model is None:
+                self._pose_model = load_pose_model()
+            return self._pose_model
+
+    def warm_up_pose_model(self):
+        self.pose_model()
+        return {**startup_times('ultralytics'), **startup_times('pose model')}
 
-    def publish_report(self, fb_report):
-        assert self.last_location is not None
+    def publish_report(self, fb_report, report_index=None, location=None):
+        if report_index is None:
+            report_index = self.report_index
+        if location is None:
+            location = self.last_location
+        assert location is not None
         if fb_report is None:
             return  # probably false detection -> no report
-        r = DTCReport(self.system_name, self.last_location['lat'], self.last_location['lon'])
-        r.severe_hemorrhage = 0 if fb_report['Severe Hemorrhage'] == 'Absent' else 1
-        r.respiratory_distress = 0 if fb_report['Respiratory Distress'] == 'Absent' else 1
+        r = DTCReport(self.system_name, location['lat'], location['lon'])
+        # unknown values (None) are not reported
+        r.severe_hemorrhage = fb_value(fb_report, 'Severe Hemorrhage', {'Absent': 0}, 1)
+        r.respiratory_distress = fb_value(fb_report, 'Respiratory Distress', {'Absent': 0}, 1)
         r.hr = fb_report['Heart Rate']
         r.rr = fb_report['Respiratory Rate']
-        r.trauma_head = 0 if fb_report['Head'] == 'Normal' else 1
-        r.trauma_torso = 0 if fb_report['Torso'] == 'Normal' else 1
-        r.trauma_lower_ext = 0 if fb_report['Lower Extermities'] == 'Normal' else 1
-        r.trauma_upper_ext = 0 if fb_report['Upper Extermities'] == 'Normal' else 1
-        r.alertness_ocular = 0 if fb_report['Ocular'] == 'Open' else 1
-        r.alertness_motor = 0 if fb_report['Motor'] == 'Normal' else 1 if fb_report['Motor'] == 'Abnormal' else 2
-        r.alertness_verbal = 0 if fb_report['Verbal'] == 'Normal' else 1 if fb_report['Verbal'] == 'Abnormal' else 2
-
-        assert self.report_index > 0, self.report_index
-        r.casualty_id = self.report_index
+        r.trauma_head = fb_value(fb_report, 'Head', {'Normal': 0}, 1)
+        r.trauma_torso = fb_value(fb_report, 'Torso', {'Normal': 0}, 1)
+        r.trauma_lower_ext = fb_value(fb_report, 'Lower Extermities', {'Normal': 0}, 1)
+        r.trauma_upper_ext = fb_value(fb_report, 'Upper Extermities', {'Normal': 0}, 1)
+        r.alertness_ocular = fb_value(fb_report, 'Ocular', {'Open': 0}, 1)
+        r.alertness_motor = fb_value(fb_report, 'Motor', {'Normal': 0, 'Abnormal': 1}, 2)
+        r.alertness_verbal = fb_value(fb_report, 'Verbal', {'Normal': 0, 'Abnormal': 1}, 2)
+
+        assert report_index > 0, report_index
+        r.casualty_id = report_index
         self.publish('lora_report', pack_data(r) + b'\n')
         self.publish('report', r.tojson())
 
+    def publish_analysis(self, report_index, location, result, triage_future=None):
+        fb_report, profiler_stats = result
+        if profiler_stats is not None:
+            self.publish('debug_profiler', profiler_stats)
+        if triage_future is not None:
+            fb_report = complete_report(fb_report, triage_future)
+        self.publish_report(fb_report, report_index, location)
+
+    def on_analysis_done(self, report_index, location, triage_future, future):
+        """
+        Callback of worker process result (called from executor thread)
+        """
+        with self.pending_lock:
+            self.pending_jobs.discard(future)
+        if future.exception() is not None:
+            print(f'Analysis of casualty {report_index} failed: {future.exception()!r}')
+            return
+        self.publish_analysis(report_index, location, future.result(), triage_future)
+
+    def on_speech_done(self, report_index, start_time, future):
+        """
+        Callback of complete transcription (called from executor thread)
+        """
+        print(f'Speech analysis {report_index} {time.monotonic() - start_time:.1f}s after scanning')
+        self.publish('audio_analysis', list(future.result()))
+
+    def on_speech_latency(self, future):
+        """
+        Callback of speech latency histogram (called from executor thread)
+        """
+        if future.exception() is not None:
+            print(f'Speech latency failed: {future.exception()!r}')
+            return
+        self.publish('speech_latency', future.result())
+
+    def create_executors(self):
+        if self.speech_executor is not None:
+            return
+        if self.analysis_workers == 0:
+            self.speech_executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            # dedicated process with loaded Whisper model for transcription of audio chunks
+            self.speech_executor = ProcessPoolExecutor(max_workers=1, mp_context=self.mp_context,
+                                                       initializer=init_speech_service,
+                                                       initargs=(self.speech_model,))
+            self.executor = ProcessPoolExecutor(max_workers=self.analysis_workers, mp_context=self.mp_context,
+                                                initializer=init_video_analysis, initargs=(self.fb_main_name,))
+            self.manager = self.mp_context.Manager()
+
+    def submit_speech_chunk(self, pcm):
+        self.create_executors()
+        return self.speech_executor.submit(transcribe_chunk, pcm)
+
+    def submit_speech_latency(self):
+        """Histogram is read after all chunks of the casualty, the speech worker runs jobs in order"""
+        self.create_executors()
+        self.speech_executor.submit(speech_latency).add_done_callback(self.on_speech_latency)
+
+    def submit_analysis(self, speech_future, video_filename, triage_future=None):
+        """
+        :param triage_future: optional Future of StreamingVideoTriage report completing fb_main() report
+        """
+        report_index, location = self.report_index, self.last_location
+        if self.analysis_workers == 0 or self.verbose:
+            self.publish_analysis(report_index, location,
+                                  analyze_casualty(speech_future, video_filename, debug=self.verbose), triage_future)
+            return
+        self.create_executors()
+        while True:
+            # bounded queue - wait for the oldest analysis to finish
+            with self.pending_lock:
+                pending = list(self.pending_jobs)
+            if len(pending) < self.max_pending_jobs:
+                break
+            print(self.time, f'Waiting for {len(pending)} pending analysis jobs')
+            wait(pending, return_when=FIRST_COMPLETED)
+        speech_queue = self.manager.Queue(1)
+        speech_future.add_done_callback(lambda f: speech_queue.put(list(f.result())))
+        future = self.executor.submit(analyze_casualty, QueueFuture(speech_queue), video_filename)
+        with self.pending_lock:
+            self.pending_jobs.add(future)
+        future.add_done_callback(partial(self.on_analysis_done, report_index, location, triage_future))
+
+    def submit_triage(self, speech_future):
+        """Return Future of StreamingVideoTriage report or None if there was no video"""
+        video_triage, self.video_triage = self.video_triage, None
+        if video_triage is None:
+            print(self.time, f'No video of casualty {self.report_index}')
+            return None
+        if self.triage_executor is None:
+            self.triage_executor = ThreadPoolExecutor(max_workers=1)
+        return self.triage_executor.submit(triage_casualty, video_triage, speech_future)
+
+    def show_pose(self, video_filename):
+        import cv2
+        cap = cv2.VideoCapture(video_filename)
+        while True:
+            ret, frame = cap.read()
+            if ret == 0:
+                break
+            results = self.pose_model()(frame)
+#            print(results[0].keypoints)
+            kpts = results[0].keypoints.xy.detach().cpu().numpy()[0]
+            pose_w_id = results[0].plot()
+            cv2.imshow(f'video{self.report_index}.h265', pose_w_id)  #frame)
+            cv2.waitKey(100)
+        cap.release()
+
     def on_report_latlon(self, data):
         """
         initial lat, lon position of the report
@@ -81,50 +399,37 @@ class Doctor(Node):
             self.report_index += 1
             assert self.wav_fd is None
             self.wav_fd = wave.open(str(AUDIO_OUTPUT_ROOT / f'audio{self.report_index}.wav'), 'wb')
-            # TODO get audio_info directly from source Node
-            channels = 1
-            sample_width = 2
-            rate = 44100
-            self.wav_fd.setnchannels(channels)
-            self.wav_fd.setsampwidth(sample_width)
-            self.wav_fd.setframerate(rate)
+            self.wav_fd.setnchannels(AUDIO_CHANNELS)
+            self.wav_fd.setsampwidth(AUDIO_SAMPLE_WIDTH)
+            self.wav_fd.setframerate(AUDIO_RATE)
+            self.transcription = StreamingTranscription(self.submit_speech_chunk, sample_rate=AUDIO_RATE,
+                                                        sample_width=AUDIO_SAMPLE_WIDTH,
+                                                        chunk_sec=self.speech_chunk_sec)
             self.is_playing = True  # playing trigger moved to dtc.py
 
             assert self.h265_fd is None
-            self.h265_fd = open(VIDEO_OUTPUT_ROOT / f'video{self.report_index}.h265', 'wb')
+            if self.archive_video:
+                self.h265_fd = open(VIDEO_OUTPUT_ROOT / f'video{self.report_index}.h265', 'wb')
+            self.video_triage = None
             self.key_frame_detected = False
 
         if self.is_scanning and not data:
             assert self.wav_fd is not None
             self.wav_fd.close()
             self.wav_fd = None
-            assert self.h265_fd is not None
-            self.h265_fd.close()
-            self.h265_fd = None
+            if self.h265_fd is not None:
+                self.h265_fd.close()
+                self.h265_fd = None
             filename = str(VIDEO_OUTPUT_ROOT / f'video{self.report_index}.h265')
-
-            is_coherent, text = is_coherent_speech(str(AUDIO_OUTPUT_ROOT / f'audio{self.report_index}.wav'))
-            self.publish('audio_analysis', [is_coherent, text])
-
-            with Profile() as profile:
-                fb_report = fb_main(filename, [is_coherent, text], debug=self.verbose)
-            s = StringIO()
-            Stats(profile, stream=s).strip_dirs().sort_stats(SortKey.CUMULATIVE).print_stats(10)
-            self.publish('debug_profiler', s.getvalue())
-            if self.verbose:
-                cap = cv2.VideoCapture(str(VIDEO_OUTPUT_ROOT / f'video{self.report_index}.h265'))
-                while True:
-                    ret, frame = cap.read()
-                    if ret == 0:
-                        break
-                    results = self.onnx_model(frame)
-#                    print(results[0].keypoints)
-                    kpts = results[0].keypoints.xy.detach().cpu().numpy()[0]
-                    pose_w_id = results[0].plot()
-                    cv2.imshow(f'video{self.report_index}.h265', pose_w_id)  #frame)
-                    cv2.waitKey(100)
-                cap.release()
-            self.publish_report(fb_report)
+            # only the last audio chunk remains to be transcribed
+            speech_future = self.transcription.finish()
+            speech_future.add_done_callback(partial(self.on_speech_done, self.report_index, time.monotonic()))
+            self.submit_speech_latency()
+            self.transcription = None
+            triage_future = self.submit_triage(speech_future) if self.video_analysis == 'stream' else None
+            self.submit_analysis(speech_future, filename, triage_future)
+            if self.verbose and self.archive_video:
+                self.show_pose(filename)
 
         self.is_scanning = data
 
@@ -135,18 +440,25 @@ class Doctor(Node):
         if self.is_scanning and not self.is_playing:
             assert self.wav_fd is not None
             self.wav_fd.writeframes(data)
+            self.transcription.add(data)
 
     def on_h265_video(self, data):
         """
         Collect H.265 data during scanning period
         """
         if self.is_scanning:
-            assert self.h265_fd is not None
             if not self.key_frame_detected:
-                self.key_frame_detected =  (data.startswith(bytes.fromhex('00000001 0950')) or
-                                            data.startswith(bytes.fromhex('00000001 460150')))
+                is_h264 = data.startswith(bytes.fromhex('00000001 0950'))
+                self.key_frame_detected = is_h264 or data.startswith(bytes.fromhex('00000001 460150'))
+                if self.key_frame_detected and self.video_analysis == 'stream':
+                    from video_triage import StreamingVideoTriage
+                    self.video_triage = StreamingVideoTriage('h264' if is_h264 else 'hevc',
+                                                             pose_model=self.pose_model() if self.stream_pose else None)
             if self.key_frame_detected:
-                self.h265_fd.write(data)
+                if self.h265_fd is not None:
+                    self.h265_fd.write(data)
+                if self.video_triage is not None:
+                    self.video_triage.feed(data)
 
     def on_playing(self, data):
         name, status = data
@@ -154,6 +466,66 @@ class Doctor(Node):
             self.is_playing = status
         # ... but maybe we would like to track also playing other sounds??
 
+    def start_loading(self):
+        """
+        Load models in background at node start and not with the first casualty,
+        'ready' is published with startup times when all are loaded
+        """
+        self.startup_times = dict(STARTUP_TIMES)
+        self.create_executors()
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        start_time = time.perf_counter()
+        futures = [self.speech_executor.submit(load_speech_model)]
+        if self.executor is not None:
+            futures.append(self.executor.submit(warm_up_fb_main))
+        else:
+            futures.append(self.loader.submit(warm_up_fb_main))
+        if self.video_analysis == 'stream':
+            futures.append(self.loader.submit(warm_up_video_triage))
+        if self.verbose or self.stream_pose:
+            futures.append(self.loader.submit(self.warm_up_pose_model))
+        remaining = [len(futures)]
+        lock = Lock()
+
+        def on_loaded(future):
+            if future.exception() is not None:
+                print(f'Startup loading failed: {future.exception()!r}')
+            else:
+                self.startup_times.update(future.result())
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            self.startup_times['ready'] = time.perf_counter() - start_time
+            for name, t in self.startup_times.items():
+                print(f'  {name}: {t:.2f}s')
+            self.publish('ready', self.startup_times)
+
+        for future in futures:
+            future.add_done_callback(on_loaded)
+
+    def run(self):
+        self.start_loading()
+        try:
+            while True:
+                self.update()
+        except BusShutdownException:
+            pass
+        finally:
+            # finish analysis of already recorded casualties
+            if self.speech_executor is not None:
+                self.speech_executor.shutdown(wait=True)
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            if self.triage_executor is not None:
+                self.triage_executor.shutdown(wait=True)
+            if self.loader is not None:
+                self.loader.shutdown(wait=True)
+            if self.manager is not None:
+                self.manager.shutdown()
+
+
+STARTUP_TIMES['import doctor'] = time.perf_counter() - _import_start_time
 
 if __name__ == "__main__":
     pass
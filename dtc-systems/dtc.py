@@ -11,13 +11,18 @@ from osgar.node import Node
 from osgar.bus import BusShutdownException
 from osgar.lib.mathex import normalizeAnglePIPI
 from osgar.followme import EmergencyStopException  # hard to believe! :(
+import common_path  # noqa: F401
 from geofence import Geofence
-from report import DTCReport, normalize_matty_name, pack_data
+from depth_scan import DepthScan
+from waypoints import Waypoints
+from report import BeaconEncoder, normalize_matty_name
 from dtc_common import DTC_QUERY_SOUND
+from vad import VoiceActivityDetector, ScanDwell
+from node_profiler import NodeProfiler
 
 MAX_CMD_HISTORY = 100  # beware of dependency on pose2d update
 
-SCANNING_TIME_SEC = 13  # 8s talking 5s listening
+SCANNING_TIME_SEC = 13  # 8s talking 5s listening, fixed duration without audio
 
 LEFT_LED_INDEX = 1  # to be moved into matty.py
 RIGHT_LED_INDEX = 0  # to be moved into matty.py
@@ -62,10 +67,12 @@ class DARPATriageChallenge(Node):
         self.max_speed = config.get('max_speed', 0.2)
         self.turn_angle = config.get('turn_angle', 20)
         self.horizon = config.get('horizon', 200)
-        self.waypoints = config.get('waypoints', [])[1:]  # remove start
+        self.depth_scan = DepthScan(horizon=self.horizon)
+        self.waypoints = Waypoints(config.get('waypoints', [])[1:])  # remove start
         self.debug_all_waypoints = config.get('waypoints', [])[:]
         self.raise_exception_on_stop = config.get('terminate_on_stop', True)
         self.system_name = config.get('env', {}).get('OSGAR_LOGS_PREFIX', 'm01-')
+        self.beacon_encoder = BeaconEncoder(self.system_name)
 
         self.geofence = None
         # try system specific geofence
@@ -74,7 +81,8 @@ class DARPATriageChallenge(Node):
             # if not available use common geofence
             geofence_lat_lon = config.get('geofence')
         if geofence_lat_lon is not None:
-            self.geofence = Geofence(geofence_lat_lon)
+            self.geofence = Geofence(geofence_lat_lon,
+                                     distance_field_resolution=config.get('geofence_resolution'))  # meters or None
             if len(self.waypoints) == 0:
                 pt = self.geofence.get_random_inner_waypoint()
                 print(f'Adding RND waypoint {pt}')
@@ -92,6 +100,13 @@ class DARPATriageChallenge(Node):
         self.field_of_view = math.radians(45)  # TODO, should clipped camera image pass it?
         self.report_dist = config.get('report_dist', 2.0)
         self.is_scanning_person = False
+        # scan duration adapted to the casualty response, if audio is available
+        self.adaptive_scan = config.get('adaptive_scan', True)
+        self.vad = VoiceActivityDetector()
+        self.scan_dwell = ScanDwell(min_sec=config.get('min_scan_sec', 10), max_sec=config.get('max_scan_sec', 20),
+                                    fixed_sec=SCANNING_TIME_SEC)
+        self.audio_available = False
+        self.scan_duration = timedelta(seconds=SCANNING_TIME_SEC)
 
         self.closest_waypoint = None
         self.closest_waypoint_dist = None
@@ -102,6 +117,7 @@ class DARPATriageChallenge(Node):
         self.look_around = False  # in case of blocked path look left and right and pick direction
         self.cmd_history = []
         self.status_ready = False
+        self.profiler = NodeProfiler.from_config(self, config)  # optional "profile" of on_* handlers
 
     def send_speed_cmd(self, speed, steering_angle):
         self.cmd_history.append((speed, steering_angle))
@@ -186,25 +202,28 @@ class DARPATriageChallenge(Node):
                 self.backup_start_time = None  # end of collision
 
         if self.report_start_time is not None:
+            # audio stopped during adaptive scan -> fixed duration
+            self.scan_finished(self.scan_dwell.check_audio(self.time.total_seconds()))
             # report via stop 3s
-            if self.time - self.report_start_time < timedelta(seconds=SCANNING_TIME_SEC):
+            if self.time - self.report_start_time < self.scan_duration:
                 self.send_speed_cmd(0, 0)
                 return  # terminate without other driving
-            elif self.time - self.report_start_time < timedelta(seconds=SCANNING_TIME_SEC + 2):
+            elif self.time - self.report_start_time < self.scan_duration + timedelta(seconds=2):
                 self.send_speed_cmd(-0.25, 0)
                 return  # reverse 0.5m
-            elif self.time - self.report_start_time < timedelta(seconds=SCANNING_TIME_SEC + 4):
+            elif self.time - self.report_start_time < self.scan_duration + timedelta(seconds=4):
                 # experimental - use also backup data collection
                 if self.is_scanning_person:
                     self.is_scanning_person = False
                     self.publish('scanning_person', self.is_scanning_person)
                 self.send_speed_cmd(0.2, math.radians(-45))  # turn right
                 return  # reverse 0.5m
-            elif self.time - self.report_start_time < timedelta(seconds=SCANNING_TIME_SEC + 9):
+            elif self.time - self.report_start_time < self.scan_duration + timedelta(seconds=9):
                 # ignore detections for a moment (10s)
                 pass  # waypoints no longer correspond to cones/expected locations of objects
             else:
                 self.report_start_time = None  # end of report
+                self.scan_duration = timedelta(seconds=SCANNING_TIME_SEC)
 
         if self.scan is None:
             # no depth data yet
@@ -229,6 +248,9 @@ class DARPATriageChallenge(Node):
                             and self.report_start_time is None):
                         print(self.time, 'SCANNING PERSON started', y1, y2, self.last_cones_distances[best])
                         self.report_start_time = self.time
+                        if self.adaptive_scan and self.audio_available:
+                            self.scan_duration = timedelta(seconds=self.scan_dwell.max_sec)
+                            self.scan_dwell.start(self.time.total_seconds())
                         report = {
                             'lat' : self.last_position[0] if self.last_position is not None else None,
                             'lon': self.last_position[1] if self.last_position is not None else None,
@@ -245,14 +267,15 @@ class DARPATriageChallenge(Node):
             # GPS hacking
             if self.last_position is not None and self.gps_heading is not None and self.closest_waypoint_dist is not None:
                 if self.closest_waypoint_dist > 5:
-                    to_waypoint = geo_angle(latlon2xy(*self.last_position), latlon2xy(*self.waypoints[self.closest_waypoint]))
+                    to_waypoint = self.waypoints.bearing(self.last_position, self.closest_waypoint)
                     diff_angle = normalizeAnglePIPI(to_waypoint - self.gps_heading)
                     if steering_angle == 0:
                         steering_angle = math.copysign(math.radians(10), diff_angle)
                 else:
                     if self.geofence is not None:
                         # remove the closest waypoint and generate new one
-                        self.waypoints = [self.geofence.get_random_inner_waypoint()]
+                        self.waypoints.clear()
+                        self.waypoints.append(self.geofence.get_random_inner_waypoint())
                         print('New waypoints', self.waypoints)
 
         if steering_angle is None:
@@ -265,6 +288,24 @@ class DARPATriageChallenge(Node):
             # TODO refactoring - otherwise lookaround conflicts with other commands
             self.send_speed_cmd(speed, steering_angle)
 
+    def on_audio(self, data):
+        self.audio_available = True
+        is_speech = self.vad.process(data)
+        if self.scan_dwell.is_active():
+            self.scan_finished(self.scan_dwell.update(self.time.total_seconds(), is_speech))
+
+    def scan_finished(self, reason):
+        """Set duration of the current scan when ScanDwell returned end reason"""
+        if reason is not None:
+            self.scan_duration = self.time - self.report_start_time
+            print(self.time, f'SCANNING PERSON finished after {self.scan_duration.total_seconds():.1f}s '
+                             f'({reason}), {self.scan_dwell.stats()}')
+
+    def on_playing(self, data):
+        name, status = data
+        if name == DTC_QUERY_SOUND and not status and self.scan_dwell.is_active():
+            self.scan_dwell.playing_finished(self.time.total_seconds())
+
     def on_nmea_data(self, data):
         assert 'lat' in data, data
         assert 'lon' in data, data
@@ -278,8 +319,8 @@ class DARPATriageChallenge(Node):
             matty_name = normalize_matty_name(self.system_name)
             if int(round(float(utc_time))) % 10 == int(matty_name[-1]):
                 # per system every 10s
-                empty_report = DTCReport(matty_name, lat, lon)
-                self.publish('lora_latlon', pack_data(empty_report) + b'\n')  # extra '\n' required by crypt
+                beacon = self.beacon_encoder.encode(lat, lon)
+                self.publish('lora_latlon', beacon + b'\n')  # extra '\n' required by crypt
         if lat is not None and lon is not None:
             border_dist = None
             if self.geofence is not None:
@@ -289,16 +330,10 @@ class DARPATriageChallenge(Node):
             p = lat, lon
             if self.verbose:
                 self.debug_arr.append((self.time, p, self.gps_heading, self.yaw))
-            best_i, best_dist  = None, None
-            for i, waypoint in enumerate(self.waypoints):
-                dist = geo_length(latlon2xy(*p), latlon2xy(*waypoint))
-                if best_dist is None or best_dist > dist:
-                    best_i = i
-                    best_dist = dist
+            best_i, best_dist = self.waypoints.nearest(p)
             if self.closest_waypoint != best_i:
                 print(f'{self.time} ----- Switching to {best_i} at {best_dist} -----')
-                for i, waypoint in enumerate(self.waypoints):
-                    dist = geo_length(latlon2xy(*p), latlon2xy(*waypoint))
+                for i, (waypoint, dist) in enumerate(zip(self.waypoints, self.waypoints.distances(p))):
                     print(i, waypoint, dist)
                 print(f'{self.time} ----------------------')
             self.last_position = p
@@ -309,16 +344,7 @@ class DARPATriageChallenge(Node):
         self.last_detections = [det for det in data if det[0] == 'person']
 
     def on_depth(self, data):
-        data = data.copy()
-        line = self.horizon - 30
-        line_end = self.horizon + 30
-        box_width = 160
-        arr = []
-        for index in range(0 , 641 - box_width, 20):
-            mask = data[line:line_end, index:box_width + index] == 0
-            data[line:line_end, index:box_width + index][mask] = 10000 # 10m
-            dist = int(np.percentile( data[line:line_end, index:box_width + index], 5))
-            arr.append(dist)
+        arr = self.depth_scan.scan(data)
         self.publish('scan', arr)
         self.scan = arr
 
@@ -463,7 +489,7 @@ class DARPATriageChallenge(Node):
         ax.add_collection(lc)
 
         radius = 0.0001
-        for c in self.waypoints + self.debug_all_waypoints:
+        for c in list(self.waypoints) + self.debug_all_waypoints:
             circle = Circle([c[1], c[0]], radius, fill=False, edgecolor='r', linestyle='--')
             ax.add_patch(circle)
             ax.set_aspect('equal')
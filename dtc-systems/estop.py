@@ -1,6 +1,8 @@
 """
   DARPA E-stop Tier level 2
 """
+from datetime import timedelta
+
 from osgar.node import Node
 from osgar.bus import BusShutdownException
 
@@ -9,44 +11,115 @@ NORMAL_OPERATION_PACKET = bytes([0x7E, 0x00, 0x0B, 0x88, 0x01, 0x49, 0x53, 0x00,
                                  0x01, 0x00, 0x02, 0x00, 0x00, 0x00, 0xD7])
 EMERGENCY_STOP_PACKET = bytes([0x7E, 0x00, 0x0B, 0x88, 0x01, 0x49, 0x53, 0x00,
                                0x01, 0x00, 0x02, 0x00, 0x00, 0x02, 0xD5])
-HEADER = bytes([0x7E, 0x00, 0x0B, 0x88, 0x01, 0x49, 0x53])
-PACKET_SIZE = 15  # including header and checksum
+START_DELIMITER = 0x7E
+AT_IS_RESPONSE = bytes([0x88, 0x01, 0x49, 0x53])  # AT command response, frame ID 1, "IS"
+AT_IS_RESPONSE_SIZE = 11  # frame data only, without delimiter, length and checksum
+EMERGENCY_STOP_STATUS = 0x02
+MAX_FRAME_SIZE = 32  # frame data limit, the largest frames on this link are MASTER_STOP (16) and AT IS response (11)
 
 MASTER_STOP = bytes.fromhex('7E 00 10 17 01 00 00 00 00 00 00 FF FF FF FE 03 44 31 05 6F')
 
+# parser states
+WAIT_START, LENGTH_MSB, LENGTH_LSB, FRAME_DATA, CHECKSUM = range(5)
+
+
+class XBeeFrameParser:
+    """
+    Streaming parser of XBee API frames (0x7E, 16bit length, frame data, checksum).
+    Incomplete frames are kept in the parser state between calls. A frame with length over
+    MAX_FRAME_SIZE or with invalid checksum is dropped and the bytes after its delimiter are
+    scanned again, so a noise 0x7E cannot hide the following valid frames.
+    """
+    def __init__(self):
+        self.state = WAIT_START
+        self.length = 0
+        self.frame = bytearray()
+        self.raw = bytearray()  # bytes after the start delimiter of the current frame
+        self.checksum_errors = 0
+        self.length_errors = 0
+
+    def feed(self, data):
+        """Return list of frame data (without delimiter, length and checksum) completed by data"""
+        frames = []
+        pending = bytearray(data)
+        i = 0
+        while i < len(pending):
+            b = pending[i]
+            i += 1
+            if self.state == WAIT_START:
+                if b == START_DELIMITER:
+                    self.state = LENGTH_MSB
+                    self.raw = bytearray()
+                continue
+            self.raw.append(b)
+            if self.state == LENGTH_MSB:
+                self.length = b << 8
+                self.state = LENGTH_LSB
+            elif self.state == LENGTH_LSB:
+                self.length |= b
+                self.frame = bytearray()
+                if self.length > MAX_FRAME_SIZE:
+                    self.length_errors += 1
+                    pending[i:i] = self.raw  # rescan from the next delimiter
+                    self.state = WAIT_START
+                else:
+                    self.state = FRAME_DATA if self.length > 0 else WAIT_START
+            elif self.state == FRAME_DATA:
+                self.frame.append(b)
+                if len(self.frame) == self.length:
+                    self.state = CHECKSUM
+            else:
+                assert self.state == CHECKSUM, self.state
+                if (sum(self.frame) + b) & 0xFF == 0xFF:
+                    frames.append(bytes(self.frame))
+                else:
+                    self.checksum_errors += 1
+                    pending[i:i] = self.raw  # rescan from the next delimiter
+                self.state = WAIT_START
+        return frames
+
 
 class EStop(Node):
     def __init__(self, config, bus):
         super().__init__(config, bus)
         bus.register('emergency_stop', 'raw')
-        self._buf = b''
         self.master = config.get('master', False)
+        self.heartbeat_period = timedelta(seconds=config.get('heartbeat_period', 1.0))
+        self.parser = XBeeFrameParser()
+        self.last_heartbeat_time = None
+        self.last_status_time = None  # last E-stop response with normal operation status
+        self.stop_latency = None
+
+    def send_heartbeat(self):
+        self.last_heartbeat_time = self.time
+        if self.master:
+            self.publish('raw', MASTER_STOP)
+        else:
+            self.publish('raw', ATIS_FRAME_PACKET)
+
+    def on_tick(self, data):
+        if self.last_heartbeat_time is None or self.time - self.last_heartbeat_time >= self.heartbeat_period:
+            self.send_heartbeat()
 
     def on_raw(self, data):
-        self._buf += data
-        packet = None
-        while HEADER in self._buf and self._buf.index(HEADER) + PACKET_SIZE <= len(self._buf):
-            i = self._buf.index(HEADER)
-            packet = self._buf[i:i+PACKET_SIZE]
-            self._buf = self._buf[i+PACKET_SIZE:]       
-
-        if packet is not None:
-            print('packet:', len(packet), packet.hex())
-            if packet[-2] == 0x02:
+        for frame in self.parser.feed(data):
+            if len(frame) != AT_IS_RESPONSE_SIZE or not frame.startswith(AT_IS_RESPONSE):
+                continue
+            if self.verbose:
+                print('frame:', len(frame), frame.hex())
+            if frame[-1] == EMERGENCY_STOP_STATUS:
+                # the button was pressed after the last normal status - upper bound of stop latency
+                if self.last_status_time is not None:
+                    self.stop_latency = (self.time - self.last_status_time).total_seconds()
+                print(self.time, 'E-stop, latency <=', self.stop_latency)
                 self.publish('emergency_stop', True)
                 self.request_stop()
-            self.sleep(1.0)
-            if self.master:
-                self.publish('raw', MASTER_STOP)
-            else:
-                self.publish('raw', ATIS_FRAME_PACKET)
+                return
+            self.last_status_time = self.time
 
     def run(self):
         try:
-            if self.master:
-                self.publish('raw', MASTER_STOP)
-            else:
-                self.publish('raw', ATIS_FRAME_PACKET)
+            self.send_heartbeat()
             while True:
                 self.update()
         except BusShutdownException:
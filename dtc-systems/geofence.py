@@ -1,22 +1,66 @@
 import math
-from random import Random
 
 import numpy as np
+import shapely
 from shapely.geometry import Point, Polygon
-from shapely.ops import nearest_points
+from shapely.geometry.polygon import orient
+from shapely.ops import nearest_points, polylabel
+
+
+def triangulate_polygon(polygon):
+    """
+    Ear clipping triangulation of a simple polygon without holes.
+
+    Args:
+        polygon (Polygon): Simple polygon.
+
+    Returns:
+        np.ndarray: K x 3 x 2 array of triangle vertices.
+    """
+    pts = np.array(orient(polygon, sign=1.0).exterior.coords)[:-1]  # counter-clockwise, without closing point
+
+    def cross(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+    indices = list(range(len(pts)))
+    triangles = []
+    while len(indices) > 3:
+        for k in range(len(indices)):
+            i0, i1, i2 = indices[k - 1], indices[k], indices[(k + 1) % len(indices)]
+            a, b, c = pts[i0], pts[i1], pts[i2]
+            area2 = cross(a, b, c)
+            if abs(area2) < 1e-9:
+                del indices[k]  # collinear vertex
+                break
+            if area2 < 0:
+                continue  # reflex vertex
+            others = [j for j in indices if j not in (i0, i1, i2)]
+            if any(cross(a, b, pts[j]) >= 0 and cross(b, c, pts[j]) >= 0 and cross(c, a, pts[j]) >= 0
+                   for j in others):
+                continue  # another vertex inside the ear
+            triangles.append((a, b, c))
+            del indices[k]
+            break
+        else:
+            break  # degenerate polygon (self-intersection)
+    if len(indices) == 3 and abs(cross(*pts[indices])) >= 1e-9:
+        triangles.append(tuple(pts[indices]))
+    return np.array(triangles, dtype=np.float64).reshape(-1, 3, 2)
 
 class Geofence:
     """
     A class to represent a geofence polygon and calculate distances to its border.
     
-    This version uses a self-contained Haversine formula for distance calculation,
-    removing the dependency on the geopy library.
+    The polygon is projected once into a local metric frame (x east, y north in meters)
+    and distances are computed there with prepared geometry. Optionally a signed-distance
+    raster of the fence is precomputed for O(1) lookups.
+    The self-contained Haversine formula is kept for reference (border_dist_haversine).
     """
 
     # Earth's mean radius in meters
     EARTH_RADIUS_METERS = 6371 * 1000
 
-    def __init__(self, coordinates):  # : list[list[float]]
+    def __init__(self, coordinates, distance_field_resolution=None):  # : list[list[float]]
         """
         Initializes the Geofence object.
 
@@ -24,13 +68,73 @@ class Geofence:
             coordinates (list[list[float]]): A list of [latitude, longitude] pairs
                                              in degrees that define the polygon's
                                              vertices in order.
+            distance_field_resolution (float): Optional raster cell size in meters
+                                               for precomputed signed distances.
         """
         if not coordinates or len(coordinates) < 3:
             raise ValueError("A polygon must have at least 3 points.")
 
         self.polygon_coords_lon_lat = [(lon, lat) for lat, lon in coordinates]
         self.geofence_poly = Polygon(self.polygon_coords_lon_lat)
-        self.random = Random(0).random  # internal random generator with seed
+        self.rng = np.random.default_rng(0)  # internal random generator with seed
+        self.samplers = {}  # min_dist_from_border -> (triangles, cumulative area weights)
+
+        # local metric frame with origin in the polygon centroid
+        self.origin_lon_lat = self.geofence_poly.centroid.x, self.geofence_poly.centroid.y
+        self.meters_per_degree = math.radians(1) * self.EARTH_RADIUS_METERS
+        self.x_scale = math.cos(math.radians(self.origin_lon_lat[1])) * self.meters_per_degree
+        self.poly_xy = Polygon(self.to_xy(coordinates))
+        self.border_xy = self.poly_xy.exterior
+        shapely.prepare(self.poly_xy)
+        shapely.prepare(self.border_xy)
+
+        self.distance_field = None
+        if distance_field_resolution is not None:
+            self.build_distance_field(distance_field_resolution)
+
+    def to_xy(self, positions):
+        """
+        Projects [latitude, longitude] position(s) into the local metric frame.
+
+        Args:
+            positions (array_like): A [latitude, longitude] pair or an array of pairs in degrees.
+
+        Returns:
+            np.ndarray: [x, y] in meters with the same leading shape as the input.
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        x = (positions[..., 1] - self.origin_lon_lat[0]) * self.x_scale
+        y = (positions[..., 0] - self.origin_lon_lat[1]) * self.meters_per_degree
+        return np.stack([x, y], axis=-1)
+
+    def to_lat_lon(self, xy):
+        """
+        Inverse of to_xy(), returns [latitude, longitude] in degrees.
+        """
+        xy = np.asarray(xy, dtype=np.float64)
+        lat = xy[..., 1] / self.meters_per_degree + self.origin_lon_lat[1]
+        lon = xy[..., 0] / self.x_scale + self.origin_lon_lat[0]
+        return np.stack([lat, lon], axis=-1)
+
+    def build_distance_field(self, resolution, margin=None):
+        """
+        Precomputes signed distances on a raster covering the fence.
+
+        Args:
+            resolution (float): Raster cell size in meters.
+            margin (float): Raster extension around the fence in meters.
+        """
+        if margin is None:
+            margin = max(20.0, 10 * resolution)
+        min_x, min_y, max_x, max_y = self.poly_xy.bounds
+        x0, y0 = min_x - margin, min_y - margin
+        cols = int(math.ceil((max_x + margin - x0) / resolution)) + 1
+        rows = int(math.ceil((max_y + margin - y0) / resolution)) + 1
+        grid_x, grid_y = np.meshgrid(x0 + np.arange(cols) * resolution, y0 + np.arange(rows) * resolution)
+        field = self._signed_dist_xy(np.stack([grid_x.ravel(), grid_y.ravel()], axis=-1))
+        self.distance_field = field.reshape(rows, cols)
+        self.distance_field_origin = x0, y0
+        self.distance_field_resolution = resolution
 
     @staticmethod
     def _haversine_distance(pos1, pos2):
@@ -65,10 +169,76 @@ class Geofence:
         distance = Geofence.EARTH_RADIUS_METERS * c
         return distance
 
+    def _signed_dist_xy(self, xy):
+        """Signed distances (positive inside) for array of local [x, y] positions"""
+        dist = shapely.distance(self.border_xy, shapely.points(xy))
+        inside = shapely.contains_xy(self.poly_xy, xy[:, 0], xy[:, 1])
+        return np.where(dist == 0, 0.0, np.where(inside, dist, -dist))
+
+    def _signed_dist_point(self, x, y):
+        """Signed distance for single local position (no numpy overhead)"""
+        dist = self.border_xy.distance(Point(x, y))
+        if dist == 0:
+            return 0.0
+        return dist if shapely.contains_xy(self.poly_xy, x, y) else -dist
+
+    def border_dists(self, positions):
+        """
+        Calculates border distances for an array of positions (batch version of border_dist).
+
+        Args:
+            positions (array_like): N x [latitude, longitude] pairs in degrees.
+
+        Returns:
+            np.ndarray: N distances in meters, positive inside, negative outside and 0 on the border.
+        """
+        xy = self.to_xy(positions).reshape(-1, 2)
+        if self.distance_field is None:
+            return self._signed_dist_xy(xy)
+
+        x0, y0 = self.distance_field_origin
+        rows, cols = self.distance_field.shape
+        col = np.rint((xy[:, 0] - x0) / self.distance_field_resolution).astype(np.int64)
+        row = np.rint((xy[:, 1] - y0) / self.distance_field_resolution).astype(np.int64)
+        in_field = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+        ret = np.empty(len(xy))
+        ret[in_field] = self.distance_field[row[in_field], col[in_field]]
+        if not in_field.all():
+            # far outside of the raster - compute exact values
+            ret[~in_field] = self._signed_dist_xy(xy[~in_field])
+        return ret
+
     def border_dist(self, position):  # : list[float] -> float:
         """
         Calculates the shortest distance from a position to the geofence border.
 
+        Uses the local metric projection, or the distance field raster if it was built
+        (accuracy is then limited by the raster resolution).
+
+        Args:
+            position (list[float]): A [latitude, longitude] pair in degrees.
+
+        Returns:
+            float: The shortest distance to the geofence border in meters.
+                   The value is positive if inside, negative if outside, and 0 on the border.
+        """
+        lat, lon = position
+        x = (lon - self.origin_lon_lat[0]) * self.x_scale
+        y = (lat - self.origin_lon_lat[1]) * self.meters_per_degree
+        if self.distance_field is not None:
+            x0, y0 = self.distance_field_origin
+            col = int(round((x - x0) / self.distance_field_resolution))
+            row = int(round((y - y0) / self.distance_field_resolution))
+            rows, cols = self.distance_field.shape
+            if 0 <= row < rows and 0 <= col < cols:
+                return float(self.distance_field[row, col])
+        return self._signed_dist_point(x, y)
+
+    def border_dist_haversine(self, position):  # : list[float] -> float:
+        """
+        Calculates the shortest distance from a position to the geofence border.
+        Reference implementation with nearest point in degrees and Haversine distance.
+
         Args:
             position (list[float]): A [latitude, longitude] pair in degrees.
 
@@ -92,21 +262,59 @@ class Geofence:
 
         return distance_meters if is_inside else -distance_meters
 
+    def get_sampler(self, min_dist_from_border):
+        """
+        Triangulates the fence shrunk by min_dist_from_border (cached).
+
+        Returns:
+            tuple: (K x 3 x 2 triangles in local meters, K cumulative area weights)
+                   or None if the shrunk fence is empty.
+        """
+        if min_dist_from_border not in self.samplers:
+            inset = self.poly_xy.buffer(-min_dist_from_border, join_style='mitre')
+            parts = getattr(inset, 'geoms', [inset])
+            triangles = [triangulate_polygon(part) for part in parts if not part.is_empty]
+            triangles = np.concatenate(triangles) if len(triangles) > 0 else np.zeros((0, 3, 2))
+            if len(triangles) == 0:
+                self.samplers[min_dist_from_border] = None
+            else:
+                ab, ac = triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+                areas = np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]) / 2
+                self.samplers[min_dist_from_border] = triangles, np.cumsum(areas) / areas.sum()
+        return self.samplers[min_dist_from_border]
+
+    def get_random_inner_waypoints(self, count, min_dist_from_border=2.0):
+        """
+        Get uniformly distributed random points inside geofence
+
+        Args:
+            count (int): Number of waypoints.
+            min_dist_from_border (float): Minimal distance from the fence in meters.
+
+        Returns:
+            list[tuple[float, float]]: List of (latitude, longitude). If the fence is too narrow
+                                       all points are the most inner point of the fence.
+        """
+        sampler = self.get_sampler(min_dist_from_border)
+        if sampler is None:
+            pt = polylabel(self.poly_xy, tolerance=0.1)
+            xy = np.tile([pt.x, pt.y], (count, 1))  # fallback inside fence (lat, lon)
+        else:
+            triangles, weights = sampler
+            index = np.searchsorted(weights, self.rng.random(count), side='right')  # area weighted
+            tri = triangles[np.minimum(index, len(triangles) - 1)]
+            u, v = self.rng.random((2, count))
+            flip = u + v > 1
+            u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+            xy = tri[:, 0] + u[:, None] * (tri[:, 1] - tri[:, 0]) + v[:, None] * (tri[:, 2] - tri[:, 0])
+        return [tuple(pt) for pt in self.to_lat_lon(xy).tolist()]
+
     def get_random_inner_waypoint(self, min_dist_from_border=2.0):
         """
         Get random point inside geofence
-        :return:
-        """
-        bbox = self.geofence_poly.bounds
-        assert len(bbox) == 4, bbox
-        # 14.36, 50.04, 14.52, 50.11
-        for i in range(10):
-            t, u = self.random(), self.random()
-            pt = t * bbox[1] + (1 - t) * bbox[3], u * bbox[0] + (1 - u) * bbox[2]
-            if self.border_dist(pt) > min_dist_from_border:
-                return pt
-        return (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2  # fallback center (lat, lon)
-
+        :return: (lat, lon)
+        """
+        return self.get_random_inner_waypoints(1, min_dist_from_border)[0]
 
 def draw(filename, names):
     import json
@@ -1,8 +1,10 @@
 """
   DTC report structure with pack/unpack for LoRa transmission
-"""
 
-import bitstring
+  The bit fields are packed with shifts and masks of a single Python integer,
+  the original bitstring implementation is kept as reference.
+"""
+import time
 
 
 def normalize_matty_name(nickname):
@@ -93,8 +95,210 @@ class DTCReport:
         return report_json
 
 
+# wire format: (attribute, bits) of optional fields, each preceded by 1 bit presence flag
+OPTIONAL_FIELDS = [
+    ('severe_hemorrhage', 1),
+    ('respiratory_distress', 1),
+    ('hr', 8),
+    ('rr', 6),  # Newborns: 30 to 60 breaths per minute
+    ('trauma_head', 2),
+    ('trauma_torso', 2),
+    ('trauma_lower_ext', 2),
+    ('trauma_upper_ext', 2),
+    ('alertness_ocular', 2),
+    ('alertness_verbal', 2),
+    ('alertness_motor', 2),
+]
+SYSTEM_LETTER = ord('M') - ord('A')
+LATLON_BITS = 32
+LATLON_SCALE = 3_600_000  # milliseconds
+CASUALTY_ID_BITS = 8
+HEADER_BITS = 5 + 3 + 2 * LATLON_BITS + CASUALTY_ID_BITS
+
+
+def _unsigned(value, bits, name):
+    if not 0 <= value < (1 << bits):
+        raise ValueError(f'{name}={value} does not fit into {bits} bits')
+    return value
+
+
+def _signed(value, bits, name):
+    if not -(1 << (bits - 1)) <= value < (1 << (bits - 1)):
+        raise ValueError(f'{name}={value} does not fit into {bits} bits')
+    return value & ((1 << bits) - 1)
+
+
+def _from_signed(value, bits):
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
 def pack_data(report):
     """Packs the data, handling the optional fields"""
+    assert report.system is not None
+    assert len(report.system) >= 3, report.system
+    assert report.system[-3:-1] == 'M0', report.system
+    assert report.system[-1] in ['1', '2', '3', '4', '5'], report.system
+    lat = int(round(report.location_lat * LATLON_SCALE)) if report.location_lat is not None else 0
+    lon = int(round(report.location_lon * LATLON_SCALE)) if report.location_lon is not None else 0
+    casualty_id = report.casualty_id if report.casualty_id is not None else 0
+
+    value = (SYSTEM_LETTER << 3) | int(report.system[-1])
+    value = (value << LATLON_BITS) | _signed(lat, LATLON_BITS, 'location_lat')
+    value = (value << LATLON_BITS) | _signed(lon, LATLON_BITS, 'location_lon')
+    value = (value << CASUALTY_ID_BITS) | _unsigned(casualty_id, CASUALTY_ID_BITS, 'casualty_id')
+    num_bits = HEADER_BITS
+    for name, bits in OPTIONAL_FIELDS:
+        field = getattr(report, name)
+        if field is not None:
+            # If exists, set the flag to 1 and append the data
+            value = (((value << 1) | 1) << bits) | _unsigned(int(field), bits, name)
+            num_bits += 1 + bits
+        else:
+            # If is omitted, just set the flag to 0
+            value <<= 1
+            num_bits += 1
+    pad = -num_bits % 8
+    return (value << pad).to_bytes((num_bits + pad) // 8, 'big')
+
+
+def _unpack(value, total_bits, pos):
+    """Decode report starting at bit `pos` of big integer `value` with `total_bits`, return (report, end bit)"""
+    def read(bits):
+        nonlocal pos
+        pos += bits
+        if pos > total_bits:
+            raise ValueError('Not enough data')
+        return (value >> (total_bits - pos)) & ((1 << bits) - 1)
+
+    def read_signed(bits):
+        return _from_signed(read(bits), bits)
+
+    # Read the mandatory fields
+    letter = read(5)
+    assert letter == SYSTEM_LETTER, letter
+    serial_num = read(3)
+    lat_ms = read_signed(LATLON_BITS)
+    lon_ms = read_signed(LATLON_BITS)
+    report = DTCReport(f'Matty M{serial_num:02}', lat_ms/LATLON_SCALE, lon_ms/LATLON_SCALE)
+    report.casualty_id = read(CASUALTY_ID_BITS)
+    for name, bits in OPTIONAL_FIELDS:
+        # Read the presence flag
+        if read(1):
+            # If the flag is true, read the optional field
+            setattr(report, name, read(bits))
+    return report, pos
+
+
+def unpack_data(packed_bytes):
+    """Safely unpacks the data, checking the presence flag."""
+    report, _ = _unpack(int.from_bytes(packed_bytes, 'big'), 8 * len(packed_bytes), 0)
+    return report
+
+
+def pack_batch(reports):
+    """Packs several reports into one byte string (each report is byte aligned)"""
+    return b''.join(pack_data(report) for report in reports)
+
+
+def unpack_batch(packed_bytes):
+    """Unpacks all reports created by pack_batch()"""
+    value, total_bits = int.from_bytes(packed_bytes, 'big'), 8 * len(packed_bytes)
+    reports = []
+    pos = 0
+    while total_bits - pos >= HEADER_BITS + len(OPTIONAL_FIELDS):
+        report, pos = _unpack(value, total_bits, pos)
+        pos += -pos % 8  # skip padding
+        reports.append(report)
+    return reports
+
+
+# Compact position beacons: absolute keyframe from time to time and small deltas in between.
+# The first 5 bits distinguish them from DTCReport (SYSTEM_LETTER).
+BEACON_KEYFRAME = ord('K') - ord('A')
+BEACON_DELTA = ord('D') - ord('A')
+KEY_ID_BITS = 4  # keyframe counter, deltas to a lost keyframe are ignored
+DELTA_BITS = 14  # +/-8191 milliseconds (approx. +/-250m in latitude)
+KEYFRAME_BITS = 5 + 3 + KEY_ID_BITS + 4 + 2 * LATLON_BITS  # 4 bits reserved for byte alignment
+DELTA_BEACON_BITS = 5 + 3 + KEY_ID_BITS + 2 * DELTA_BITS
+
+
+def is_beacon(packed_bytes):
+    return len(packed_bytes) > 0 and (packed_bytes[0] >> 3) in [BEACON_KEYFRAME, BEACON_DELTA]
+
+
+class BeaconEncoder:
+    """Robot side of position beacons"""
+    def __init__(self, system, keyframe_period=6):
+        """
+        :param system: robot name like "m03-" or "Matty M03"
+        :param keyframe_period: every n-th beacon is absolute keyframe
+        """
+        system = normalize_matty_name(system)
+        assert system[-3:-1] == 'M0' and system[-1] in '12345', system
+        self.serial_num = int(system[-1])
+        self.keyframe_period = keyframe_period
+        self.key_id = -1
+        self.keyframe = None  # (lat_ms, lon_ms)
+        self.count = 0
+
+    def encode(self, lat, lon):
+        lat_ms = int(round(lat * LATLON_SCALE)) if lat is not None else 0
+        lon_ms = int(round(lon * LATLON_SCALE)) if lon is not None else 0
+        limit = 1 << (DELTA_BITS - 1)
+        if (self.keyframe is not None and self.count % self.keyframe_period != 0
+                and -limit <= lat_ms - self.keyframe[0] < limit and -limit <= lon_ms - self.keyframe[1] < limit):
+            value = (BEACON_DELTA << 3) | self.serial_num
+            value = (value << KEY_ID_BITS) | self.key_id
+            value = (value << DELTA_BITS) | _signed(lat_ms - self.keyframe[0], DELTA_BITS, 'lat delta')
+            value = (value << DELTA_BITS) | _signed(lon_ms - self.keyframe[1], DELTA_BITS, 'lon delta')
+            num_bits = DELTA_BEACON_BITS
+        else:
+            self.key_id = (self.key_id + 1) % (1 << KEY_ID_BITS)
+            self.keyframe = lat_ms, lon_ms
+            self.count = 0
+            value = (BEACON_KEYFRAME << 3) | self.serial_num
+            value = (value << (KEY_ID_BITS + 4)) | (self.key_id << 4)
+            value = (value << LATLON_BITS) | _signed(lat_ms, LATLON_BITS, 'location_lat')
+            value = (value << LATLON_BITS) | _signed(lon_ms, LATLON_BITS, 'location_lon')
+            num_bits = KEYFRAME_BITS
+        self.count += 1
+        return value.to_bytes(num_bits // 8, 'big')
+
+
+class BeaconDecoder:
+    """Basestation side of position beacons, keeps the last keyframe of every robot"""
+    def __init__(self):
+        self.keyframes = {}  # serial_num -> (key_id, lat_ms, lon_ms)
+
+    def decode(self, packed_bytes):
+        """Return DTCReport with position (casualty_id = 0) or None if the keyframe is unknown"""
+        value, total_bits = int.from_bytes(packed_bytes, 'big'), 8 * len(packed_bytes)
+        kind, serial_num = value >> (total_bits - 5), (value >> (total_bits - 8)) & 0x7
+        key_id = (value >> (total_bits - 8 - KEY_ID_BITS)) & ((1 << KEY_ID_BITS) - 1)
+        if kind == BEACON_KEYFRAME:
+            if total_bits != KEYFRAME_BITS:
+                raise ValueError(f'Invalid keyframe size {len(packed_bytes)}')
+            lat_ms = _from_signed((value >> LATLON_BITS) & ((1 << LATLON_BITS) - 1), LATLON_BITS)
+            lon_ms = _from_signed(value & ((1 << LATLON_BITS) - 1), LATLON_BITS)
+            self.keyframes[serial_num] = key_id, lat_ms, lon_ms
+        else:
+            if kind != BEACON_DELTA or total_bits < DELTA_BEACON_BITS:
+                raise ValueError(f'Invalid beacon {packed_bytes.hex()}')
+            if serial_num not in self.keyframes or self.keyframes[serial_num][0] != key_id:
+                return None
+            value >>= total_bits - DELTA_BEACON_BITS
+            dlat = _from_signed((value >> DELTA_BITS) & ((1 << DELTA_BITS) - 1), DELTA_BITS)
+            dlon = _from_signed(value & ((1 << DELTA_BITS) - 1), DELTA_BITS)
+            _, lat_ms, lon_ms = self.keyframes[serial_num]
+            lat_ms, lon_ms = lat_ms + dlat, lon_ms + dlon
+        report = DTCReport(f'Matty M{serial_num:02}', lat_ms/LATLON_SCALE, lon_ms/LATLON_SCALE)
+        report.casualty_id = 0
+        return report
+
+
+def pack_data_bitstring(report):
+    """Reference bitstring implementation of pack_data() (tests and benchmark only)"""
+    import bitstring
     s = bitstring.BitStream()
     assert report.system is not None
     assert len(report.system) >= 3, report.system
@@ -167,8 +371,9 @@ def pack_data(report):
     return s.tobytes()
 
 
-def unpack_data(packed_bytes):
-    """Safely unpacks the data, checking the presence flag."""
+def unpack_data_bitstring(packed_bytes):
+    """Reference bitstring implementation of unpack_data() (tests and benchmark only)"""
+    import bitstring
     unpacker = bitstring.BitStream(packed_bytes)
 
     # Read the mandatory fields
@@ -216,3 +421,36 @@ def unpack_data(packed_bytes):
         report.alertness_motor = unpacker.read('uint:2')
 
     return report
+
+
+def benchmark(reports, repeat=100):
+    """Return list of (name, microseconds per report) for codec and its bitstring reference"""
+    results = []
+    for name, pack, unpack in [('bitstring', pack_data_bitstring, unpack_data_bitstring),
+                               ('integer', pack_data, unpack_data)]:
+        start_time = time.perf_counter()
+        for i in range(repeat):
+            for report in reports:
+                unpack(pack(report))
+        results.append((name, 1_000_000 * (time.perf_counter() - start_time) / (repeat * len(reports))))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    parser = argparse.ArgumentParser(description='Benchmark pack_data/unpack_data round trip')
+    parser.add_argument('--count', type=int, default=100, help='number of random reports')
+    parser.add_argument('--repeat', type=int, default=100, help='number of passes over all reports')
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    reports = []
+    for i in range(args.count):
+        r = DTCReport(f'm0{rnd.randint(1, 5)}-', rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+        for name, bits in OPTIONAL_FIELDS:
+            if rnd.random() < 0.5:
+                setattr(r, name, rnd.randrange(1 << bits))
+        reports.append(r)
+    for name, duration in benchmark(reports, repeat=args.repeat):
+        print(f'{name:10} {duration:.1f} us per pack+unpack')
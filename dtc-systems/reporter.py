@@ -3,13 +3,17 @@
 """
 import time
 import json
+import os
+import queue
 from pathlib import Path
+from threading import Event, Thread
 
 import requests
 import cv2
+import av
 
 from osgar.node import Node
-from report import DTCReport, unpack_data
+from report import BeaconDecoder, DTCReport, is_beacon, unpack_data
 from osgar.drivers.lora import parse_lora_packet
 
 
@@ -27,33 +31,37 @@ json_headers = {
     "Content-Type" : "application/json",
 }
 
+REQUEST_TIMEOUT = 10.0  # seconds, stalled connection must not block the submissions forever
 
-def get_status():
+
+def get_status(session=requests, url_base=URL_BASE, timeout=REQUEST_TIMEOUT):
     print('Get Status')
-    url = URL_BASE + "/api/status"
+    url = url_base + "/api/status"
 
     # Correct GET /api/status/ request
-    response = requests.get(url, headers=json_headers)
+    response = session.get(url, headers=json_headers, timeout=timeout)
+    response.raise_for_status()
     assert response.status_code == 200, response.status_code
     print(response.content)
     print("-------------------")
     return response.content
 
 
-def initial_report(report_data):
+def initial_report(report_data, session=requests, url_base=URL_BASE, timeout=REQUEST_TIMEOUT):
 
     print('Report', report_data)
-    url = URL_BASE + "/api/initial_report"
+    url = url_base + "/api/initial_report"
 
     # Correct POST /api/artifact_reports/ request
-    response = requests.post(url, json=report_data, headers=json_headers)
+    response = session.post(url, json=report_data, headers=json_headers, timeout=timeout)
     print(response.content)
+    response.raise_for_status()
     assert response.status_code in [200, 201], response.status_code
     print("-------------------")
     return response.content
 
 
-def submit_dtc_image(casualty_id, img_path):
+def submit_dtc_image(casualty_id, img_path, session=requests, url_base=URL_BASE, timeout=REQUEST_TIMEOUT):
     report_data = {
         'casualty_id': casualty_id,
         "team": "Robotika",
@@ -61,14 +69,15 @@ def submit_dtc_image(casualty_id, img_path):
         'time_ago': 0
     }
     print('Report', report_data)
-    url = URL_BASE + "/api/casualty_image"
+    url = url_base + "/api/casualty_image"
 
     with open(img_path, 'rb') as f:
         files = {
             'file': f
         }
-        response = requests.post(url, files=files, data=report_data, headers=json_authorization)
+        response = session.post(url, files=files, data=report_data, headers=json_authorization, timeout=timeout)
     print(response.content)
+    response.raise_for_status()
     assert response.status_code in [200, 201], response.status_code
     print("-------------------")
     return response.content
@@ -84,24 +93,186 @@ def submit_dtc_report(report_data):
     return report_status['report_status'] == "accepted", report_status
 
 
-def get_keyframe_image(data):
-    # try H264 via OpenCV
-    is_h264 = data.startswith(bytes.fromhex('00000001 0950')) or data.startswith(bytes.fromhex('00000001 0930'))
-    is_h265 = data.startswith(bytes.fromhex('00000001 460150')) or data.startswith(bytes.fromhex('00000001 460130'))
-    assert is_h264 or is_h265, data[:20].hex()
-    tmp_filename = 'tmp-reporter.h26x'
-    if data.startswith(bytes.fromhex('00000001 0950')) or data.startswith(bytes.fromhex('00000001 460150')):
-        # I - key frame
-        with open(tmp_filename, 'wb') as f:
-            f.write(data)
-    else:
-        return None
-    cap = cv2.VideoCapture(tmp_filename)
-    ret, frame = cap.read()
-#        if ret:
-#            image = pygame.image.frombuffer(frame.tobytes(), frame.shape[1::-1], "BGR")
-    cap.release()
-    return frame
+class SubmissionQueue(Thread):
+    """
+    Background submission of reports and images to the DTC scoring server.
+    Every job is first stored in the outbox directory and removed only after the server
+    accepted it, so pending submissions survive restart of the reporter. Jobs are sent
+    in order over one keep-alive session. Connection errors and server errors (5xx) are
+    retried with exponential backoff, jobs which can never succeed (rejected by the server,
+    missing image, unexpected response, ...) are moved to the failed/ subdirectory.
+    A job whose request timed out after it was sent is not sent again if the server status
+    changed meanwhile (i.e. the server probably accepted it), it is moved to the unconfirmed/
+    subdirectory instead.
+    """
+    def __init__(self, outbox_dir, url_base=URL_BASE, on_response=None, backoff=1.0, max_backoff=30.0,
+                 timeout=REQUEST_TIMEOUT):
+        super().__init__(daemon=True)
+        self.outbox = Path(outbox_dir)
+        self.outbox.mkdir(parents=True, exist_ok=True)
+        self.failed_dir = self.outbox / 'failed'
+        self.unconfirmed_dir = self.outbox / 'unconfirmed'
+        self.url_base = url_base
+        self.on_response = on_response  # callback(job, response_content)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.queue = queue.Queue()
+        self.stop_event = Event()
+        pending = sorted(self.outbox.glob('*.json'))
+        names = sorted(path.name for path in self.outbox.rglob('*.json'))  # including failed and unconfirmed
+        self.seq = int(names[-1].split('-')[0]) + 1 if names else 0
+        for path in pending:
+            print(f'Pending submission {path.name}')
+            self.queue.put(path)
+
+    def put(self, job):
+        """Store job in outbox and return immediately"""
+        path = self.outbox / f'{self.seq:06d}-{job["kind"]}.json'
+        self.seq += 1
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as fd:
+            json.dump(job, fd)
+        os.replace(tmp_path, path)
+        self.queue.put(path)
+
+    def submit_report(self, report_data):
+        self.put({'kind': 'report', 'data': report_data})
+
+    def submit_image(self, casualty_id, img_path):
+        self.put({'kind': 'image', 'casualty_id': casualty_id, 'img_path': str(img_path)})
+
+    def pending(self):
+        return len(list(self.outbox.glob('*.json')))
+
+    def failed(self):
+        return len(list(self.failed_dir.glob('*.json')))
+
+    def unconfirmed(self):
+        return len(list(self.unconfirmed_dir.glob('*.json')))
+
+    def move_to_failed(self, path, reason):
+        print(f'Submission {path.name} failed permanently: {reason!r}')
+        self.failed_dir.mkdir(exist_ok=True)
+        os.replace(path, self.failed_dir / path.name)
+
+    def process(self, job):
+        if job['kind'] == 'report':
+            return json.loads(bytes.decode(initial_report(job['data'], session=self.session, url_base=self.url_base,
+                                                          timeout=self.timeout)))
+        assert job['kind'] == 'image', job['kind']
+        return submit_dtc_image(job['casualty_id'], job['img_path'], session=self.session, url_base=self.url_base,
+                                timeout=self.timeout)
+
+    def send(self, job):
+        """
+        Process job, return server response or None if the server did not confirm it, but its status changed
+        """
+        status = get_status(session=self.session, url_base=self.url_base, timeout=self.timeout)
+        try:
+            return self.process(job)
+        except requests.ReadTimeout:
+            # the request was sent - resend it only if the server did not change its status
+            if get_status(session=self.session, url_base=self.url_base, timeout=self.timeout) == status:
+                raise
+            return None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                path = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                with open(path) as fd:
+                    job = json.load(fd)
+            except (OSError, ValueError) as e:
+                self.move_to_failed(path, e)
+                continue
+            attempt = 0
+            while True:
+                try:
+                    response = self.send(job)
+                    break
+                except requests.HTTPError as e:
+                    if e.response.status_code < 500:
+                        response = e  # rejected by server
+                        break
+                    print(f'Submission {path.name} failed: {e}')
+                except requests.RequestException as e:
+                    print(f'Submission {path.name} failed: {e}')
+                except Exception as e:
+                    response = e  # broken job or unexpected response, retry would not help
+                    break
+                if self.stop_event.wait(min(self.max_backoff, self.backoff * 2 ** attempt)):
+                    return  # the job stays in the outbox for the next run
+                attempt += 1
+            if isinstance(response, Exception):
+                self.move_to_failed(path, response)
+                continue
+            if response is None:
+                print(f'Submission {path.name} timed out, but server status changed - not sent again')
+                self.unconfirmed_dir.mkdir(exist_ok=True)
+                os.replace(path, self.unconfirmed_dir / path.name)
+                continue
+            path.unlink()
+            if self.on_response is not None:
+                try:
+                    self.on_response(job, response)
+                except Exception as e:
+                    print(f'Submission {path.name} response callback failed: {e!r}')
+
+    def request_stop(self):
+        self.stop_event.set()
+
+
+H264_KEYFRAME = bytes.fromhex('00000001 0950')
+H264_FRAME = bytes.fromhex('00000001 0930')
+H265_KEYFRAME = bytes.fromhex('00000001 460150')
+H265_FRAME = bytes.fromhex('00000001 460130')
+
+
+class KeyframeDecoder:
+    """
+    In-memory decoder of H.264/H.265 I-frames fed directly with bus data.
+    Codec contexts are created on the first keyframe and reused for all following ones.
+    """
+    def __init__(self):
+        self.codecs = {}
+
+    def get_codec(self, codec_name):
+        if codec_name not in self.codecs:
+            self.codecs[codec_name] = av.CodecContext.create(codec_name, 'r')
+        return self.codecs[codec_name]
+
+    def decode(self, data):
+        """Return BGR image for I-frame data, None for other frames"""
+        is_h264 = data.startswith(H264_KEYFRAME) or data.startswith(H264_FRAME)
+        is_h265 = data.startswith(H265_KEYFRAME) or data.startswith(H265_FRAME)
+        assert is_h264 or is_h265, data[:20].hex()
+        if data.startswith(H264_KEYFRAME):
+            codec = self.get_codec('h264')
+        elif data.startswith(H265_KEYFRAME):
+            codec = self.get_codec('hevc')
+        else:
+            return None
+        try:
+            # the empty parse flushes the last NAL unit of the frame
+            packets = codec.parse(data) + codec.parse(b'')
+            frames = []
+            for packet in packets:
+                frames.extend(codec.decode(packet))
+            if len(frames) == 0:
+                # drain frames delayed by the decoder and make it ready for the next keyframe
+                frames.extend(codec.decode(None))
+                codec.flush_buffers()
+        except av.FFmpegError as e:
+            print(f"Warning: Failed to decode keyframe: {e}")
+            return None
+        if len(frames) == 0:
+            return None
+        return frames[-1].to_ndarray(format='bgr24')
 
 
 class Reporter(Node):
@@ -111,17 +282,27 @@ class Reporter(Node):
         self.is_team_reporter = config.get('is_team_reporter', False)
         self.grab_image = False
         self.report_index = 0
+        self.beacon_decoder = BeaconDecoder()
+        self.keyframe_decoder = KeyframeDecoder()
+        self.submission_queue = None
+        if self.is_team_reporter:
+            self.submission_queue = SubmissionQueue('dtc_report/outbox', url_base=config.get('url_base', URL_BASE),
+                                                    on_response=self.publish_server_response)
         Path('dtc_report/reports').mkdir(parents=True, exist_ok=True)
         Path('dtc_report/images').mkdir(parents=True, exist_ok=True)
 
+    def publish_server_response(self, job, response):
+        # called from SubmissionQueue thread
+        if job['kind'] == 'report':
+            self.publish('server_response', response)
+
     def on_report(self, data):
         report_cmd = data.copy()
         self.report_index += 1
         report_cmd["casualty_id"] = self.report_index
 
         if self.is_team_reporter:
-            ok, server_response = submit_dtc_report(report_cmd)
-            self.publish('server_response', server_response)
+            self.submission_queue.submit_report(report_cmd)
 
         print(self.time, f'REPORT {self.report_index}')
         filename = f'report{self.report_index}.json'
@@ -132,7 +313,7 @@ class Reporter(Node):
     def on_image(self, data):
         if self.grab_image:
             # search for I-frame
-            image = get_keyframe_image(data)
+            image = self.keyframe_decoder.decode(data)
             if image is not None:
                 filename = f'image{self.report_index}.jpg'
                 print(self.time, f'Saving {filename} ...')
@@ -141,13 +322,30 @@ class Reporter(Node):
                 self.grab_image = False
 
                 if self.is_team_reporter:
-                    submit_dtc_image(self.report_index, img_path)
+                    self.submission_queue.submit_image(self.report_index, img_path)
+
+    def run(self):
+        if self.submission_queue is not None:
+            self.submission_queue.start()
+        try:
+            super().run()
+        finally:
+            if self.submission_queue is not None:
+                self.submission_queue.request_stop()
+                # unfinished job stays in the outbox for the next run
+                self.submission_queue.join(timeout=self.submission_queue.timeout)
 
     def on_lora_report(self, data):
         addr, payload = data
         if 1 in addr:
             return  # note, hard link to base-station!
-        r = unpack_data(payload)
+        if is_beacon(payload):
+            r = self.beacon_decoder.decode(payload)
+            if r is None:
+                print(self.time, f'Pose {addr}: missing keyframe')
+                return
+        else:
+            r = unpack_data(payload)
         if r.casualty_id is None or r.casualty_id == 0:
             # just report of robot positions
             print(self.time, f'Pose {addr}: ({r.location_lat:.6f}, {r.location_lon:.6f})')
@@ -0,0 +1,131 @@
+import random
+import unittest
+from crypt import (
+    MAX_LORA_MESSAGE_SIZE,
+    Crypt,
+    CryptContext,
+    decode_text,
+    decrypt_from_text,
+    encode_frame,
+    encoded_frame_size,
+    encrypt_to_text,
+    split_batch,
+)
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from report import OPTIONAL_FIELDS, BeaconEncoder, DTCReport, pack_data
+
+ENC_KEY = bytes.fromhex('cd88e9e7685df9292842afdb9155855023733c7bbc867d4e950aacd77a3cb4df')
+MAC_KEY = bytes.fromhex('69bd50ff2f953e862d71feac8110d55db420e30db0b6d381ca26b0f48deef0cb')
+CONFIG = {'enc_key': ENC_KEY.hex(), 'mac_key': MAC_KEY.hex()}
+
+
+class CryptTest(unittest.TestCase):
+
+    def test_context_compatibility(self):
+        context = CryptContext(ENC_KEY, MAC_KEY)
+        for message in [b'x', b'Final test. (31, 4, 8)', bytes(range(100))]:
+            self.assertEqual(context.decrypt_from_text(encrypt_to_text(message, ENC_KEY, MAC_KEY)), message)
+            self.assertEqual(decrypt_from_text(context.encrypt_to_text(message), ENC_KEY, MAC_KEY), message)
+
+    def test_decrypt_many(self):
+        context = CryptContext(ENC_KEY, MAC_KEY)
+        messages = [b'first', b'second message longer than one AES block', b'3']
+        blobs = [context.encrypt(m) for m in messages]
+        blobs.insert(1, blobs[0][:-1] + b'X')  # broken tag
+        blobs.append(b'short')
+        results = context.decrypt_many(blobs)
+        self.assertEqual([results[0]] + results[2:4], messages)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(results[4], ValueError)
+        with self.assertRaises(ValueError):
+            context.decrypt_from_text('not base64!')
+
+    def test_frame(self):
+        context = CryptContext(ENC_KEY, MAC_KEY)
+        for messages in [[b'single'], [b'first', b'second', b'\x03abc']]:
+            text = encode_frame(context, messages)
+            for forbidden in b'|\r\n':
+                self.assertNotIn(forbidden, text)
+            blob, is_batch = decode_text(text)
+            self.assertEqual(is_batch, len(messages) > 1)
+            plaintext = context.decrypt_many([blob])[0]
+            self.assertEqual(split_batch(plaintext) if is_batch else [plaintext], messages)
+
+    def test_on_raw_burst(self):
+        bus = MagicMock()
+        crypt = Crypt(config=CONFIG, bus=bus)
+        packets = [b'1|' + bytes(encrypt_to_text(m, ENC_KEY, MAC_KEY), 'ascii') + b'\r\n' for m in [b'abc', b'def']]
+        stream = b''.join(packets)
+        crypt.on_raw(stream[:5])
+        crypt.on_raw(stream[5:-3])
+        self.assertEqual(bus.publish.call_count, 1)
+        crypt.on_raw(stream[-3:])
+        self.assertEqual(bus.publish.call_count, 2)
+        self.assertEqual(bus.publish.call_args_list[0].args, ('decrypted', [[1], b'abc']))
+        self.assertEqual(bus.publish.call_args_list[1].args, ('decrypted', [[1], b'def']))
+        self.assertEqual(len(crypt.buf), 0)
+
+    def test_on_packet(self):
+        bus = MagicMock()
+        crypt = Crypt(config=CONFIG, bus=bus)
+        crypt.on_packet(b'hello\n')
+        topic, data = bus.publish.call_args.args
+        self.assertEqual(topic, 'encrypted')
+        self.assertEqual(data[-1:], b'\n')
+
+        receiver = Crypt(config=CONFIG, bus=bus)
+        receiver.on_raw(b'3|' + data[:-1] + b'\r\n')
+        self.assertEqual(bus.publish.call_args.args, ('decrypted', [[3], b'hello']))
+
+    def test_batch_time(self):
+        bus = MagicMock()
+        crypt = Crypt(config=dict(CONFIG, batch_time=1.0), bus=bus)
+        crypt.time = timedelta(seconds=10)
+        crypt.on_packet(b'beacon\n')
+        crypt.time = timedelta(seconds=10.5)
+        crypt.on_packet(b'report\n')
+        crypt.on_tick(10.5)
+        bus.publish.assert_not_called()
+        crypt.time = timedelta(seconds=11)
+        crypt.on_tick(11)
+        self.assertEqual(bus.publish.call_count, 1)
+        topic, data = bus.publish.call_args.args
+
+        receiver = Crypt(config=CONFIG, bus=bus)
+        receiver.on_raw(b'2|' + data[:-1] + b'\r\n')
+        self.assertEqual(bus.publish.call_args_list[-2].args, ('decrypted', [[2], b'beacon']))
+        self.assertEqual(bus.publish.call_args_list[-1].args, ('decrypted', [[2], b'report']))
+
+    def test_frame_size_limit(self):
+        rnd = random.Random(0)
+        context = CryptContext(ENC_KEY, MAC_KEY)
+        for sizes in [[1], [16], [5, 5], [10, 5, 5]]:
+            messages = [rnd.randbytes(size) for size in sizes]
+            self.assertGreaterEqual(encoded_frame_size(sizes), len(encode_frame(context, messages)))
+
+        # robot traffic - position beacons and full casualty reports
+        bus = MagicMock()
+        crypt = Crypt(config=dict(CONFIG, batch_time=1.0), bus=bus)
+        crypt.time = timedelta(seconds=0)
+        beacons = BeaconEncoder('m03-')
+        for i in range(100):
+            crypt.time += timedelta(seconds=0.3)
+            lat, lon = 32.6570764 + rnd.uniform(-0.01, 0.01), -83.7562508 + rnd.uniform(-0.01, 0.01)
+            crypt.on_packet(beacons.encode(lat, lon) + b'\n')
+            if i % 10 == 0:
+                r = DTCReport('m03-', lat, lon)
+                r.casualty_id = i + 1
+                for name, bits in OPTIONAL_FIELDS:
+                    setattr(r, name, (1 << bits) - 1)
+                crypt.on_packet(pack_data(r) + b'\n')
+            crypt.on_tick(None)
+        frames = [args[1][:-1] for args, kwargs in bus.publish.call_args_list]
+        self.assertTrue(any(text.startswith(b'}') for text in frames))  # batching still used
+        for text in frames:
+            self.assertLessEqual(len(text), MAX_LORA_MESSAGE_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
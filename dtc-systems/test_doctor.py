@@ -1,20 +1,46 @@
-import importlib
+import os
+import subprocess
+import sys
+import time
 import unittest
+from threading import Event
 from unittest.mock import MagicMock, call, patch
 
 import numpy as np
 
-# Patch private black-box function "detect-and-stream"
-original_function = importlib.import_module
-def my_side_effect(name, package=None):
-    if name == 'detect-and-stream':
-        return MagicMock()  # mocked result
-    else:
-        return original_function(name, package)  # call the original function for other args
+import doctor as doctor_module
+from doctor import Doctor, VIDEO_OUTPUT_ROOT, AUDIO_OUTPUT_ROOT
+from dtc_common import DTC_QUERY_SOUND
+from test_video_triage import encode_hevc
 
-with patch('importlib.import_module', side_effect=my_side_effect) as mock_func:
-    with patch.dict('sys.modules', {'ultralytics': MagicMock()}):
-        from doctor import Doctor, VIDEO_OUTPUT_ROOT, AUDIO_OUTPUT_ROOT
+
+def setUpModule():
+    # Patch private black-box function "detect-and-stream" (imported lazily)
+    doctor_module.fb_main = MagicMock()
+
+
+FB_REPORT = {'Head': 'Normal',
+             'Heart Rate': 0,
+             'Lower Extermities': 'Normal',
+             'Motor': 'Absent',
+             'Ocular': 'Open',
+             'Respiratory Distress': 'Absent',
+             'Respiratory Rate': 13,
+             'Severe Hemorrhage': 'Absent',
+             'Torso': 'Normal',
+             'Upper Extermities': 'Normal',
+             'Verbal': 'Absent'}
+
+
+def fake_fb_main(filename, audio_analysis, debug=False):
+    return FB_REPORT
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
 
 
 class DoctorTest(unittest.TestCase):
@@ -23,7 +49,7 @@ class DoctorTest(unittest.TestCase):
         bus = MagicMock()
         ref_h265_data = bytes.fromhex('00000001 460150') + b'some H265 binary data'  # must be I-frame
         audio_data = np.zeros(100, dtype=np.uint16)
-        doctor = Doctor(bus=bus, config={})
+        doctor = Doctor(bus=bus, config={'analysis_workers': 0})
         doctor.last_location = {'lat': 32.6570764, 'lon': -83.7562508}
         doctor.on_scanning_person(True)
         doctor.on_h265_video(ref_h265_data)
@@ -41,7 +67,7 @@ class DoctorTest(unittest.TestCase):
     def test_audio_bug(self):
         bus = MagicMock()
         audio_data = np.zeros(100, dtype=np.uint16)
-        doctor = Doctor(bus=bus, config={})
+        doctor = Doctor(bus=bus, config={'analysis_workers': 0})
         doctor.last_location = {'lat': 32.6570764, 'lon': -83.7562508}
         doctor.on_scanning_person(True)
         doctor.on_audio(audio_data)
@@ -54,19 +80,8 @@ class DoctorTest(unittest.TestCase):
         bus = MagicMock()
         doctor = Doctor(bus=bus, config={})
         doctor.last_location = {'lat': 32.6570764, 'lon': -83.7562508}
-        fb_report = {'Head': 'Normal',
-             'Heart Rate': 0,
-             'Lower Extermities': 'Normal',
-             'Motor': 'Absent',
-             'Ocular': 'Open',
-             'Respiratory Distress': 'Absent',
-             'Respiratory Rate': 13,
-             'Severe Hemorrhage': 'Absent',
-             'Torso': 'Normal',
-             'Upper Extermities': 'Normal',
-             'Verbal': 'Absent'}
         doctor.report_index = 1
-        doctor.publish_report(fb_report)
+        doctor.publish_report(FB_REPORT)
         last = bus.mock_calls[-1]
         self.assertEqual(last.args[0], 'report')
         report = last.args[1]
@@ -84,6 +99,132 @@ class DoctorTest(unittest.TestCase):
         self.assertEqual(report['alertness_motor']['value'], 2)
         self.assertEqual(report['alertness_verbal']['value'], 2)
 
+    def test_worker_pool(self):
+        bus = MagicMock()
+        audio_data = np.zeros(100, dtype=np.uint16)
+        # spawned worker process imports the video analysis by name, module globals are restored after test
+        with patch.object(doctor_module, 'fb_main_name', doctor_module.fb_main_name), \
+                patch.object(doctor_module, 'fb_main', doctor_module.fb_main):
+            doctor = Doctor(bus=bus, config={'max_pending_jobs': 1, 'fb_main': 'test_doctor:fake_fb_main'})
+            self.assertEqual(doctor.mp_context.get_start_method(), 'spawn')
+            for i in range(2):
+                doctor.last_location = {'lat': 32.6570764 + i, 'lon': -83.7562508}
+                doctor.on_scanning_person(True)
+                doctor.on_audio(audio_data)
+                doctor.on_scanning_person(False)
+            doctor.executor.shutdown(wait=True)
+            doctor.speech_executor.shutdown(wait=True)
+            doctor.manager.shutdown()
+        reports = [c.args[1] for c in bus.publish.call_args_list if c.args[0] == 'report']
+        self.assertEqual([r['casualty_id'] for r in reports], [1, 2])
+        self.assertAlmostEqual(reports[1]['location']['latitude'], 33.6570764, places=5)
+        self.assertEqual(reports[1]['rr']['value'], 13)
+        self.assertEqual(len(doctor.pending_jobs), 0)
+
+    def test_streaming_speech(self):
+        events = []
+        chunks = []
+        video_started = Event()
+
+        def slow_transcribe(pcm):
+            if 'scanning finished' in events:
+                # the last chunk is transcribed in parallel with video analysis
+                events.append(('video in parallel', video_started.wait(timeout=5.0)))
+            time.sleep(0.05)
+            doctor_module.speech_service.latency.record(0.05)
+            chunks.append(len(pcm))
+            events.append(('transcribed', len(chunks)))
+            return f' part{len(chunks)}'
+
+        received = []
+
+        def slow_video(filename, audio_analysis, debug=False):
+            video_started.set()
+            received.append(list(audio_analysis))
+            return FB_REPORT
+
+        bus = MagicMock()
+        with patch.object(doctor_module, 'fb_main', slow_video):
+            doctor = Doctor(bus=bus, config={'analysis_workers': 0, 'speech_chunk_sec': 2.0})
+            doctor.last_location = {'lat': 32.6570764, 'lon': -83.7562508}
+            with patch.object(doctor_module.speech_service, 'transcribe', slow_transcribe):
+                doctor.on_scanning_person(True)
+                doctor.on_audio(np.ones(4410, dtype=np.int16))  # ignored during query sound
+                doctor.on_playing([DTC_QUERY_SOUND, False])
+                for i in range(50):
+                    doctor.on_audio(np.zeros(4410, dtype=np.int16))  # 5s in 0.1s blocks
+                submitted = len(doctor.transcription.futures)
+                self.assertGreaterEqual(submitted, 2)
+                # chunks are transcribed during listening
+                self.assertTrue(wait_for(lambda: len(chunks) == submitted))
+                events.append('scanning finished')
+                doctor.on_scanning_person(False)
+            doctor.speech_executor.shutdown(wait=True)
+        self.assertEqual(sum(chunks), 5 * 44100 * 2)
+        text = ' '.join(f'part{i + 1}' for i in range(len(chunks)))
+        self.assertEqual(received, [[True, text]])
+        self.assertIn(call('audio_analysis', [True, text]), bus.publish.call_args_list)
+        # latency of the transcribed chunks is published by the node, not printed by the worker
+        latency = [args[1] for args, kwargs in bus.publish.call_args_list if args[0] == 'speech_latency']
+        self.assertEqual(len(latency), 1)
+        self.assertEqual(latency[0]['count'], len(chunks))
+        # only the last chunk is transcribed after scanning, in parallel with video
+        self.assertEqual(events, [('transcribed', i + 1) for i in range(submitted)] + [
+            'scanning finished', ('video in parallel', True), ('transcribed', submitted + 1)])
+
+    def test_stream_video(self):
+        bus = MagicMock()
+        images = [np.full((120, 160, 3), 100 + 10 * (i % 2), dtype=np.uint8) for i in range(50)]
+        analyzed = []
+
+        def fb_main(filename, audio_analysis, debug=False):
+            analyzed.append(filename)
+            return dict(FB_REPORT, **{'Head': 'Wound', 'Respiratory Rate': 50, 'Verbal': None})
+
+        with patch.object(doctor_module, 'fb_main', fb_main):
+            doctor = Doctor(bus=bus, config={'analysis_workers': 0, 'video_analysis': 'stream'})
+            doctor.last_location = {'lat': 32.6570764, 'lon': -83.7562508}
+            doctor.on_scanning_person(True)
+            for data in encode_hevc(images):
+                doctor.on_h265_video(data)
+            doctor.on_scanning_person(False)
+            doctor.triage_executor.shutdown(wait=True)
+        self.assertEqual(analyzed, [str(VIDEO_OUTPUT_ROOT / 'video1.h265')])
+        reports = [c.args[1] for c in bus.publish.call_args_list if c.args[0] == 'report']
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['casualty_id'], 1)
+        # fb_main() values are preferred
+        self.assertEqual(reports[0]['trauma_head'], 1)
+        self.assertEqual(reports[0]['rr']['value'], 50)
+        # unknown values are taken from the streaming triage
+        self.assertEqual(reports[0]['alertness_verbal']['value'], 2)  # too short audio
+
+    def test_stream_requires_archive(self):
+        with self.assertRaises(AssertionError):
+            Doctor(bus=MagicMock(), config={'video_analysis': 'stream', 'archive_video': False})
+
+    def test_lazy_startup(self):
+        # fresh interpreter, modules imported by other tests do not matter
+        heavy_modules = ['ultralytics', 'detect-and-stream', 'whisper']
+        result = subprocess.run([sys.executable, '-c', 'import sys, doctor; '
+                                 f'print([name for name in {heavy_modules} if name in sys.modules])'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '[]')
+        self.assertIn('import doctor', doctor_module.STARTUP_TIMES)
+
+        bus = MagicMock()
+        doctor = Doctor(bus=bus, config={'analysis_workers': 0})
+        self.assertIsNone(doctor._pose_model)
+        with patch.object(doctor_module.speech_service, 'load'):
+            doctor.start_loading()
+            doctor.loader.shutdown(wait=True)
+            doctor.speech_executor.shutdown(wait=True)
+        topic, startup_times = bus.publish.call_args.args
+        self.assertEqual(topic, 'ready')
+        self.assertIn('load speech model base.en', startup_times)
+        self.assertIn('ready', startup_times)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from estop import ATIS_FRAME_PACKET, EMERGENCY_STOP_PACKET, MASTER_STOP, NORMAL_OPERATION_PACKET, EStop, XBeeFrameParser
+
+
+class EStopTest(unittest.TestCase):
+    def test_parser(self):
+        parser = XBeeFrameParser()
+        self.assertEqual(parser.feed(NORMAL_OPERATION_PACKET), [NORMAL_OPERATION_PACKET[3:-1]])
+        self.assertEqual(parser.feed(ATIS_FRAME_PACKET + MASTER_STOP),
+                         [ATIS_FRAME_PACKET[3:-1], MASTER_STOP[3:-1]])
+
+        # byte by byte with garbage in between
+        frames = []
+        for b in b'\x00\x11' + EMERGENCY_STOP_PACKET + b'\x22' + NORMAL_OPERATION_PACKET:
+            frames.extend(parser.feed(bytes([b])))
+        self.assertEqual(frames, [EMERGENCY_STOP_PACKET[3:-1], NORMAL_OPERATION_PACKET[3:-1]])
+
+    def test_checksum(self):
+        parser = XBeeFrameParser()
+        corrupted = bytearray(NORMAL_OPERATION_PACKET)
+        corrupted[-2] = 0x02  # status changed without checksum update
+        self.assertEqual(parser.feed(bytes(corrupted) + NORMAL_OPERATION_PACKET),
+                         [NORMAL_OPERATION_PACKET[3:-1]])
+        self.assertEqual(parser.checksum_errors, 1)
+
+    def test_bogus_header(self):
+        parser = XBeeFrameParser()
+        # noise delimiter with huge length in front of valid frames
+        self.assertEqual(parser.feed(b'\x7e\xff\xf0' + EMERGENCY_STOP_PACKET + NORMAL_OPERATION_PACKET),
+                         [EMERGENCY_STOP_PACKET[3:-1], NORMAL_OPERATION_PACKET[3:-1]])
+        self.assertEqual(parser.length_errors, 1)
+        # delimiter of valid frame used as the length byte of noise frame
+        frames = []
+        for b in b'\x7e' + EMERGENCY_STOP_PACKET:
+            frames.extend(parser.feed(bytes([b])))
+        self.assertEqual(frames, [EMERGENCY_STOP_PACKET[3:-1]])
+        # noise frame with small length swallowing the start of a valid frame
+        self.assertEqual(parser.feed(b'\x7e\x00\x02' + EMERGENCY_STOP_PACKET), [EMERGENCY_STOP_PACKET[3:-1]])
+        self.assertEqual(parser.checksum_errors, 1)
+
+    def test_emergency_stop(self):
+        bus = MagicMock()
+        estop = EStop(config={}, bus=bus)
+        estop.time = timedelta(seconds=1)
+        estop.on_raw(NORMAL_OPERATION_PACKET[:5])
+        estop.on_raw(NORMAL_OPERATION_PACKET[5:])
+        bus.publish.assert_not_called()
+        estop.time = timedelta(seconds=2.5)
+        estop.on_raw(EMERGENCY_STOP_PACKET)
+        bus.publish.assert_called_once_with('emergency_stop', True)
+        bus.shutdown.assert_called_once()
+        self.assertAlmostEqual(estop.stop_latency, 1.5)
+
+    def test_heartbeat(self):
+        bus = MagicMock()
+        estop = EStop(config={}, bus=bus)
+        for t in range(25):
+            estop.time = timedelta(seconds=t/10)
+            estop.on_tick(t/10)
+        self.assertEqual(bus.publish.call_args_list, 3 * [(('raw', ATIS_FRAME_PACKET),)])
+
+        bus = MagicMock()
+        estop = EStop(config={'master': True}, bus=bus)
+        estop.time = timedelta(seconds=0)
+        estop.on_tick(0)
+        bus.publish.assert_called_once_with('raw', MASTER_STOP)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
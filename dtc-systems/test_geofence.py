@@ -42,11 +42,53 @@ class GeofenceTest(unittest.TestCase):
         with self.assertRaises(ValueError, msg="Initializing with < 3 points should raise ValueError."):
             Geofence([[50.1, 14.4], [50.2, 14.5]])
 
+    def test_haversine_reference(self):
+        for point in [[50.08, 14.42], [50.13, 14.40], [50.075, 14.50], [50.03, 14.45]]:
+            self.assertAlmostEqual(self.prague_geofence.border_dist(point),
+                                   self.prague_geofence.border_dist_haversine(point), delta=1)
+
+    def test_batch(self):
+        points = [[50.08, 14.42], [50.13, 14.40], [50.11, 14.44]]
+        distances = self.prague_geofence.border_dists(points)
+        self.assertEqual(distances.tolist(), [self.prague_geofence.border_dist(p) for p in points])
+
+    def test_distance_field(self):
+        # approx. 100m x 70m fence
+        coords = [[50.0, 14.0], [50.0, 14.0014], [50.0006, 14.0014], [50.0006, 14.0]]
+        exact = Geofence(coords)
+        geofence = Geofence(coords, distance_field_resolution=0.5)
+        points = [[50.0003, 14.0007], [50.0001, 14.0001], [50.0007, 14.0007], [50.01, 14.01]]
+        for point, dist in zip(points, geofence.border_dists(points)):
+            self.assertAlmostEqual(dist, exact.border_dist(point), delta=0.5)
+        self.assertAlmostEqual(geofence.border_dist(points[-1]), exact.border_dist(points[-1]))  # outside raster
+
     def test_random_point(self):
         waypoint = self.prague_geofence.get_random_inner_waypoint()
         self.assertGreater(self.prague_geofence.border_dist(waypoint), 0.0)
         waypoint2 = self.prague_geofence.get_random_inner_waypoint()
         self.assertNotEqual(waypoint, waypoint2)
 
+    def test_random_points_l_shape(self):
+        # L-shape: 100m x 10m bar + 10m x 90m bar (approx. in degrees)
+        dlat, dlon = 1 / 111195, 1 / (111195 * 0.6428)  # 1m at lat 50
+        coords = [[50.0, 14.0], [50.0, 14.0 + 100 * dlon], [50.0 + 10 * dlat, 14.0 + 100 * dlon],
+                  [50.0 + 10 * dlat, 14.0 + 10 * dlon], [50.0 + 100 * dlat, 14.0 + 10 * dlon],
+                  [50.0 + 100 * dlat, 14.0]]
+        geofence = Geofence(coords)
+        waypoints = geofence.get_random_inner_waypoints(2000, min_dist_from_border=2.0)
+        distances = geofence.border_dists(waypoints)
+        self.assertGreater(distances.min(), 2.0 - 1e-6)
+        # area of the arms of the shrunk L-shape is the same
+        horizontal = sum(1 for lat, lon in waypoints if lat < 50.0 + 8 * dlat and lon > 14.0 + 8 * dlon)
+        vertical = sum(1 for lat, lon in waypoints if lat > 50.0 + 8 * dlat and lon < 14.0 + 8 * dlon)
+        self.assertAlmostEqual(horizontal / vertical, 1.0, delta=0.2)
+
+    def test_random_point_narrow_fence(self):
+        coords = [[50.0, 14.0], [50.0, 14.001], [50.00002, 14.001], [50.00002, 14.0]]  # ~2m wide
+        geofence = Geofence(coords)
+        waypoint = geofence.get_random_inner_waypoint(min_dist_from_border=2.0)
+        self.assertGreater(geofence.border_dist(waypoint), 0.0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,28 @@
+import random
 import unittest
 
-from report import DTCReport, pack_data, unpack_data
+from report import (
+    OPTIONAL_FIELDS,
+    BeaconDecoder,
+    BeaconEncoder,
+    DTCReport,
+    is_beacon,
+    pack_batch,
+    pack_data,
+    pack_data_bitstring,
+    unpack_batch,
+    unpack_data,
+    unpack_data_bitstring,
+)
+
+
+def random_report(rnd):
+    r = DTCReport(f'm0{rnd.randint(1, 5)}-', rnd.uniform(-90, 90), rnd.uniform(-180, 180))
+    r.casualty_id = rnd.randrange(256)
+    for name, bits in OPTIONAL_FIELDS:
+        if rnd.random() < 0.5:
+            setattr(r, name, rnd.randrange(1 << bits))
+    return r
 
 
 class DTCReportTest(unittest.TestCase):
@@ -88,6 +110,47 @@ class DTCReportTest(unittest.TestCase):
         self.assertEqual(r2.location_lat, 0)
         self.assertEqual(r2.location_lon, 0)
 
+    def test_fuzz_bitstring_reference(self):
+        rnd = random.Random(0)
+        for i in range(200):
+            r = random_report(rnd)
+            data = pack_data(r)
+            self.assertEqual(data, pack_data_bitstring(r))
+            unpacked, reference = unpack_data(data), unpack_data_bitstring(data)
+            self.assertEqual(vars(unpacked), vars(reference))
+            for name, bits in OPTIONAL_FIELDS:
+                self.assertEqual(getattr(unpacked, name), getattr(r, name))
+
+    def test_batch(self):
+        rnd = random.Random(1)
+        reports = [random_report(rnd) for i in range(5)]
+        unpacked = unpack_batch(pack_batch(reports))
+        self.assertEqual([vars(r) for r in unpacked], [vars(unpack_data(pack_data(r))) for r in reports])
+        self.assertEqual(unpack_batch(b''), [])
+
+    def test_beacons(self):
+        encoder, decoder = BeaconEncoder('m04-', keyframe_period=3), BeaconDecoder()
+        sizes = []
+        for i in range(7):
+            lat, lon = 32.500546 + i * 0.00001, -83.758361 - i * 0.00002
+            data = encoder.encode(lat, lon)
+            self.assertTrue(is_beacon(data))
+            sizes.append(len(data))
+            r = decoder.decode(data)
+            self.assertEqual(r.system, 'Matty M04')
+            self.assertEqual(r.casualty_id, 0)
+            self.assertAlmostEqual(r.location_lat, lat, 6)
+            self.assertAlmostEqual(r.location_lon, lon, 6)
+        self.assertEqual(sizes, [10, 5, 5, 10, 5, 5, 10])
+        self.assertFalse(is_beacon(pack_data(DTCReport('m04-', 32.5, -83.7))))
+
+    def test_beacon_lost_keyframe(self):
+        encoder, decoder = BeaconEncoder('m02-'), BeaconDecoder()
+        decoder.decode(encoder.encode(32.5, -83.7))
+        encoder.encode(32.6, -83.7)  # too far - new keyframe is lost
+        self.assertIsNone(decoder.decode(encoder.encode(32.6001, -83.7)))
+        self.assertIsNone(BeaconDecoder().decode(encoder.encode(32.6002, -83.7)))
+
 
 if __name__ == '__main__':
     unittest.main()
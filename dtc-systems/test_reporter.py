@@ -0,0 +1,198 @@
+import json
+import tempfile
+import time
+import unittest
+from fractions import Fraction
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+
+import av
+import numpy as np
+from reporter import H264_FRAME, H264_KEYFRAME, KeyframeDecoder, SubmissionQueue
+
+
+def encode_h264(images, keyint=3):
+    # OAK camera stream - access unit delimiter in front of every frame
+    enc = av.CodecContext.create('libx264', 'w')
+    enc.height, enc.width = images[0].shape[:2]
+    enc.pix_fmt = 'yuv420p'
+    enc.time_base = Fraction(1, 25)
+    enc.options = {'x264-params': f'aud=1:keyint={keyint}', 'tune': 'zerolatency'}
+    packets = []
+    for i, img in enumerate(images):
+        frame = av.VideoFrame.from_ndarray(img, format='bgr24')
+        frame.pts = i
+        packets.extend(bytes(p) for p in enc.encode(frame))
+    packets.extend(bytes(p) for p in enc.encode(None))
+    # x264 uses primary_pic_type 0 for I-frames, OAK sends 2
+    return [H264_KEYFRAME + p[len(H264_KEYFRAME):] if p.startswith(bytes.fromhex('00000001 0910')) else p
+            for p in packets]
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """Local stand-in for the DTC scoring server"""
+    def __init__(self, failures=0, late_accepts=0, stalls=0, delay=0.5):
+        super().__init__(('127.0.0.1', 0), ScoringHandler)
+        self.failures = failures  # number of requests answered with 503
+        self.late_accepts = late_accepts  # number of requests accepted, but answered after delay
+        self.stalls = stalls  # number of requests answered after delay with 503
+        self.delay = delay
+        self.requests = []
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        assert self.path == '/api/status', self.path
+        self.reply(200, json.dumps({'num_accepted': len(self.server.requests)}).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.reply(503, b'{}')
+        elif self.server.stalls > 0:
+            self.server.stalls -= 1
+            time.sleep(self.server.delay)
+            self.reply(503, b'{}')
+        else:
+            self.server.requests.append((self.path, body))
+            if self.server.late_accepts > 0:
+                self.server.late_accepts -= 1
+                time.sleep(self.server.delay)
+            self.reply(201, json.dumps({'report_status': 'accepted'}).encode())
+
+    def reply(self, status, content):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except ConnectionError:
+            pass  # client timeout
+
+    def log_message(self, format, *args):
+        pass
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+class ReporterTest(unittest.TestCase):
+    def test_keyframe_decoder(self):
+        images = [np.full((120, 160, 3), 20 * i, dtype=np.uint8) for i in range(7)]
+        packets = encode_h264(images)
+        self.assertEqual(len(packets), len(images))
+        decoder = KeyframeDecoder()
+        for i, data in enumerate(packets):
+            image = decoder.decode(data)
+            if i % 3 == 0:
+                self.assertEqual(image.shape, (120, 160, 3))
+                self.assertLess(abs(int(image[60, 80, 1]) - 20 * i), 5)
+            else:
+                self.assertTrue(data.startswith(H264_FRAME))
+                self.assertIsNone(image)
+        # the same decoder is reused for repeated keyframe
+        self.assertEqual(decoder.decode(packets[0]).shape, (120, 160, 3))
+        self.assertEqual(list(decoder.codecs.keys()), ['h264'])
+
+    def test_submission_queue(self):
+        server = ScoringServer(failures=2)
+        responses = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            img_path = Path(tmp_dir) / 'image1.jpg'
+            img_path.write_bytes(b'jpeg')
+            submission_queue = SubmissionQueue(Path(tmp_dir) / 'outbox', url_base=server.url(), backoff=0.01,
+                                               on_response=lambda job, response: responses.append(response))
+            submission_queue.start()
+            start = time.monotonic()
+            submission_queue.submit_report({'casualty_id': 1})
+            submission_queue.submit_image(1, img_path)
+            self.assertLess(time.monotonic() - start, 0.1)  # non-blocking
+            self.assertTrue(wait_for(lambda: len(responses) == 2))
+            self.assertEqual(submission_queue.pending(), 0)
+            submission_queue.request_stop()
+            submission_queue.join()
+        server.stop()
+        self.assertEqual([path for path, body in server.requests], ['/api/initial_report', '/api/casualty_image'])
+        self.assertEqual(json.loads(server.requests[0][1]), {'casualty_id': 1})
+        self.assertEqual(responses[0], {'report_status': 'accepted'})
+
+    def test_failed_job(self):
+        server = ScoringServer()
+        responses = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            submission_queue = SubmissionQueue(Path(tmp_dir) / 'outbox', url_base=server.url(), backoff=0.01,
+                                               on_response=lambda job, response: responses.append(response))
+            submission_queue.start()
+            submission_queue.submit_image(1, Path(tmp_dir) / 'missing.jpg')
+            (submission_queue.outbox / '000001-report.json').write_text('{broken')
+            submission_queue.queue.put(submission_queue.outbox / '000001-report.json')
+            submission_queue.seq = 2
+            submission_queue.submit_report({'casualty_id': 1})
+            # broken jobs do not stop the queue
+            self.assertTrue(wait_for(lambda: len(responses) == 1))
+            self.assertEqual(submission_queue.pending(), 0)
+            self.assertEqual(submission_queue.failed(), 2)
+            submission_queue.request_stop()
+            submission_queue.join()
+        server.stop()
+        self.assertEqual([path for path, body in server.requests], ['/api/initial_report'])
+
+    def test_request_timeout(self):
+        for late_accepts, stalls in [(1, 0), (0, 1)]:
+            server = ScoringServer(late_accepts=late_accepts, stalls=stalls)
+            responses = []
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                submission_queue = SubmissionQueue(Path(tmp_dir) / 'outbox', url_base=server.url(), backoff=0.01,
+                                                   timeout=0.2,
+                                                   on_response=lambda job, response: responses.append(response))
+                submission_queue.start()
+                submission_queue.submit_report({'casualty_id': 1})
+                submission_queue.submit_report({'casualty_id': 2})
+                self.assertTrue(wait_for(lambda: submission_queue.pending() == 0))
+                self.assertEqual(submission_queue.unconfirmed(), late_accepts)
+                submission_queue.request_stop()
+                submission_queue.join()
+            server.stop()
+            # report accepted by the server is not sent again, timed out report is
+            self.assertEqual([json.loads(body)['casualty_id'] for path, body in server.requests], [1, 2])
+            self.assertEqual(len(responses), 2 - late_accepts)
+
+    def test_durable_outbox(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # server not available - the report stays in the outbox
+            submission_queue = SubmissionQueue(tmp_dir, url_base='http://127.0.0.1:1')
+            submission_queue.submit_report({'casualty_id': 2})
+            self.assertEqual(submission_queue.pending(), 1)
+
+            server = ScoringServer()
+            submission_queue = SubmissionQueue(tmp_dir, url_base=server.url())
+            submission_queue.start()
+            self.assertTrue(wait_for(lambda: submission_queue.pending() == 0))
+            submission_queue.request_stop()
+            submission_queue.join()
+            server.stop()
+        self.assertEqual(len(server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
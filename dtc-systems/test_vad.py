@@ -0,0 +1,95 @@
+import unittest
+
+import numpy as np
+from vad import SCAN_MAX_TIME, SCAN_NO_AUDIO, SCAN_RESPONSE, SCAN_SILENCE, ScanDwell, VoiceActivityDetector
+
+BLOCK = 1024  # frames_per_buffer of audio driver
+BLOCK_SEC = BLOCK / 44100
+
+
+def audio_block(amplitude, rng):
+    t = np.arange(BLOCK)
+    noise = rng.normal(0, 50, BLOCK)
+    return (amplitude * np.sin(t * 2 * np.pi * 300 / 44100) + noise).astype(np.int16).tobytes()
+
+
+class VADTest(unittest.TestCase):
+    def test_detector(self):
+        rng = np.random.default_rng(0)
+        vad = VoiceActivityDetector()
+        self.assertFalse(any(vad.process(audio_block(0, rng)) for i in range(50)))
+        detected = [vad.process(audio_block(3000, rng)) for i in range(20)]
+        self.assertTrue(all(detected[3:]))  # onset after 3 frames (60ms)
+        detected = [vad.process(audio_block(0, rng)) for i in range(50)]
+        self.assertFalse(any(detected[1:]))  # the first block contains the rest of speech frame
+        # short click is not speech
+        click = np.zeros(BLOCK, dtype=np.int16)
+        click[100:200] = 10000
+        self.assertFalse(vad.process(click.tobytes()))
+
+    def simulate(self, dwell, speech_intervals, playing_end=8.0):
+        t = 0.0
+        dwell.start(t)
+        reason = None
+        while reason is None:
+            t += BLOCK_SEC
+            if playing_end is not None and t >= playing_end:
+                dwell.playing_finished(t)
+                playing_end = None
+            is_speech = any(start <= t < end for start, end in speech_intervals)
+            reason = dwell.update(t, is_speech)
+        return t, reason
+
+    def test_scan_dwell(self):
+        dwell = ScanDwell(min_sec=10, max_sec=20)
+        t, reason = self.simulate(dwell, [])
+        self.assertEqual(reason, SCAN_SILENCE)
+        self.assertAlmostEqual(t, 11.0, delta=0.05)
+
+        t, reason = self.simulate(dwell, [(9.0, 11.5)])
+        self.assertEqual(reason, SCAN_RESPONSE)
+        self.assertAlmostEqual(t, 12.5, delta=0.05)
+
+        # speech during the query sound (own speaker) is ignored
+        t, reason = self.simulate(dwell, [(2.0, 7.0)])
+        self.assertEqual(reason, SCAN_SILENCE)
+
+        # short answer, but scan takes at least min_sec
+        t, reason = self.simulate(dwell, [(4.0, 8.5)], playing_end=4.0)
+        self.assertEqual(reason, SCAN_RESPONSE)
+        self.assertAlmostEqual(t, 10.0, delta=0.05)
+
+        t, reason = self.simulate(dwell, [(9.0, 30.0)], playing_end=None)
+        self.assertEqual(reason, SCAN_MAX_TIME)
+        self.assertAlmostEqual(t, 20.0, delta=0.05)
+
+        self.assertFalse(dwell.is_active())
+        self.assertEqual(len(dwell.dwell_times), 5)
+        self.assertEqual(dwell.reasons[SCAN_SILENCE], 2)
+        self.assertIn('scans=5', dwell.stats())
+
+    def test_audio_stopped(self):
+        dwell = ScanDwell(min_sec=10, max_sec=20, fixed_sec=13, audio_timeout_sec=1.0)
+        for audio_end, expected_end in [(5.0, 13.0), (12.5, 13.5), (15.0, 16.0)]:
+            dwell.start(0.0)
+            t = 0.0
+            reason = None
+            while reason is None:
+                t += BLOCK_SEC
+                if t < audio_end:
+                    reason = dwell.update(t, is_speech=8.0 < t)  # continuous speech -> max_sec with audio
+                else:
+                    reason = dwell.check_audio(t)
+            self.assertEqual(reason, SCAN_NO_AUDIO)
+            self.assertAlmostEqual(t, expected_end, delta=0.05)
+        # no fallback while audio arrives
+        dwell.start(0.0)
+        self.assertIsNone(dwell.update(14.0, is_speech=True))
+        self.assertIsNone(dwell.check_audio(14.5))
+        self.assertEqual(dwell.reasons[SCAN_NO_AUDIO], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
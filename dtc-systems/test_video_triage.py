@@ -0,0 +1,68 @@
+import unittest
+from fractions import Fraction
+
+import av
+import numpy as np
+from video_triage import StreamingVideoTriage, limb_motion, respiratory_rate
+
+
+def encode_hevc(images, fps=10):
+    # OAK camera stream - access unit delimiter in front of every frame
+    enc = av.CodecContext.create('libx265', 'w')
+    enc.height, enc.width = images[0].shape[:2]
+    enc.pix_fmt = 'yuv420p'
+    enc.time_base = Fraction(1, fps)
+    enc.options = {'x265-params': 'log-level=none:keyint=30:bframes=0:aud=1'}
+    packets = []
+    for i, img in enumerate(images):
+        frame = av.VideoFrame.from_ndarray(img, format='bgr24')
+        frame.pts = i
+        packets.extend(bytes(p) for p in enc.encode(frame))
+    packets.extend(bytes(p) for p in enc.encode(None))
+    # x265 uses pic_type 0 for I-frames, OAK sends 2
+    i_frame, oak_i_frame = bytes.fromhex('00000001 460110'), bytes.fromhex('00000001 460150')
+    return [oak_i_frame + p[len(i_frame):] if p.startswith(i_frame) else p for p in packets]
+
+
+class VideoTriageTest(unittest.TestCase):
+    def test_respiratory_rate(self):
+        fps = 10
+        t = np.arange(20 * fps) / fps
+        signal = 100 + 0.2 * t + 2 * np.sin(2 * np.pi * t * 15 / 60)
+        self.assertAlmostEqual(respiratory_rate(signal, fps), 15, delta=3)
+        self.assertIsNone(respiratory_rate(signal[:30], fps))
+
+    def test_limb_motion(self):
+        person = np.zeros((17, 2))
+        person[:, 0] = 100
+        person[:, 1] = np.linspace(50, 250, 17)
+        moved = person.copy()
+        moved[9, 0] += 40  # left wrist
+        self.assertAlmostEqual(limb_motion([person, person]), 0)
+        self.assertAlmostEqual(limb_motion([person, moved]), 40 / 8 / 200)
+        self.assertIsNone(limb_motion([person]))
+
+    def test_stream(self):
+        fps = 10
+        t = np.arange(20 * fps) / fps
+        images = [np.full((120, 160, 3), int(120 + 20 * np.sin(2 * np.pi * x * 12 / 60)), dtype=np.uint8)
+                  for x in t]
+        triage = StreamingVideoTriage('hevc', fps=fps)
+        for data in encode_hevc(images, fps):
+            triage.feed(data)
+        report = triage.finish([True, 'I am fine'])
+        self.assertEqual(triage.num_frames, len(images))
+        self.assertAlmostEqual(report['Respiratory Rate'], 12, delta=3)
+        self.assertEqual(report['Respiratory Distress'], 'Absent')
+        self.assertEqual(report['Verbal'], 'Normal')
+        self.assertIsNone(report['Heart Rate'])
+        # features which are not computed from the stream are unknown
+        for key in ['Severe Hemorrhage', 'Head', 'Torso', 'Lower Extermities', 'Upper Extermities', 'Ocular',
+                    'Motor']:
+            self.assertIsNone(report[key], key)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
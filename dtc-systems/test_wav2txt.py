@@ -0,0 +1,63 @@
+import unittest
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+import numpy as np
+from wav2txt import SpeechService, StreamingTranscription, quietest_split
+
+
+class SpeechServiceTest(unittest.TestCase):
+    def test_too_short(self):
+        service = SpeechService(load=False)
+        pcm = np.zeros(44100 // 2, dtype=np.int16).tobytes()
+        self.assertEqual(service.is_coherent_speech(pcm), (False, "<Audio is too short to be considered speech>"))
+        self.assertIsNone(service.model)
+
+    def test_transcribe_pcm(self):
+        service = SpeechService(load=False)
+        service.model = MagicMock()
+        service.model.transcribe.return_value = {'text': ' I am fine.'}
+        pcm = (1000 * np.sin(np.arange(2 * 44100) / 10)).astype(np.int16).tobytes()
+        self.assertEqual(service.is_coherent_speech(pcm), (True, ' I am fine.'))
+        audio = service.model.transcribe.call_args.args[0]
+        self.assertEqual(audio.dtype, np.float32)
+        self.assertAlmostEqual(len(audio), 2 * 16000, delta=10)
+        self.assertLess(np.abs(audio).max(), 0.04)
+        self.assertEqual(service.latency.count, 1)
+
+
+class StreamingTranscriptionTest(unittest.TestCase):
+    def test_quietest_split(self):
+        samples = np.full(44100, 1000, dtype=np.int16)
+        samples[30000:30512] = 0
+        self.assertEqual(quietest_split(samples.tobytes(), 20000), 2 * 30224)
+
+    def test_chunks(self):
+        chunks = []
+
+        def submit(pcm):
+            chunks.append(pcm)
+            future = Future()
+            future.set_result(f' word{len(chunks)}')
+            return future
+
+        stream = StreamingTranscription(submit, chunk_sec=1.0)
+        speech = (1000 * np.sin(np.arange(44100) / 5)).astype(np.int16)
+        speech[40000:41000] = 0  # pause between words
+        for i in range(3):
+            stream.add(speech[:22050].tobytes())
+            stream.add(speech[22050:])
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(chunks[0]), 2 * 40152)  # cut in the pause
+        result = stream.finish()
+        self.assertEqual(b''.join(chunks), 3 * speech.tobytes())
+        self.assertEqual(result.result(), (True, 'word1 word2 word3 word4'))
+
+    def test_too_short(self):
+        stream = StreamingTranscription(submit=None)
+        stream.add(np.zeros(1000, dtype=np.int16))
+        self.assertEqual(stream.finish().result(), (False, "<Audio is too short to be considered speech>"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+  Voice activity detection and adaptive duration of the casualty scan
+
+  VoiceActivityDetector is a light-weight energy detector on 16bit PCM with adaptive
+  noise floor (no extra dependencies, runs on every `audio` message).
+  ScanDwell decides when the stationary scan can end - after the casualty answered,
+  after silence timeout or at the maximum duration (fixed duration if audio stops)
+  - and collects dwell statistics.
+"""
+from collections import Counter
+
+import numpy as np
+
+# scan end reasons
+SCAN_RESPONSE = 'response'  # speech onset followed by silence
+SCAN_SILENCE = 'silence'  # no speech after the query sound
+SCAN_MAX_TIME = 'max_time'
+SCAN_NO_AUDIO = 'no_audio'  # audio stopped during the scan
+
+
+class VoiceActivityDetector:
+    def __init__(self, sample_rate=44100, frame_sec=0.02, min_rms=300, noise_ratio=3.0, noise_alpha=0.05,
+                 onset_frames=3):
+        """
+        :param min_rms: minimal RMS of speech frame (16bit samples)
+        :param noise_ratio: speech frame RMS has to be above noise_ratio * noise floor
+        :param noise_alpha: update rate of the noise floor from non-speech frames
+        :param onset_frames: number of consecutive speech frames to detect speech (rejects clicks)
+        """
+        self.frame_size = int(frame_sec * sample_rate)
+        self.min_rms = min_rms
+        self.noise_ratio = noise_ratio
+        self.noise_alpha = noise_alpha
+        self.onset_frames = onset_frames
+        self.noise_floor = None
+        self.speech_run = 0  # consecutive speech frames
+        self.rest = np.zeros(0, dtype=np.int16)
+
+    def process(self, pcm):
+        """Return True if speech was detected in given PCM buffer (mono, 16bit)"""
+        samples = np.concatenate([self.rest, np.frombuffer(bytes(pcm), dtype=np.int16)])
+        num_frames = len(samples) // self.frame_size
+        self.rest = samples[num_frames * self.frame_size:]
+        frames = samples[:num_frames * self.frame_size].astype(np.float32).reshape(num_frames, self.frame_size)
+        is_speech = False
+        for rms in np.sqrt(np.mean(frames * frames, axis=1)):
+            if self.noise_floor is None:
+                self.noise_floor = rms
+            if rms > max(self.min_rms, self.noise_ratio * self.noise_floor):
+                self.speech_run += 1
+            else:
+                self.speech_run = 0
+                self.noise_floor += self.noise_alpha * (rms - self.noise_floor)
+            if self.speech_run >= self.onset_frames:
+                is_speech = True
+        return is_speech
+
+
+class ScanDwell:
+    """
+    Timing of the stationary scan (times in seconds)
+    The listening starts when the query sound finished (or talk_sec after start).
+    The scan ends:
+      - end_of_speech_sec of silence after detected speech (response complete)
+      - listen_timeout_sec without any speech
+      - max_sec in any case, i.e. it is extended while speech continues
+    but never before min_sec (video analysis needs enough frames).
+    If no audio arrives for audio_timeout_sec, the scan has the fixed duration fixed_sec
+    (or ends immediately if it is already longer), see check_audio().
+    """
+    def __init__(self, min_sec=10, max_sec=20, talk_sec=8, listen_timeout_sec=3, end_of_speech_sec=1.0,
+                 fixed_sec=13, audio_timeout_sec=1.0):
+        self.min_sec = min_sec
+        self.max_sec = max_sec
+        self.talk_sec = talk_sec
+        self.listen_timeout_sec = listen_timeout_sec
+        self.end_of_speech_sec = end_of_speech_sec
+        self.fixed_sec = fixed_sec
+        self.audio_timeout_sec = audio_timeout_sec
+        self.start_time = None
+        self.last_audio_time = None
+        self.listen_start_time = None
+        self.speech_onset_time = None
+        self.last_speech_time = None
+        self.dwell_times = []
+        self.reasons = Counter()
+
+    def start(self, t):
+        self.start_time = t
+        self.last_audio_time = t
+        self.listen_start_time = None
+        self.speech_onset_time = None
+        self.last_speech_time = None
+
+    def is_active(self):
+        return self.start_time is not None
+
+    def playing_finished(self, t):
+        if self.is_active() and self.listen_start_time is None:
+            self.listen_start_time = t
+
+    def update(self, t, is_speech):
+        """Return end reason if the scan should finish now, otherwise None"""
+        assert self.is_active()
+        self.last_audio_time = t
+        if self.listen_start_time is None and t - self.start_time >= self.talk_sec:
+            self.listen_start_time = self.start_time + self.talk_sec  # missing playing notification
+        if is_speech and self.listen_start_time is not None:
+            if self.speech_onset_time is None:
+                self.speech_onset_time = t
+            self.last_speech_time = t
+
+        reason = None
+        if t - self.start_time >= self.max_sec:
+            reason = SCAN_MAX_TIME
+        elif t - self.start_time < self.min_sec or self.listen_start_time is None:
+            pass
+        elif self.speech_onset_time is None:
+            if t - self.listen_start_time >= self.listen_timeout_sec:
+                reason = SCAN_SILENCE
+        elif t - self.last_speech_time >= self.end_of_speech_sec:
+            reason = SCAN_RESPONSE
+        if reason is not None:
+            self.finish(t, reason)
+        return reason
+
+    def check_audio(self, t):
+        """Return end reason if the scan should finish now due to missing audio, otherwise None"""
+        if not self.is_active() or t - self.last_audio_time < self.audio_timeout_sec:
+            return None
+        if t - self.start_time < self.fixed_sec:
+            return None
+        self.finish(t, SCAN_NO_AUDIO)
+        return SCAN_NO_AUDIO
+
+    def finish(self, t, reason):
+        self.dwell_times.append(t - self.start_time)
+        self.reasons[reason] += 1
+        self.start_time = None
+
+    def stats(self):
+        if len(self.dwell_times) == 0:
+            return 'no scans'
+        dwell = np.array(self.dwell_times)
+        reasons = ', '.join(f'{reason}: {count}' for reason, count in sorted(self.reasons.items()))
+        return (f'scans={len(dwell)} dwell mean={dwell.mean():.1f}s min={dwell.min():.1f}s '
+                f'max={dwell.max():.1f}s total={dwell.sum():.1f}s ({reasons})')
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,148 @@
+"""
+  Streaming video triage - casualty features computed while the video arrives
+
+  H.265/H.264 packets are decoded by one persistent PyAV codec in a worker thread
+  as they come from the bus. Every frame contributes to the motion signal (mean
+  intensity of the central region, downscaled grayscale) used for respiratory rate;
+  every `pose_every`-th frame optionally goes through the pose model for limb motion.
+  At the end of the scan only the aggregation remains and the result is a dictionary
+  with the same keys as the report of `fb_main()` (detect-and-stream). Features which
+  cannot be derived from the stream (hemorrhage, trauma, eyes, heart rate) are None.
+"""
+import queue
+from threading import Thread
+
+import av
+import cv2
+import numpy as np
+
+MOTION_SIZE = (160, 120)  # downscaled grayscale frame for motion signal
+MIN_BREATHING_HZ = 0.1  # 6 breaths per minute
+MAX_BREATHING_HZ = 0.7  # 42 breaths per minute
+MAX_RR = 63  # 6 bits in DTC report
+NORMAL_RR_RANGE = (8, 30)  # outside -> respiratory distress
+MOTOR_MOTION_THRESHOLD = 0.05  # mean limb keypoint motion relative to person height
+LIMB_KEYPOINTS = [7, 8, 9, 10, 13, 14, 15, 16]  # COCO elbows, wrists, knees, ankles
+
+
+def respiratory_rate(signal, fps):
+    """Return breaths per minute from periodic intensity signal or None if too short"""
+    signal = np.asarray(signal, dtype=np.float64)
+    if len(signal) < 4 * fps:
+        return None
+    t = np.arange(len(signal))
+    signal = signal - np.polyval(np.polyfit(t, signal, 1), t)  # remove drift (exposure, lighting)
+    spectrum = np.abs(np.fft.rfft(signal * np.hanning(len(signal))))
+    freq = np.fft.rfftfreq(len(signal), d=1.0 / fps)
+    band = (freq >= MIN_BREATHING_HZ) & (freq <= MAX_BREATHING_HZ)
+    if not band.any() or spectrum[band].max() == 0:
+        return None
+    return min(MAX_RR, int(round(freq[band][np.argmax(spectrum[band])] * 60)))
+
+
+def limb_motion(keypoints):
+    """Mean motion of limb keypoints between pose samples, relative to person height"""
+    if len(keypoints) < 2:
+        return None
+    kpts = np.array(keypoints)  # samples x 17 keypoints x (x, y), missing keypoint is (0, 0)
+    ys = kpts[..., 1][kpts[..., 1] > 0]
+    height = np.ptp(ys) if len(ys) > 1 else 0
+    if height == 0:
+        return None
+    kpts = kpts[:, LIMB_KEYPOINTS]
+    valid = (kpts > 0).all(axis=2)
+    step = np.linalg.norm(np.diff(kpts, axis=0), axis=2)
+    step_valid = valid[1:] & valid[:-1]
+    if not step_valid.any():
+        return None
+    return float(step[step_valid].mean() / height)
+
+
+class StreamingVideoTriage:
+    def __init__(self, codec_name='hevc', fps=10, pose_model=None, pose_every=5):
+        """
+        :param pose_model: optional ultralytics pose model (callable on BGR image)
+        :param pose_every: pose estimation on every n-th frame (CPU budget)
+        """
+        self.codec = av.CodecContext.create(codec_name, 'r')
+        self.fps = fps
+        self.pose_model = pose_model
+        self.pose_every = pose_every
+        self.packets = queue.Queue()
+        self.num_frames = 0
+        self.motion_signal = []
+        self.keypoints = []
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def feed(self, data):
+        """Non-blocking - packet is decoded in the worker thread"""
+        self.packets.put(data)
+
+    def process_frame(self, frame):
+        gray = cv2.resize(frame.to_ndarray(format='gray'), MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        h, w = gray.shape
+        self.motion_signal.append(float(gray[h // 4: 3 * h // 4, w // 4: 3 * w // 4].mean()))
+        if self.pose_model is not None and self.num_frames % self.pose_every == 0:
+            results = self.pose_model(frame.to_ndarray(format='bgr24'), verbose=False)
+            kpts = results[0].keypoints.xy.detach().cpu().numpy()
+            if len(kpts) > 0:
+                self.keypoints.append(kpts[0])
+        self.num_frames += 1
+
+    def run(self):
+        while True:
+            data = self.packets.get()
+            try:
+                if data is None:
+                    # flush the last NAL unit from parser and frames delayed in decoder
+                    packets = self.codec.parse(b'') + [None]
+                else:
+                    packets = self.codec.parse(data)
+                for packet in packets:
+                    for frame in self.codec.decode(packet):
+                        self.process_frame(frame)
+            except av.FFmpegError as e:
+                print(f"Warning: Failed to decode video packet: {e}")
+            if data is None:
+                break
+
+    def finish(self, speech=None):
+        """
+        Wait for decoding of all received packets and return report dictionary compatible with fb_main()
+        Unknown values are None.
+        :param speech: [is_coherent, text] or future-like object with result()
+        """
+        self.packets.put(None)
+        self.thread.join()
+        if speech is not None and hasattr(speech, 'result'):
+            speech = speech.result()
+        rr = respiratory_rate(self.motion_signal, self.fps)
+        motion = limb_motion(self.keypoints)
+        if motion is not None:
+            motor = 'Normal' if motion > MOTOR_MOTION_THRESHOLD else 'Absent'
+        elif self.pose_model is not None and self.num_frames > 0:
+            motor = 'Absent'  # no person limbs visible
+        else:
+            motor = None
+        if rr is None:
+            distress = None
+        else:
+            distress = 'Absent' if NORMAL_RR_RANGE[0] <= rr <= NORMAL_RR_RANGE[1] else 'Present'
+        return {
+            # not available from the stream features
+            'Severe Hemorrhage': None,
+            'Heart Rate': None,
+            'Head': None,
+            'Torso': None,
+            'Lower Extermities': None,
+            'Upper Extermities': None,
+            'Ocular': None,
+
+            'Respiratory Distress': distress,
+            'Respiratory Rate': rr,
+            'Motor': motor,
+            'Verbal': None if speech is None else 'Normal' if speech[0] else 'Absent',
+        }
+
+# vim: expandtab sw=4 ts=4
@@ -1,37 +1,175 @@
-import librosa
-import speech_recognition as sr
-
-
-def is_coherent_speech(wav_path, threshold=0.5):
-    # Load the audio file
-    audio, sample_rate = librosa.load(wav_path, sr=None)
-    
-    # Check if the duration is reasonable for speech (e.g., at least 1 second)
-    duration = librosa.get_duration(y=audio, sr=sample_rate)
-    if duration < 1.0:
-        return False, "<Audio is too short to be considered speech>"
-
-    # Use speech recognition to transcribe the audio
-    recognizer = sr.Recognizer()
-    with sr.AudioFile(wav_path) as source:
-        audio_data = recognizer.record(source)
-    
-    try:
-        transcription = recognizer.recognize_whisper(audio_data, model="base.en")
+"""
+  Speech transcription with Whisper model loaded once per process
+"""
+import time
+import wave
+from concurrent.futures import Future
+from threading import Lock
+
+import numpy as np
+
+import common_path  # noqa: F401
+from latency_histogram import LatencyHistogram
+
+WHISPER_SAMPLE_RATE = 16000
+MIN_SPEECH_DURATION = 1.0  # seconds
+
+
+def speech_result(duration, transcription, threshold=0.5):
+    """Return (is_coherent, text) for transcription of audio with given duration"""
+    words = transcription.split()
+    num_words = len(words)
+
+    # Check if the number of words is above a certain threshold
+    if True:  # (ignore for now) num_words / duration > threshold:
+        return True, transcription
+    else:
+        return False, "<Insufficient word count for coherent speech>"
+
+
+class SpeechService:
+    """
+    Long-lived Whisper transcription of PCM buffers (mono, signed little-endian)
+    """
+    def __init__(self, model='base.en', sample_rate=44100, sample_width=2, load=True):
+        self.model_name = model
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.model = None
+        self.load_time = None
+        self.latency = LatencyHistogram(min_latency=0.125, num_bins=8)
+        if load:
+            self.load()
+
+    def load(self):
+        if self.model is None:
+            import whisper
+            start_time = time.monotonic()
+            self.model = whisper.load_model(self.model_name)
+            self.load_time = time.monotonic() - start_time
+            print(f'Whisper {self.model_name} loaded in {self.load_time:.1f}s')
+        return self.model
+
+    def duration(self, pcm):
+        return len(pcm) / (self.sample_rate * self.sample_width)
+
+    def transcribe(self, pcm):
+        import speech_recognition as sr  # only for resampling, not needed at startup
+        model = self.load()
+        start_time = time.monotonic()
+        audio_data = sr.AudioData(bytes(pcm), self.sample_rate, self.sample_width)
+        raw = audio_data.get_raw_data(convert_rate=WHISPER_SAMPLE_RATE, convert_width=2)
+        audio = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768
+        transcription = model.transcribe(audio, fp16=False)['text']
+        self.latency.record(time.monotonic() - start_time)
+        return transcription
+
+    def is_coherent_speech(self, pcm, threshold=0.5):
+        # Check if the duration is reasonable for speech (e.g., at least 1 second)
+        duration = self.duration(pcm)
+        if duration < MIN_SPEECH_DURATION:
+            return False, "<Audio is too short to be considered speech>"
+
+        transcription = self.transcribe(pcm)
         print(transcription)
-        words = transcription.split()
-        num_words = len(words)
-        
-        # Check if the number of words is above a certain threshold
-        if True:  # (ignore for now) num_words / duration > threshold:
-            return True, transcription
-        else:
-            return False, "<Insufficient word count for coherent speech>"
-    
-    except sr.UnknownValueError:
-        return False, "<Speech recognition could not understand audio>"
-    except sr.RequestError:
-        return False, "<Could not request results from speech recognition service>"
+        return speech_result(duration, transcription, threshold)
+
+
+def quietest_split(pcm, start, sample_width=2, window=256):
+    """Return byte offset >= start of the quietest window in 16bit PCM (cut between words)"""
+    assert sample_width == 2, sample_width
+    start -= start % sample_width
+    samples = np.frombuffer(bytes(pcm[start:]), dtype=np.int16)
+    num_windows = len(samples) // window
+    if num_windows == 0:
+        return len(pcm)
+    energy = np.abs(samples[:num_windows * window].astype(np.int32)).reshape(num_windows, window).sum(axis=1)
+    return start + int(np.argmin(energy)) * window * sample_width
+
+
+class StreamingTranscription:
+    """
+    Chunked transcription of audio as it arrives. Whenever chunk_sec of audio is buffered,
+    it is cut at the quietest spot of its last third and submitted, so at the end
+    of the listening window only the remaining part has to be transcribed.
+    """
+    def __init__(self, submit, sample_rate=44100, sample_width=2, chunk_sec=3.0, threshold=0.5):
+        """
+        :param submit: callable(pcm) returning Future with text of the chunk
+        """
+        self.submit = submit
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.chunk_size = int(chunk_sec * sample_rate) * sample_width
+        self.threshold = threshold
+        self.buf = bytearray()
+        self.total_size = 0
+        self.futures = []
+
+    def duration(self):
+        return self.total_size / (self.sample_rate * self.sample_width)
+
+    def add(self, pcm):
+        pcm = bytes(pcm)  # also raw data of numpy array
+        self.buf += pcm
+        self.total_size += len(pcm)
+        if len(self.buf) >= self.chunk_size:
+            cut = quietest_split(self.buf, 2 * self.chunk_size // 3, self.sample_width)
+            self.futures.append(self.submit(bytes(self.buf[:cut])))
+            del self.buf[:cut]
+
+    def finish(self):
+        """Submit the last chunk and return Future of (is_coherent, text) for the whole audio"""
+        result = Future()
+        duration = self.duration()
+        if duration < MIN_SPEECH_DURATION:
+            result.set_result((False, "<Audio is too short to be considered speech>"))
+            return result
+        if len(self.buf) > 0:
+            self.futures.append(self.submit(bytes(self.buf)))
+            self.buf = bytearray()
+        futures = self.futures
+        lock = Lock()
+        remaining = [len(futures)]
+
+        def on_chunk_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                result.set_result((False, f"<Speech recognition failed: {errors[0]!r}>"))
+                return
+            transcription = ' '.join(f.result().strip() for f in futures)
+            print(transcription)
+            result.set_result(speech_result(duration, transcription, self.threshold))
+
+        for future in futures:
+            future.add_done_callback(on_chunk_done)
+        return result
+
+
+def read_wav(wav_path):
+    """Return mono PCM, sample rate and sample width of WAV file"""
+    with wave.open(wav_path, 'rb') as wav:
+        channels, sample_width, sample_rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        pcm = wav.readframes(wav.getnframes())
+    if channels > 1:
+        assert sample_width == 2, sample_width
+        pcm = np.frombuffer(pcm, dtype=np.int16).reshape(-1, channels).mean(axis=1).astype(np.int16).tobytes()
+    return pcm, sample_rate, sample_width
+
+
+_services = {}
+
+
+def is_coherent_speech(wav_path, threshold=0.5, model='base.en'):
+    pcm, sample_rate, sample_width = read_wav(wav_path)
+    key = (model, sample_rate, sample_width)
+    if key not in _services:
+        _services[key] = SpeechService(model, sample_rate, sample_width, load=False)
+    return _services[key].is_coherent_speech(pcm, threshold=threshold)
 
 
 if __name__ == '__main__':
@@ -3,14 +3,19 @@
 """
 
 import math
+import os
+import sys
 from datetime import timedelta
 
-import numpy as np
+# Ensure we can find shared modules
+if os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')) not in sys.path:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')))
 
 from osgar.node import Node
 from osgar.bus import BusShutdownException
 from osgar.lib.mathex import normalizeAnglePIPI
 from osgar.followme import EmergencyStopException  # hard to believe! :(
+from depth_scan import DepthScan
 
 LEFT_LED_INDEX = 1  # to be moved into matty.py
 RIGHT_LED_INDEX = 0  # to be moved into matty.py
@@ -36,6 +41,7 @@ class FollowPerson(Node):
         self.max_speed = config.get('max_speed', 0.2)
         self.turn_angle = config.get('turn_angle', 20)
         self.horizon = config.get('horizon', 200)
+        self.depth_scan = DepthScan(horizon=self.horizon)
         self.raise_exception_on_stop = config.get('terminate_on_stop', True)
         self.system_name = config.get('env', {}).get('OSGAR_LOGS_PREFIX', 'm01-')
         self.field_of_view = math.radians(69)  # OAK-D Pro color camera TODO review night -> config
@@ -124,16 +130,7 @@ class FollowPerson(Node):
         self.last_detections = [det for det in data if det[0] == 'person']
 
     def on_depth(self, data):
-        data = data.copy()
-        line = self.horizon - 30
-        line_end = self.horizon + 30
-        box_width = 160
-        arr = []
-        for index in range(0 , 641 - box_width, 20):
-            mask = data[line:line_end, index:box_width + index] == 0
-            data[line:line_end, index:box_width + index][mask] = 10000 # 10m
-            dist = int(np.percentile( data[line:line_end, index:box_width + index], 5))
-            arr.append(dist)
+        arr = self.depth_scan.scan(data)
         self.publish('scan', arr)
         self.scan = arr
 
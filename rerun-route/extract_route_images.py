@@ -3,9 +3,71 @@ import os
 
 import av
 import cv2
+import numpy as np
 from osgar.lib.serialize import deserialize
 from osgar.logger import LogReader, lookup_stream_id
 
+# limited (MPEG) range luma 16..235 -> full range 0..255 as in the BGR conversion
+LIMITED_TO_FULL_RANGE = np.clip(np.round((np.arange(256) - 16) * 255 / 219), 0, 255).astype(np.uint8)
+LUMA_FORMATS = ['yuv420p', 'yuvj420p', 'yuv422p', 'yuvj422p', 'yuv444p', 'yuvj444p', 'nv12']
+
+
+def frame_to_gray(frame):
+    """Grayscale image directly from luma plane of the PyAV frame (no colour conversion)"""
+    if frame.format.name not in LUMA_FORMATS:
+        return frame.to_ndarray(format='gray')
+    plane = frame.planes[0]
+    luma = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)[:, :plane.width]
+    if frame.format.name.startswith('yuvj') or frame.color_range == 2:  # JPEG = full range
+        return luma.copy()
+    return cv2.LUT(luma, LIMITED_TO_FULL_RANGE)
+
+
+class VideoDecoder:
+    def __init__(self, codec_name='hevc', output='bgr', scale=1.0):
+        """
+        :param output: 'bgr' colour image or 'gray' image from luma plane
+        :param scale: image downscale factor (camera intrinsics have to be scaled accordingly)
+        """
+        assert output in ['bgr', 'gray'], output
+        # Use 'hevc' for H.265 or 'h264' for H.264
+        self.codec = av.CodecContext.create(codec_name, 'r')
+        self.output = output
+        self.scale = scale
+
+    def decode(self, data: bytes):
+        """
+        Takes raw H.264/H.265 bytes and returns the decoded OpenCV image (BGR or grayscale).
+        Returns None if the packet didn't contain enough data to form a full frame yet.
+        """
+        # Parse the raw bytes into FFmpeg Packets
+        try:
+            packets = self.codec.parse(data)
+        except av.AVError as e:
+            print(f"Warning: Failed to parse video packet: {e}")
+            return None
+
+        frames = []
+        for packet in packets:
+            try:
+                # Decode the packet into VideoFrames
+                frames.extend(self.codec.decode(packet))
+            except av.AVError as e:
+                print(f"Warning: Failed to decode video packet: {e}")
+                continue
+
+        if not frames:
+            return None
+        # We return the last frame decoded in this batch
+        if self.output == 'gray':
+            img = frame_to_gray(frames[-1])
+        else:
+            # Convert it directly to a numpy array in OpenCV's BGR format
+            img = frames[-1].to_ndarray(format='bgr24')
+        if self.scale != 1.0:
+            img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return img
+
 
 def get_closest_data(ts, history):
     if not history:
@@ -21,10 +83,13 @@ def get_closest_data(ts, history):
             break
     return best_data
 
-def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=None, debug_dir=None):
+def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=None, decode_scale=1.0,
+                           debug_dir=None):
     """
     Extracts poses, ORB descriptors, and 3D keypoints from an OSGAR log.
-    Returns: list of {'kp': keypoints, 'des': descriptors, 'pose': (x, y, h), 'kp_3d': list of (X,Y,Z)}
+    Frames are decoded the same way as the query frames of RerunRoute (grayscale, scaled by decode_scale).
+    Returns: list of {'kp': keypoints, 'kp_xy': N x 2 keypoint coordinates, 'des': descriptors,
+                      'pose': (x, y, h), 'kp_3d': N x 3 (X,Y,Z) with NaN without depth or None, 'frame': gray image}
     """
     if debug_dir and not os.path.exists(debug_dir):
         os.makedirs(debug_dir)
@@ -33,8 +98,8 @@ def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=N
         orb = cv2.ORB_create(nfeatures=2000)
 
     # OAK-D THE_1080_P approximate intrinsics
-    fx, fy = 1400.0, 1400.0
-    cx, cy = 960.0, 540.0
+    fx, fy = 1400.0 * decode_scale, 1400.0 * decode_scale
+    cx, cy = 960.0 * decode_scale, 540.0 * decode_scale
 
     print(f"Extracting video from {log_path}...")
     color_stream = lookup_stream_id(log_path, "oak.color")
@@ -57,7 +122,7 @@ def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=N
 
     # 2. Correlate and extract features via in-memory decoding
     print("Extracting visual landmarks...")
-    codec = av.CodecContext.create('hevc', 'r')
+    decoder = VideoDecoder(codec_name='hevc', output='gray', scale=decode_scale)
 
     ref_data = []
     last_x, last_y = None, None
@@ -65,26 +130,11 @@ def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=N
 
     with LogReader(log_path, only_stream_id=color_stream) as log:
         for timestamp, stream_id, data in log:
-            raw_data = deserialize(data)
-            try:
-                packets = codec.parse(raw_data)
-            except av.AVError:
-                continue
-
-            frame = None
-            for packet in packets:
-                try:
-                    frames = codec.decode(packet)
-                    if frames:
-                        frame = frames[-1].to_ndarray(format='bgr24')
-                except av.AVError:
-                    continue
-
+            frame = decoder.decode(deserialize(data))
             if frame is None:
                 continue
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            brightness = cv2.mean(gray)[0]
+            brightness = cv2.mean(frame)[0]
 
             if brightness < min_brightness:
                 frame_idx += 1
@@ -97,25 +147,25 @@ def extract_reference_data(log_path, step_meters=0.2, min_brightness=30.0, orb=N
                     kp, des = orb.detectAndCompute(frame, None)
                     if des is not None:
                         depth_frame = get_closest_data(timestamp, depth_history)
-                        kp_3d = []
+                        kp_xy = np.array([k.pt for k in kp], dtype=np.float32)
+                        kp_3d = None
                         if depth_frame is not None:
                             d_h, d_w = depth_frame.shape
                             f_h, f_w = frame.shape[:2]
-                            for k in kp:
-                                u, v = int(k.pt[0]), int(k.pt[1])
-                                # Map to depth coordinates
-                                ud, vd = int(u * d_w / f_w), int(v * d_h / f_h)
-                                d = depth_frame[vd, ud] if (0 <= vd < d_h and 0 <= ud < d_w) else 0
-                                if d > 0:
-                                    z = d / 1000.0
-                                    xc = (u - cx) * z / fx
-                                    yc = (v - cy) * z / fy
-                                    kp_3d.append((xc, yc, z))
-                                else:
-                                    kp_3d.append(None)
+                            u, v = kp_xy[:, 0].astype(int), kp_xy[:, 1].astype(int)
+                            # Map to depth coordinates
+                            ud, vd = (u * d_w / f_w).astype(int), (v * d_h / f_h).astype(int)
+                            inside = (0 <= vd) & (vd < d_h) & (0 <= ud) & (ud < d_w)
+                            d = np.zeros(len(kp))
+                            d[inside] = depth_frame[vd[inside], ud[inside]]
+                            z = d / 1000.0
+                            kp_3d = np.full((len(kp), 3), np.nan, dtype=np.float32)
+                            valid = d > 0
+                            kp_3d[valid] = np.column_stack([(u - cx) * z / fx, (v - cy) * z / fy, z])[valid]
 
                         ref_data.append({
                             'kp': kp,
+                            'kp_xy': kp_xy,
                             'des': des,
                             'pose': (x, y, h),
                             'kp_3d': kp_3d,
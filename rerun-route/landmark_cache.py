@@ -0,0 +1,151 @@
+"""
+  Persistent cache of visual landmarks extracted from the reference log
+
+  The extraction (HEVC decoding, ORB and depth back-projection of the whole log)
+  takes minutes, so the result is stored in one file keyed by the log content
+  and the extraction parameters. The file is a sequence of .npy arrays:
+    poses      M x 3 float64 (x, y, heading)
+    offsets    M+1 int64 - landmark i uses rows offsets[i]:offsets[i+1] of the following
+    des        N x 32 uint8 ORB descriptors of all landmarks
+    kp_xy      N x 2 float32 keypoint image coordinates
+    kp_3d      N x 3 float32 camera coordinates, NaN for keypoints without depth
+    has_depth  M bool - landmark has kp_3d (False when extracted without depth stream)
+    lsh_bits, lsh_keys, lsh_owners - PlaceIndex built over all descriptors
+  and it is loaded via memory mapping, i.e. in a fraction of a second.
+  Reference frames (only for visualization) are not cached.
+"""
+import hashlib
+import os
+
+import cv2
+import numpy as np
+from extract_route_images import extract_reference_data
+from place_index import PlaceIndex
+
+CACHE_VERSION = 4  # grayscale decoding of reference frames
+ARRAYS = ['poses', 'offsets', 'des', 'kp_xy', 'kp_3d', 'has_depth', 'lsh_bits', 'lsh_keys', 'lsh_owners']
+HASH_BLOCK_SIZE = 1 << 20
+HASH_NUM_BLOCKS = 64  # logs are immutable, sampled blocks + size identify the content
+
+
+def log_hash(log_path):
+    """Hash of the log content - whole file if small, otherwise evenly spaced blocks"""
+    size = os.path.getsize(log_path)
+    h = hashlib.sha1(str(size).encode())
+    with open(log_path, 'rb') as f:
+        if size <= HASH_BLOCK_SIZE * HASH_NUM_BLOCKS:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                h.update(block)
+        else:
+            step = (size - HASH_BLOCK_SIZE) // (HASH_NUM_BLOCKS - 1)
+            for i in range(HASH_NUM_BLOCKS):
+                f.seek(i * step)
+                h.update(f.read(HASH_BLOCK_SIZE))
+    return h.hexdigest()
+
+
+def orb_params(orb):
+    return [orb.getMaxFeatures(), orb.getScaleFactor(), orb.getNLevels(), orb.getEdgeThreshold(),
+            orb.getFirstLevel(), orb.getWTA_K(), int(orb.getScoreType()), orb.getPatchSize(),
+            orb.getFastThreshold()]
+
+
+def cache_key(log_path, step_meters, min_brightness, orb, decode_scale=1.0):
+    params = (f'v{CACHE_VERSION} step={step_meters} brightness={min_brightness} orb={orb_params(orb)}'
+              f' scale={decode_scale}')
+    return hashlib.sha1(f'{log_hash(log_path)} {params}'.encode()).hexdigest()
+
+
+def save_cache(path, ref_data, place_index):
+    """
+    Write landmarks atomically (partially written cache is never used)
+    Note, that on Windows the file cannot be replaced while it is memory mapped by load_cache().
+    """
+    num_kp = [len(ref['des']) for ref in ref_data]
+    arrays = {
+        'poses': np.array([ref['pose'] for ref in ref_data], dtype=np.float64).reshape(-1, 3),
+        'offsets': np.concatenate([[0], np.cumsum(num_kp)]).astype(np.int64),
+        'des': np.concatenate([ref['des'] for ref in ref_data]) if ref_data else np.zeros((0, 32), np.uint8),
+        'kp_xy': np.concatenate([ref['kp_xy'] for ref in ref_data]).astype(np.float32)
+                 if ref_data else np.zeros((0, 2), np.float32),
+        'kp_3d': np.concatenate([ref['kp_3d'] if ref['kp_3d'] is not None else np.full((n, 3), np.nan)
+                                 for ref, n in zip(ref_data, num_kp)]).astype(np.float32)
+                 if ref_data else np.zeros((0, 3), np.float32),
+        'has_depth': np.array([ref['kp_3d'] is not None for ref in ref_data], dtype=bool),
+        'lsh_bits': place_index.bits,
+        'lsh_keys': place_index.keys,
+        'lsh_owners': place_index.owners,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for name in ARRAYS:
+            np.lib.format.write_array(f, np.ascontiguousarray(arrays[name]), version=(1, 0))
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+def load_cache(path):
+    """
+    Return list of landmarks with the same keys as extract_reference_data() (views into memmap)
+    and PlaceIndex of the landmarks
+    """
+    arrays = {}
+    with open(path, 'rb') as f:
+        for name in ARRAYS:
+            assert np.lib.format.read_magic(f) == (1, 0), path
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            f.seek(offset + int(np.prod(shape)) * dtype.itemsize)
+    offsets = np.asarray(arrays['offsets'])
+    has_depth = np.asarray(arrays['has_depth'])
+    ref_data = []
+    for i, pose in enumerate(np.asarray(arrays['poses'])):
+        rows = slice(offsets[i], offsets[i + 1])
+        ref_data.append({
+            'des': arrays['des'][rows],
+            'kp_xy': arrays['kp_xy'][rows],
+            'kp_3d': arrays['kp_3d'][rows] if has_depth[i] else None,
+            'pose': tuple(pose),
+        })
+    place_index = PlaceIndex(np.asarray(arrays['lsh_bits']), arrays['lsh_keys'], arrays['lsh_owners'], len(ref_data))
+    return ref_data, place_index
+
+
+def cached_reference_data(log_path, cache_dir=None, step_meters=0.2, min_brightness=30.0, orb=None,
+                          decode_scale=1.0, debug_dir=None):
+    """
+    extract_reference_data() with persistent cache, returns landmarks and their PlaceIndex
+    :param cache_dir: directory of cache files, default is the directory of the log
+    """
+    if orb is None:
+        orb = cv2.ORB_create(nfeatures=2000)
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(log_path))
+    key = cache_key(log_path, step_meters, min_brightness, orb, decode_scale)
+    path = os.path.join(cache_dir, f'{os.path.basename(log_path)}.{key[:16]}.landmarks')
+    if os.path.exists(path):
+        try:
+            ref_data, place_index = load_cache(path)
+            print(f"Loaded {len(ref_data)} visual landmarks from {path}")
+            return ref_data, place_index
+        except (OSError, ValueError) as e:
+            print(f"Warning: Failed to load landmark cache ({e})")
+    ref_data = extract_reference_data(log_path, step_meters=step_meters, min_brightness=min_brightness,
+                                      orb=orb, decode_scale=decode_scale, debug_dir=debug_dir)
+    place_index = PlaceIndex.build([ref['des'] for ref in ref_data])
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_cache(path, ref_data, place_index)
+        print(f"Saved landmark cache {path}")
+    except OSError as e:  # including PermissionError of cache replaced while mapped by another process on Windows
+        print(f"Warning: Failed to save landmark cache ({e})")
+    return ref_data, place_index
+
+# vim: expandtab sw=4 ts=4
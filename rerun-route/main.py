@@ -4,17 +4,27 @@
 import glob
 import math
 import os
+import queue
 import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
 
 # Ensure we can find local modules
 if os.path.dirname(__file__) not in sys.path:
     sys.path.append(os.path.dirname(__file__))
+# Ensure we can find shared modules
+if os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')) not in sys.path:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')))
 
-import av
 import cv2
 import numpy as np
-from extract_route_images import extract_reference_data
+from extract_route_images import VideoDecoder
+from landmark_cache import cached_reference_data
+from latency_histogram import LatencyHistogram
+from node_profiler import NodeProfiler
+from place_index import PlaceIndex
 from osgar.bus import BusShutdownException
 from osgar.followme import EmergencyStopException
 from osgar.followpath import FollowPath, Route
@@ -23,38 +33,63 @@ from osgar.logger import LogReader, lookup_stream_id
 from osgar.node import Node
 
 
-class VideoDecoder:
-    def __init__(self, codec_name='hevc'):
-        # Use 'hevc' for H.265 or 'h264' for H.264
-        self.codec = av.CodecContext.create(codec_name, 'r')
+def better_candidate(best, candidate):
+    """More inliers wins, tie is resolved by lower landmark index (independent of evaluation order)"""
+    if candidate is None:
+        return best
+    if best is None or (candidate['inliers'], -candidate['ref_idx']) > (best['inliers'], -best['ref_idx']):
+        return candidate
+    return best
+
+
+class AlignmentWorker(Thread):
+    """
+    Runs visual alignment outside of the bus thread (OpenCV releases the GIL)
+    Only the newest submitted frame is processed, older pending frames are dropped.
+    """
+    def __init__(self, align):
+        super().__init__(daemon=True)
+        self.align = align
+        self.condition = Condition()
+        self.request = None
+        self.results = queue.Queue()
+        self.num_dropped = 0
+        self.stopped = False
+        self.start()
+
+    def submit(self, request):
+        with self.condition:
+            if self.request is not None:
+                self.num_dropped += 1
+            self.request = request
+            self.condition.notify()
+
+    def pop_results(self):
+        results = []
+        while not self.results.empty():
+            results.append(self.results.get())
+        return results
 
-    def decode(self, data: bytes):
-        """
-        Takes raw H.264/H.265 bytes and returns the decoded OpenCV image (BGR).
-        Returns None if the packet didn't contain enough data to form a full frame yet.
-        """
-        # Parse the raw bytes into FFmpeg Packets
-        try:
-            packets = self.codec.parse(data)
-        except av.AVError as e:
-            print(f"Warning: Failed to parse video packet: {e}")
-            return None
-
-        frames = []
-        for packet in packets:
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                request, self.request = self.request, None
             try:
-                # Decode the packet into VideoFrames
-                frames.extend(self.codec.decode(packet))
-            except av.AVError as e:
-                print(f"Warning: Failed to decode video packet: {e}")
+                result = self.align(*request)
+            except Exception as e:
+                print(f"Warning: Visual alignment failed: {e!r}")
                 continue
+            if result is not None:
+                self.results.put(result)
 
-        if frames:
-            # We return the last frame decoded in this batch
-            # Convert it directly to a numpy array in OpenCV's BGR format
-            return frames[-1].to_ndarray(format='bgr24')
-
-        return None
+    def request_stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
 
 
 class RerunRoute(Node):
@@ -70,6 +105,8 @@ class RerunRoute(Node):
         self.pose2d_stream = config.get('pose2d_stream', 'platform.pose2d')
         self.ref_dir = self.resolve_path(config.get('ref_dir'))
         self.debug_dir = self.resolve_path(config.get('debug_dir'))
+        # landmarks extracted from logfile are cached, default next to the log
+        self.landmark_cache_dir = self.resolve_path(config.get('landmark_cache_dir'))
 
         self.min_brightness = config.get('min_brightness', 30.0)
         self.min_inliers = config.get('min_inliers', 20)
@@ -81,6 +118,13 @@ class RerunRoute(Node):
         self.match_time_step = config.get('match_time_step', 2.0)
         self.match_window_size = config.get('match_window_size', 3)
         self.pose_filter_alpha = config.get('pose_filter_alpha', 0.1)
+        # candidate landmarks are evaluated in parallel, search stops at clear winner
+        self.match_workers = config.get('match_workers', min(4, os.cpu_count() or 1))
+        self.early_stop_inliers = config.get('early_stop_inliers', 2 * self.min_inliers)
+        self.match_pool = ThreadPoolExecutor(self.match_workers) if self.match_workers > 1 else None
+        self.match_time_histogram = LatencyHistogram()
+        # initial localization verifies only the best candidates of PlaceIndex (0 = all landmarks)
+        self.place_candidates = config.get('place_candidates', 10)
 
         # OAK-D THE_1080_P approximate intrinsics
         # TODO: These should be provided by the camera driver or calibrated for the specific resolution.
@@ -90,6 +134,9 @@ class RerunRoute(Node):
                                        [0, intrinsics[1], intrinsics[3]],
                                        [0, 0, 1.0]], dtype=float)
         self.dist_coeffs = np.zeros((4,1)) # Assuming no distortion for now
+        # ORB runs on grayscale (optionally downscaled) frames, colour is decoded only for visualization
+        self.decode_scale = config.get('decode_scale', 1.0)
+        self.camera_matrix[:2] *= self.decode_scale
 
         # Load path from log file
         self.path = self.extract_path(self.logfile, self.pose2d_stream)
@@ -99,14 +146,17 @@ class RerunRoute(Node):
             print(f"Extracted {len(self.path)} points from {self.logfile}")
 
         self.orb = cv2.ORB_create(nfeatures=2000)
-        self.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
         self.ref_data = []
+        self.place_index = None
 
         if self.ref_dir:
             self.load_reference_images(self.ref_dir)
+            self.place_index = PlaceIndex.build([ref['des'] for ref in self.ref_data])
         elif self.logfile:
             print(f"Auto-extracting reference data from {self.logfile}...")
-            self.ref_data = extract_reference_data(self.logfile, orb=self.orb, debug_dir=self.debug_dir)
+            self.ref_data, self.place_index = cached_reference_data(
+                    self.logfile, cache_dir=self.landmark_cache_dir, orb=self.orb, decode_scale=self.decode_scale,
+                    debug_dir=self.debug_dir)
 
         self.app = FollowPath(config, bus)
         self.app.route = Route(pts=self.path)
@@ -119,13 +169,18 @@ class RerunRoute(Node):
         self.state = self.STATE_WAIT_FOR_IMAGE if (self.ref_dir or self.logfile) else self.STATE_DRIVING
         self.pose_offset = [0.0, 0.0, 0.0] # x, y, heading_rad
         self.last_depth = None
-        self.decoder = VideoDecoder(codec_name='hevc')
+        self.decoder = VideoDecoder(codec_name='hevc', output='bgr' if self.visualize_alignment else 'gray',
+                                    scale=self.decode_scale)
 
         # Continuous tracking state
         self.last_match_time = None
         self.last_match_pose = None
         self.last_raw_pose = (0.0, 0.0, 0.0)
         self.current_ref_idx = -1
+        # optional visual alignment in worker thread, control keeps odometry rate, but the run depends on
+        # the thread timing and it is not reproducible by osgar.replay (False = inside on_color)
+        self.alignment_worker = AlignmentWorker(self.align) if config.get('async_alignment', False) else None
+        self.profiler = NodeProfiler.from_config(self, config)  # optional "profile" of on_* handlers
 
         print(f"Initial state: {self.state}")
 
@@ -149,7 +204,8 @@ class RerunRoute(Node):
                 match = re.search(r'_x(-?\d+\.\d+)_y(-?\d+\.\d+)', ref_path)
                 if match:
                     pose = (float(match.group(1)), float(match.group(2)))
-                    self.ref_data.append({'des': des, 'kp': kp, 'pose': pose, 'path': ref_path})
+                    kp_xy = np.array([k.pt for k in kp], dtype=np.float32)
+                    self.ref_data.append({'des': des, 'kp': kp, 'kp_xy': kp_xy, 'pose': pose, 'path': ref_path})
         print(f"Loaded {len(self.ref_data)} references.")
 
     def my_publish(self, name, data):
@@ -183,6 +239,7 @@ class RerunRoute(Node):
         self.last_depth = data
 
     def on_pose2d(self, data):
+        self.apply_alignment_results()
         # Raw data from robot platform (starts at 0,0,0)
         x, y, heading = data
         heading_rad = math.radians(heading / 100.0)
@@ -244,6 +301,7 @@ class RerunRoute(Node):
         self.publish('desired_speed', [round(self.app.max_speed * 1000), round(math.degrees(angular_speed) * 100)])
 
     def on_color(self, data):
+        self.apply_alignment_results()
         img = self.decoder.decode(data)
         if img is None:
             return
@@ -263,87 +321,130 @@ class RerunRoute(Node):
                 if time_passed < self.match_time_step and dist_passed < self.match_distance_step:
                     return
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if self.alignment_worker is None:
+            result = self.align(self.time, img, self.last_raw_pose)
+            if result is not None:
+                self.apply_alignment(result)
+        else:
+            self.alignment_worker.submit((self.time, img, self.last_raw_pose))
+
+    def apply_alignment_results(self):
+        if self.alignment_worker is not None:
+            for result in self.alignment_worker.pop_results():
+                self.apply_alignment(result)
+
+    def evaluate_candidate(self, i, kp_xy, des):
+        """
+        Match query frame to reference landmark i and verify geometry (PnP with depth, or homography)
+        Returns candidate {'inliers', 'ref_idx', 'pose', 'rvec', 'tvec', 'mask', 'matches'} or None
+        """
+        ref = self.ref_data[i]
+        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)  # one per call, used from several threads
+        matches = bf.match(des, ref['des'])
+        good = [m for m in matches if m.distance < 50]
+        if len(good) < 10:
+            return None
+
+        query_idx = [m.queryIdx for m in good]
+        train_idx = [m.trainIdx for m in good]
+        # Try PnP if we have 3D points
+        ref_kp3d = ref.get('kp_3d')
+        if ref_kp3d is not None:
+            obj_pts = np.asarray(ref_kp3d[train_idx], dtype=float)
+            valid = ~np.isnan(obj_pts[:, 2])
+            obj_pts = obj_pts[valid]
+            img_pts = kp_xy[query_idx][valid]
+            if len(obj_pts) < 10:
+                return None
+            ret, rvec, tvec, inliers_indices = cv2.solvePnPRansac(
+                obj_pts, img_pts, self.camera_matrix, self.dist_coeffs,
+                reprojectionError=5.0, iterationsCount=100)
+            if not ret:
+                return None
+            mask = np.zeros(len(good), dtype=bool)
+            mask[inliers_indices] = True
+            return {'inliers': len(inliers_indices), 'ref_idx': i, 'pose': ref['pose'],
+                    'rvec': rvec, 'tvec': tvec, 'mask': mask, 'matches': good}
+
+        # Fallback to Homography if no 3D data
+        src_pts = np.float32(kp_xy[query_idx]).reshape(-1, 1, 2)
+        dst_pts = np.float32(ref['kp_xy'][train_idx]).reshape(-1, 1, 2)
+        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+        if mask is None:
+            return None
+        return {'inliers': int(np.sum(mask)), 'ref_idx': i, 'pose': ref['pose'],
+                'rvec': None, 'tvec': None, 'mask': mask, 'matches': good}  # No 3D info
+
+    def match_candidates(self, kp_xy, des, search_indices, current_ref_idx=-1):
+        """
+        Evaluate candidate landmarks and return the best one
+        Candidates are evaluated in rank-ordered batches of match_workers (in parallel if match_pool
+        is available) and the search stops after the batch where a candidate reaches early_stop_inliers.
+        The result does not depend on thread timing, so it is reproducible by osgar.replay.
+        """
+        search_indices = list(search_indices)
+        if current_ref_idx >= 0:
+            # the nearest landmarks first - the most probable winners
+            search_indices = sorted(search_indices, key=lambda i: abs(i - current_ref_idx))
+        best = None
+        for start in range(0, len(search_indices), self.match_workers):
+            batch = search_indices[start:start + self.match_workers]
+            if self.match_pool is None or len(batch) == 1:
+                candidates = [self.evaluate_candidate(i, kp_xy, des) for i in batch]
+            else:
+                candidates = self.match_pool.map(lambda i: self.evaluate_candidate(i, kp_xy, des), batch)
+            for candidate in candidates:
+                best = better_candidate(best, candidate)
+            if best is not None and best['inliers'] >= self.early_stop_inliers:
+                break
+        return best
+
+    def align(self, frame_time, img, raw_pose):
+        """
+        Visual alignment of the frame to reference landmarks (called from worker thread in async mode)
+        Returns correction {'time', 'offset', 'pose', 'ref_idx', 'inliers'} or None
+        :param raw_pose: odometry pose at the time of the frame
+        """
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         brightness = cv2.mean(gray)[0]
         if brightness < self.min_brightness:
-            return
+            return None
 
-        kp, des = self.orb.detectAndCompute(img, None)
+        kp, des = self.orb.detectAndCompute(gray, None)
         if des is None or len(des) < 10:
-            return
+            return None
 
         # Determine search window
-        if self.current_ref_idx == -1:
+        current_ref_idx = self.current_ref_idx
+        if current_ref_idx == -1 and self.place_candidates > 0 and self.place_index is not None:
+            search_indices = self.place_index.query(des, top=self.place_candidates)
+        elif current_ref_idx == -1:
             search_indices = range(len(self.ref_data))
         else:
-            start = max(0, self.current_ref_idx - self.match_window_size)
-            end = min(len(self.ref_data), self.current_ref_idx + self.match_window_size + 1)
+            start = max(0, current_ref_idx - self.match_window_size)
+            end = min(len(self.ref_data), current_ref_idx + self.match_window_size + 1)
             search_indices = range(start, end)
 
-        best_inliers = 0
-        best_pose = None
-        best_ref_idx = -1
-        best_rvec = None
-        best_tvec = None
-
-        best_mask = None
-        best_matches = None
-        best_ref_frame = None
-        best_ref_kp = None
-
-        for i in search_indices:
-            ref = self.ref_data[i]
-            matches = self.bf.match(des, ref['des'])
-            good = [m for m in matches if m.distance < 50]
-
-            if len(good) >= 10:
-                # Try PnP if we have 3D points
-                ref_kp3d = ref.get('kp_3d')
-                if ref_kp3d is not None:
-                    obj_pts = []
-                    img_pts = []
-                    for m in good:
-                        p3d = ref_kp3d[m.trainIdx]
-                        if p3d is not None:
-                            obj_pts.append(p3d)
-                            img_pts.append(kp[m.queryIdx].pt)
-
-                    if len(obj_pts) >= 10:
-                        obj_pts = np.array(obj_pts, dtype=float)
-                        img_pts = np.array(img_pts, dtype=float)
-                        ret, rvec, tvec, inliers_indices = cv2.solvePnPRansac(
-                            obj_pts, img_pts, self.camera_matrix, self.dist_coeffs,
-                            reprojectionError=5.0, iterationsCount=100)
-
-                        if ret:
-                            inliers = len(inliers_indices)
-                            if inliers > best_inliers:
-                                best_inliers = inliers
-                                best_pose = ref['pose']
-                                best_rvec = rvec
-                                best_tvec = tvec
-                                best_mask = np.zeros(len(good), dtype=bool)
-                                best_mask[inliers_indices] = True
-                                best_matches = good
-                                best_ref_frame = ref.get('frame')
-                                best_ref_kp = ref.get('kp')
-                                best_ref_idx = i
-                else:
-                    # Fallback to Homography if no 3D data
-                    src_pts = np.float32([kp[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
-                    dst_pts = np.float32([ref['kp'][m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
-                    M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-                    if mask is not None:
-                        inliers = int(np.sum(mask))
-                        if inliers > best_inliers:
-                            best_inliers = inliers
-                            best_pose = ref['pose']
-                            best_mask = mask
-                            best_matches = good
-                            best_ref_frame = ref.get('frame')
-                            best_ref_kp = ref.get('kp')
-                            best_ref_idx = i
-                            best_rvec = None # No 3D info
+        match_start_time = time.perf_counter()
+        best = self.match_candidates(np.array([k.pt for k in kp], dtype=float), des, search_indices,
+                                     current_ref_idx)
+        match_time = time.perf_counter() - match_start_time
+        self.match_time_histogram.record(match_time)
+        if self.state == self.STATE_WAIT_FOR_IMAGE:
+            print(frame_time, f"Matched {len(search_indices)} candidates in {1000 * match_time:.0f}ms")
+
+        if best is None:
+            best = {'inliers': 0, 'ref_idx': -1}
+        best_inliers = best['inliers']
+        best_pose = best.get('pose')
+        best_ref_idx = best['ref_idx']
+        best_rvec = best.get('rvec')
+        best_tvec = best.get('tvec')
+
+        best_mask = best.get('mask')
+        best_matches = best.get('matches')
+        best_ref_frame = self.ref_data[best_ref_idx].get('frame') if best_ref_idx >= 0 else None
+        best_ref_kp = self.ref_data[best_ref_idx]['kp_xy'] if best_ref_idx >= 0 else None
 
         if best_inliers >= self.min_inliers:
             ref_x, ref_y, ref_heading = best_pose
@@ -360,63 +461,70 @@ class RerunRoute(Node):
                 abs_y = ref_y + dx * s + dy * c
                 abs_heading = ref_heading + yaw_diff
 
-                print(self.time, f"Match found (PnP)! Inliers: {best_inliers}, "
+                print(frame_time, f"Match found (PnP)! Inliers: {best_inliers}, "
                       f"Ref Pose: {best_pose[:2]}, "
                       f"Offset: ({dx:.2f}, {dy:.2f})m, "
                       f"yaw: {math.degrees(yaw_diff):.1f} deg")
             else:
                 # Fallback to simple snap
                 abs_x, abs_y, abs_heading = ref_x, ref_y, ref_heading
-                print(self.time, f"Match found (Snap)! Inliers: {best_inliers}, Ref Pose: {best_pose[:2]}")
+                print(frame_time, f"Match found (Snap)! Inliers: {best_inliers}, Ref Pose: {best_pose[:2]}")
 
-            # Calculate the origin offset relative to raw (0,0,0) odometry
-            raw_x, raw_y, raw_heading = self.last_raw_pose
+            # Calculate the origin offset relative to raw (0,0,0) odometry at the time of the frame
+            raw_x, raw_y, raw_heading = raw_pose
             h_off = abs_heading - raw_heading
             c, s = math.cos(h_off), math.sin(h_off)
             target_x_off = abs_x - (raw_x * c - raw_y * s)
             target_y_off = abs_y - (raw_x * s + raw_y * c)
-            target_offset = [target_x_off, target_y_off, h_off]
-
-            if self.state == self.STATE_WAIT_FOR_IMAGE:
-                self.pose_offset = target_offset
-                # Transition to JOINING or DRIVING
-                first, second = self.app.route.routeSplit((abs_x, abs_y))
-                dist = 0.0
-                if len(second) > 0:
-                    dist = math.hypot(second[0][1] - abs_y, second[0][0] - abs_x)
-
-                if dist > self.join_threshold:
-                    self.state = self.STATE_JOINING
-                    print(self.time, f"State: STATE_JOINING (dist to path: {dist:.2f}m)")
-                else:
-                    self.state = self.STATE_DRIVING
-                    print(self.time, f"State: STATE_DRIVING (dist to path: {dist:.2f}m)")
+            return {'time': frame_time, 'offset': [target_x_off, target_y_off, h_off],
+                    'pose': (abs_x, abs_y, abs_heading), 'ref_idx': best_ref_idx, 'inliers': best_inliers}
+
+        if self.state == self.STATE_WAIT_FOR_IMAGE:
+            print(frame_time, f"Alignment failed (best inliers: {best_inliers} at ref_idx {best_ref_idx})")
+        if self.visualize_alignment and best_inliers > 5 and best_ref_frame is not None:
+            mask_list = best_mask.astype(int).flatten().tolist()
+            draw_params = dict(matchColor = (0,0,255),
+                           singlePointColor = None,
+                           matchesMask = mask_list,
+                           flags = 2)
+            ref_kp = [cv2.KeyPoint(float(x), float(y), 1) for x, y in best_ref_kp]
+            vis_img = cv2.drawMatches(img, kp, best_ref_frame, ref_kp, best_matches, None, **draw_params)
+            out_path = os.path.join(os.path.dirname(self.logfile), "alignment_failed.png")
+            cv2.imwrite(out_path, vis_img)
+            print(f"Saved failed alignment visualization to {out_path}")
+        return None
+
+    def apply_alignment(self, result):
+        """Apply pose-offset correction from align() (bus thread)"""
+        target_offset = result['offset']
+        abs_x, abs_y, _ = result['pose']
+        if self.state == self.STATE_WAIT_FOR_IMAGE:
+            self.pose_offset = list(target_offset)
+            # Transition to JOINING or DRIVING
+            first, second = self.app.route.routeSplit((abs_x, abs_y))
+            dist = 0.0
+            if len(second) > 0:
+                dist = math.hypot(second[0][1] - abs_y, second[0][0] - abs_x)
+
+            if dist > self.join_threshold:
+                self.state = self.STATE_JOINING
+                print(self.time, f"State: STATE_JOINING (dist to path: {dist:.2f}m)")
             else:
-                # Smoothly update offset during driving
-                alpha = self.pose_filter_alpha
-                self.pose_offset[0] = (1 - alpha) * self.pose_offset[0] + alpha * target_offset[0]
-                self.pose_offset[1] = (1 - alpha) * self.pose_offset[1] + alpha * target_offset[1]
-                # Heading smoothing with wrap-around
-                diff = target_offset[2] - self.pose_offset[2]
-                diff = (diff + math.pi) % (2 * math.pi) - math.pi
-                self.pose_offset[2] += alpha * diff
-
-            self.last_match_time = self.time
-            self.last_match_pose = (abs_x, abs_y)
-            self.current_ref_idx = best_ref_idx
+                self.state = self.STATE_DRIVING
+                print(self.time, f"State: STATE_DRIVING (dist to path: {dist:.2f}m)")
         else:
-            if self.state == self.STATE_WAIT_FOR_IMAGE:
-                print(self.time, f"Alignment failed (best inliers: {best_inliers} at ref_idx {best_ref_idx})")
-            if self.visualize_alignment and best_inliers > 5 and best_ref_frame is not None:
-                mask_list = best_mask.astype(int).flatten().tolist()
-                draw_params = dict(matchColor = (0,0,255),
-                               singlePointColor = None,
-                               matchesMask = mask_list,
-                               flags = 2)
-                vis_img = cv2.drawMatches(img, kp, best_ref_frame, best_ref_kp, best_matches, None, **draw_params)
-                out_path = os.path.join(os.path.dirname(self.logfile), "alignment_failed.png")
-                cv2.imwrite(out_path, vis_img)
-                print(f"Saved failed alignment visualization to {out_path}")
+            # Smoothly update offset during driving
+            alpha = self.pose_filter_alpha
+            self.pose_offset[0] = (1 - alpha) * self.pose_offset[0] + alpha * target_offset[0]
+            self.pose_offset[1] = (1 - alpha) * self.pose_offset[1] + alpha * target_offset[1]
+            # Heading smoothing with wrap-around
+            diff = target_offset[2] - self.pose_offset[2]
+            diff = (diff + math.pi) % (2 * math.pi) - math.pi
+            self.pose_offset[2] += alpha * diff
+
+        self.last_match_time = result['time']
+        self.last_match_pose = (abs_x, abs_y)
+        self.current_ref_idx = result['ref_idx']
 
     def on_emergency_stop(self, data):
         if data:
@@ -434,6 +542,13 @@ class RerunRoute(Node):
                 self.update()
         except (BusShutdownException, EmergencyStopException):
             pass
+        if self.alignment_worker is not None:
+            self.alignment_worker.request_stop()
+            self.alignment_worker.join()
+            print(f"Alignment worker dropped {self.alignment_worker.num_dropped} frames")
+        if self.match_pool is not None:
+            self.match_pool.shutdown(cancel_futures=True)
+        print(f"Match time: {self.match_time_histogram}")
         print("Route finished, requesting stop.")
         self.request_stop()
 
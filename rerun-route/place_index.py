@@ -0,0 +1,78 @@
+"""
+  Place recognition index over ORB descriptors of reference landmarks
+
+  Locality-sensitive hashing for binary descriptors: every table uses a random
+  subset of `key_bits` descriptor bits as a key. Descriptors of the same scene
+  point differ only in a few bits, so they often share the key, while random
+  descriptors are spread over 2**key_bits buckets. A query frame votes for the
+  landmarks of all descriptors in its buckets and the best voted landmarks are
+  the candidates for geometric verification. The query cost depends on the bucket
+  sizes (binary search in sorted keys), not on the number of landmarks.
+"""
+import numpy as np
+
+DESCRIPTOR_BITS = 256  # ORB
+
+
+def hash_keys(des, bits):
+    """Keys of descriptors (N x 32 uint8) composed of selected bits"""
+    keys = np.zeros(len(des), dtype=np.uint32)
+    for shift, bit in enumerate(bits):
+        keys |= ((des[:, bit >> 3] >> (7 - (bit & 7))) & 1).astype(np.uint32) << shift
+    return keys
+
+
+class PlaceIndex:
+    def __init__(self, bits, keys, owners, num_landmarks, max_bucket=64):
+        """
+        :param bits: num_tables x key_bits selected descriptor bits
+        :param keys: num_tables x N sorted keys of all reference descriptors
+        :param owners: num_tables x N landmark index of the corresponding descriptor
+        :param max_bucket: larger buckets (frequent non-distinctive patterns) do not vote
+        """
+        self.bits = bits
+        self.keys = keys
+        self.owners = owners
+        self.num_landmarks = num_landmarks
+        self.max_bucket = max_bucket
+
+    @classmethod
+    def build(cls, descriptors, num_tables=8, key_bits=16, seed=0):
+        """
+        :param descriptors: list of ORB descriptors (N_i x 32 uint8) of the reference landmarks
+        """
+        rng = np.random.default_rng(seed)
+        bits = np.array([rng.choice(DESCRIPTOR_BITS, key_bits, replace=False) for _ in range(num_tables)],
+                        dtype=np.uint16)
+        des = np.concatenate(descriptors) if len(descriptors) > 0 else np.zeros((0, 32), dtype=np.uint8)
+        owner = np.repeat(np.arange(len(descriptors), dtype=np.int32), [len(d) for d in descriptors])
+        keys = np.zeros((num_tables, len(des)), dtype=np.uint32)
+        owners = np.zeros((num_tables, len(des)), dtype=np.int32)
+        for t in range(num_tables):
+            table_keys = hash_keys(des, bits[t])
+            order = np.argsort(table_keys, kind='stable')
+            keys[t] = table_keys[order]
+            owners[t] = owner[order]
+        return cls(bits, keys, owners, len(descriptors))
+
+    def votes(self, des):
+        """Number of hash collisions of query descriptors with each landmark"""
+        votes = np.zeros(self.num_landmarks, dtype=np.int64)
+        for bits, keys, owners in zip(self.bits, self.keys, self.owners):
+            query_keys = hash_keys(des, bits)
+            left = np.searchsorted(keys, query_keys, side='left')
+            sizes = np.searchsorted(keys, query_keys, side='right') - left
+            informative = (sizes > 0) & (sizes <= self.max_bucket)
+            left, sizes = left[informative], sizes[informative]
+            # indices of all descriptors in the hit buckets
+            starts = np.repeat(left - np.cumsum(sizes) + sizes, sizes)
+            votes += np.bincount(owners[starts + np.arange(len(starts))], minlength=self.num_landmarks)
+        return votes
+
+    def query(self, des, top=10):
+        """Return indices of up to `top` landmarks with the most votes, best first"""
+        votes = self.votes(des)
+        ranked = np.argsort(-votes, kind='stable')[:top]
+        return [int(i) for i in ranked if votes[i] > 0]
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+from landmark_cache import cache_key, cached_reference_data, load_cache, save_cache
+from place_index import PlaceIndex
+
+
+def random_landmarks(num, with_depth=True):
+    rng = np.random.default_rng(0)
+    ref_data = []
+    for i in range(num):
+        n = 50 + 10 * i
+        kp_3d = None
+        if with_depth:
+            kp_3d = rng.uniform(0.5, 5.0, (n, 3)).astype(np.float32)
+            kp_3d[::3] = np.nan  # keypoints without depth
+        ref_data.append({
+            'des': rng.integers(0, 256, (n, 32), dtype=np.uint8),
+            'kp_xy': rng.uniform(0, 1000, (n, 2)).astype(np.float32),
+            'kp_3d': kp_3d,
+            'pose': (float(i), 2.0 * i, 0.1 * i),
+        })
+    return ref_data
+
+
+class LandmarkCacheTest(unittest.TestCase):
+    def test_save_load(self):
+        ref_data = random_landmarks(3) + random_landmarks(1, with_depth=False)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.landmarks')
+            save_cache(path, ref_data, PlaceIndex.build([ref['des'] for ref in ref_data]))
+            loaded, place_index = load_cache(path)
+            self.assertEqual(len(loaded), len(ref_data))
+            for ref, cached in zip(ref_data, loaded):
+                np.testing.assert_array_equal(cached['des'], ref['des'])
+                np.testing.assert_array_equal(cached['kp_xy'], ref['kp_xy'])
+                self.assertEqual(cached['pose'], ref['pose'])
+            np.testing.assert_array_equal(loaded[0]['kp_3d'], ref_data[0]['kp_3d'])  # including NaN
+            self.assertIsNone(loaded[3]['kp_3d'])
+            self.assertIsInstance(loaded[1]['des'], np.memmap)
+            # descriptors from memory map are directly usable by matcher
+            matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(ref_data[1]['des'], loaded[1]['des'])
+            self.assertEqual(len(matches), len(ref_data[1]['des']))
+            self.assertTrue(all(m.distance == 0 for m in matches))
+            self.assertEqual(place_index.query(ref_data[2]['des'], top=1), [2])
+            del loaded, matches, place_index  # memory mapped file cannot be replaced on Windows
+
+            save_cache(path, [], PlaceIndex.build([]))
+            loaded, place_index = load_cache(path)
+            self.assertEqual(loaded, [])
+            self.assertEqual(place_index.query(ref_data[2]['des']), [])
+            del loaded, place_index
+
+    def test_depth_without_valid_points(self):
+        ref_data = random_landmarks(2)
+        ref_data[0]['kp_3d'][:] = np.nan  # depth stream available, but all keypoints out of range
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.landmarks')
+            save_cache(path, ref_data, PlaceIndex.build([ref['des'] for ref in ref_data]))
+            loaded, place_index = load_cache(path)
+            self.assertIsNotNone(loaded[0]['kp_3d'])
+            np.testing.assert_array_equal(loaded[0]['kp_3d'], ref_data[0]['kp_3d'])
+            del loaded, place_index
+
+    def test_cached_reference_data(self):
+        orb = cv2.ORB_create(nfeatures=2000)
+        ref_data = random_landmarks(2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'route.log')
+            with open(log_path, 'wb') as f:
+                f.write(b'log content')
+            with patch('landmark_cache.extract_reference_data', return_value=ref_data) as extract:
+                cached_reference_data(log_path, orb=orb)
+                loaded, place_index = cached_reference_data(log_path, orb=orb)
+                self.assertEqual(extract.call_count, 1)
+                np.testing.assert_array_equal(loaded[1]['des'], ref_data[1]['des'])
+
+                # key depends on parameters and log content
+                cached_reference_data(log_path, step_meters=0.5, orb=orb)
+                self.assertEqual(extract.call_count, 2)
+                # landmarks of downscaled frames
+                cached_reference_data(log_path, orb=orb, decode_scale=0.5)
+                self.assertEqual(extract.call_count, 3)
+                self.assertEqual(extract.call_args.kwargs['decode_scale'], 0.5)
+                key = cache_key(log_path, 0.2, 30.0, orb)
+                self.assertNotEqual(key, cache_key(log_path, 0.2, 30.0, cv2.ORB_create(nfeatures=500)))
+                with open(log_path, 'ab') as f:
+                    f.write(b'more')
+                self.assertNotEqual(key, cache_key(log_path, 0.2, 30.0, orb))
+            del loaded, place_index
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+from place_index import PlaceIndex, hash_keys
+
+
+def perturb(des, rng, prob=0.05):
+    """The same descriptors seen again - a few flipped bits"""
+    bits = np.unpackbits(des, axis=1)
+    return np.packbits(bits ^ (rng.random(bits.shape) < prob), axis=1)
+
+
+class PlaceIndexTest(unittest.TestCase):
+    def test_hash_keys(self):
+        des = np.zeros((2, 32), dtype=np.uint8)
+        des[1, 0] = 0b10000000  # bit 0
+        des[1, 31] = 0b00000001  # bit 255
+        self.assertEqual(hash_keys(des, [0, 255, 1]).tolist(), [0, 0b011])
+
+    def test_query(self):
+        rng = np.random.default_rng(0)
+        descriptors = [rng.integers(0, 256, (500, 32), dtype=np.uint8) for _ in range(200)]
+        index = PlaceIndex.build(descriptors)
+        for i in [0, 123, 199]:
+            candidates = index.query(perturb(descriptors[i], rng), top=5)
+            self.assertEqual(candidates[0], i)
+            self.assertLessEqual(len(candidates), 5)
+        # half of the view overlaps with one place, half with the next one
+        query = np.concatenate([descriptors[50][:250], descriptors[51][250:]])
+        self.assertEqual(sorted(index.query(perturb(query, rng), top=2)), [50, 51])
+
+    def test_empty(self):
+        index = PlaceIndex.build([])
+        self.assertEqual(index.query(np.zeros((10, 32), dtype=np.uint8)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: expandtab sw=4 ts=4
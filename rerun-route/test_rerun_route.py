@@ -1,6 +1,43 @@
+import os
+import tempfile
+import time
 import unittest
+from datetime import timedelta
+from fractions import Fraction
+from threading import Event
 from unittest.mock import MagicMock
-from main import RerunRoute
+
+import av
+import cv2
+import numpy as np
+from osgar.followpath import Route
+from osgar.lib.serialize import serialize
+from osgar.logger import LogWriter
+
+from extract_route_images import extract_reference_data
+from main import AlignmentWorker, RerunRoute, VideoDecoder
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def encode_hevc(images):
+    enc = av.CodecContext.create('libx265', 'w')
+    enc.height, enc.width = images[0].shape[:2]
+    enc.pix_fmt = 'yuv420p'
+    enc.time_base = Fraction(1, 10)
+    enc.options = {'x265-params': 'log-level=none'}
+    packets = []
+    for i, img in enumerate(images):
+        frame = av.VideoFrame.from_ndarray(img, format='bgr24')
+        frame.pts = i
+        packets.extend(bytes(p) for p in enc.encode(frame))
+    packets.extend(bytes(p) for p in enc.encode(None))
+    return packets
 
 
 class RerunRouteTest(unittest.TestCase):
@@ -14,6 +51,141 @@ class RerunRouteTest(unittest.TestCase):
         app = RerunRoute(config, bus)
         self.assertEqual(app.path, [])
 
+    def test_match_candidates(self):
+        rng = np.random.default_rng(0)
+        des = rng.integers(0, 256, (200, 32), dtype=np.uint8)
+        kp_xy = rng.uniform(0, 1000, (200, 2))
+        ref_data = [{'des': rng.integers(0, 256, (200, 32), dtype=np.uint8), 'kp_xy': kp_xy.astype(np.float32),
+                     'kp_3d': None, 'pose': (i, 0, 0)} for i in range(20)]
+        for i in [7, 12]:  # the same place seen from shifted view
+            ref_data[i]['des'] = des
+            ref_data[i]['kp_xy'] = (kp_xy + [30, 5]).astype(np.float32)
+
+        for workers in [1, 4]:
+            app = RerunRoute({'logfile': None, 'match_workers': workers, 'early_stop_inliers': 1000}, MagicMock())
+            app.ref_data = ref_data
+            best = app.match_candidates(kp_xy, des, range(len(ref_data)))
+            self.assertEqual(best['ref_idx'], 7)
+            self.assertEqual(best['inliers'], 200)
+            self.assertIsNone(best['rvec'])
+            # the nearest to current landmark is evaluated first and clear winner stops the search
+            app.early_stop_inliers = 100
+            app.evaluate_candidate = MagicMock(side_effect=app.evaluate_candidate)
+            best = app.match_candidates(kp_xy, des, range(9, 16), current_ref_idx=12)
+            self.assertEqual(best['ref_idx'], 12)
+            # only the first batch (rank-ordered) is evaluated
+            self.assertEqual(app.evaluate_candidate.call_count, workers)
+            self.assertEqual([args[0] for args, kwargs in app.evaluate_candidate.call_args_list],
+                             [12, 11, 13, 10][:workers])
+
+    def test_match_candidates_deterministic(self):
+        rng = np.random.default_rng(0)
+        des = rng.integers(0, 256, (200, 32), dtype=np.uint8)
+        kp_xy = rng.uniform(0, 1000, (200, 2))
+        ref_data = [{'des': rng.integers(0, 256, (200, 32), dtype=np.uint8), 'kp_xy': kp_xy.astype(np.float32),
+                     'kp_3d': None, 'pose': (i, 0, 0)} for i in range(12)]
+        for i, num in [(2, 120), (3, 200)]:  # both reach early stop, 3 is better but ranked later
+            ref_data[i]['des'] = des.copy()
+            ref_data[i]['des'][num:] = rng.integers(0, 256, (200 - num, 32), dtype=np.uint8)
+            ref_data[i]['kp_xy'] = (kp_xy + [30, 5]).astype(np.float32)
+        results = []
+        for workers in [1, 1, 4, 4, 4]:
+            app = RerunRoute({'logfile': None, 'match_workers': workers, 'early_stop_inliers': 100}, MagicMock())
+            app.ref_data = ref_data
+            results.append((workers, app.match_candidates(kp_xy, des, range(len(ref_data)))['ref_idx']))
+        # the same result for the same configuration, the batch of 4 contains both winners
+        self.assertEqual(results, [(1, 2), (1, 2), (4, 3), (4, 3), (4, 3)])
+
+    def test_gray_decoder(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (240, 320, 3), dtype=np.uint8), (9, 9), 0)
+        packets = encode_hevc(5 * [img])
+        decoders = [VideoDecoder(), VideoDecoder(output='gray'), VideoDecoder(output='gray', scale=0.5)]
+        images = [None] * len(decoders)
+        for data in packets:
+            for i, decoder in enumerate(decoders):
+                images[i] = decoder.decode(data) if images[i] is None else images[i]
+        bgr, gray, small = images
+        self.assertEqual(bgr.shape, (240, 320, 3))
+        self.assertEqual(gray.shape, (240, 320))
+        self.assertEqual(small.shape, (120, 160))
+        # luma plane matches grayscale of the colour image (including limited -> full range)
+        diff = np.abs(gray.astype(int) - cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+        self.assertLess(diff.mean(), 1.5)
+        self.assertLess(abs(small.mean() - gray.mean()), 1.0)
+
+    def test_decode_scale(self):
+        app = RerunRoute({'logfile': None, 'decode_scale': 0.5}, MagicMock())
+        np.testing.assert_array_equal(app.camera_matrix, [[700, 0, 480], [0, 700, 270], [0, 0, 1]])
+        self.assertEqual(app.decoder.output, 'gray')
+        app = RerunRoute({'logfile': None, 'visualize_alignment': True}, MagicMock())
+        self.assertEqual(app.decoder.output, 'bgr')
+        self.assertEqual(app.camera_matrix[0, 0], 1400)
+
+    def test_reference_decode_scale(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (240, 320, 3), dtype=np.uint8), (5, 5), 0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'route.log')
+            with LogWriter(filename=log_path) as log:
+                color = log.register('oak.color')
+                pose2d = log.register('platform.pose2d')
+                depth = log.register('oak.depth')
+                for i, data in enumerate(encode_hevc(10 * [img])):
+                    log.write(pose2d, serialize([500 * i, 0, 0]), dt=timedelta(seconds=0.1 * i))
+                    log.write(depth, serialize(np.full((60, 80), 2000, dtype=np.uint16)),
+                              dt=timedelta(seconds=0.1 * i))
+                    log.write(color, serialize(data), dt=timedelta(seconds=0.1 * i))
+            # the reference landmarks are detected in the same images as the query frames
+            ref_data = extract_reference_data(log_path, step_meters=1.0, decode_scale=0.5)
+        self.assertGreater(len(ref_data), 0)
+        self.assertEqual(ref_data[0]['frame'].shape, (120, 160))
+        self.assertLessEqual(ref_data[0]['kp_xy'].max(axis=0).tolist(), [160, 120])
+        # 3D points do not depend on the scale
+        kp_xy, kp_3d = ref_data[0]['kp_xy'], ref_data[0]['kp_3d']
+        np.testing.assert_allclose(kp_3d[:, 2], 2.0)
+        np.testing.assert_allclose(kp_3d[:, 0], (kp_xy[:, 0].astype(int) / 0.5 - 960) * 2.0 / 1400, atol=1e-5)
+
+    def test_alignment_worker(self):
+        processed = []
+        release = Event()
+
+        def align(frame_time, img, raw_pose):
+            release.wait()
+            processed.append(frame_time)
+            return {'time': frame_time}
+
+        worker = AlignmentWorker(align)
+        worker.submit((1, None, None))
+        self.assertTrue(wait_for(lambda: worker.request is None))  # the first frame is being processed
+        for t in range(2, 5):
+            worker.submit((t, None, None))
+        release.set()
+        self.assertTrue(wait_for(lambda: len(processed) == 2))
+        self.assertEqual(processed, [1, 4])  # latest frame wins
+        self.assertEqual(worker.num_dropped, 2)
+        self.assertEqual(worker.pop_results(), [{'time': 1}, {'time': 4}])
+        worker.request_stop()
+        worker.join()
+
+    def test_async_correction(self):
+        app = RerunRoute({'logfile': None}, MagicMock())
+        app.app.route = Route(pts=[(0, 0), (10, 0)])
+        app.state = app.STATE_WAIT_FOR_IMAGE
+        frame_time = timedelta(seconds=1)
+        # the robot moved 1m after the frame was taken, the correction uses the pose of the frame
+        app.alignment_worker = AlignmentWorker(lambda t, img, raw_pose: {
+            'time': t, 'offset': [raw_pose[0] + 2.0, 0.0, 0.0], 'pose': (2.0, 0.0, 0.0), 'ref_idx': 3, 'inliers': 50})
+        app.alignment_worker.submit((frame_time, None, (0.0, 0.0, 0.0)))
+        self.assertTrue(wait_for(lambda: not app.alignment_worker.results.empty()))
+        app.time = timedelta(seconds=1.5)
+        app.on_pose2d([1000, 0, 0])
+        self.assertEqual(app.pose_offset, [2.0, 0.0, 0.0])
+        self.assertEqual(app.state, app.STATE_DRIVING)
+        self.assertEqual(app.last_match_time, frame_time)
+        self.assertEqual(app.current_ref_idx, 3)
+        app.alignment_worker.request_stop()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,17 +3,25 @@
 """
 
 import math
+import os
+import sys
 from datetime import timedelta
 
+# Ensure we can find shared modules
+if os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')) not in sys.path:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'common')))
+
 import numpy as np
 
 from osgar.node import Node
 from osgar.lib.mathex import normalizeAnglePIPI
+from depth_scan import DepthScan, INVALID_MASK
+from waypoints import Waypoints
 
 
 def geo_length(pos1, pos2):
     "return distance on sphere for two integer positions in milliseconds"
-    x_scale = math.cos(math.radians(pos1[0]/3600000))
+    x_scale = math.cos(math.radians(pos1[1]/3600000))  # based on lat
     scale = 40000000/(360*3600000)
     return math.hypot((pos2[0] - pos1[0])*x_scale, pos2[1] - pos1[1]) * scale
 
@@ -21,7 +29,7 @@ def geo_length(pos1, pos2):
 def geo_angle(pos1, pos2):
     if geo_length(pos1, pos2) < 1.0:
         return None
-    x_scale = math.cos(math.radians(pos1[0]/3600000))
+    x_scale = math.cos(math.radians(pos1[1]/3600000))  # based on lat
     return math.atan2(pos2[1] - pos1[1], (pos2[0] - pos1[0])*x_scale)
 
 
@@ -36,7 +44,8 @@ class RoboOrienteering(Node):
         bus.register('desired_steering', 'scan')
         self.max_speed = config.get('max_speed', 0.2)
         self.turn_angle = config.get('turn_angle', 20)
-        self.waypoints = config.get('waypoints', [])[1:]  # remove start
+        self.depth_scan = DepthScan(horizon=400//2, above=0, below=30, invalid=INVALID_MASK)
+        self.waypoints = Waypoints(config.get('waypoints', [])[1:])  # remove start
         self.debug_all_waypoints = config.get('waypoints', [])[:]
         self.last_position = None
         self.verbose = False
@@ -130,7 +139,7 @@ class RoboOrienteering(Node):
                 # ignore detections for a moment (10s)
                 if self.closest_waypoint_dist is not None and self.closest_waypoint_dist < 10:
                     print(f'{self.time} REMOVING {self.closest_waypoint} dist={self.closest_waypoint_dist}')
-                    self.waypoints = self.waypoints[:self.closest_waypoint] + self.waypoints[self.closest_waypoint + 1:]
+                    del self.waypoints[self.closest_waypoint]
                     self.closest_waypoint_dist = None
                     self.closest_waypoint = None
             else:
@@ -158,7 +167,7 @@ class RoboOrienteering(Node):
             # GPS hacking
             if self.last_position is not None and self.gps_heading is not None and self.closest_waypoint_dist is not None:
                 if self.closest_waypoint_dist > 20:
-                    to_waypoint = geo_angle(latlon2xy(*self.last_position), latlon2xy(*self.waypoints[self.closest_waypoint]))
+                    to_waypoint = self.waypoints.bearing(self.last_position, self.closest_waypoint)
                     diff_angle = normalizeAnglePIPI(to_waypoint - self.gps_heading)
                     if steering_angle == 0:
                         steering_angle = math.copysign(math.radians(10), diff_angle)
@@ -177,16 +186,10 @@ class RoboOrienteering(Node):
             p = data['lat'], data['lon']
             if self.verbose:
                 self.debug_arr.append((self.time, p))
-            best_i, best_dist  = None, None
-            for i, waypoint in enumerate(self.waypoints):
-                dist = geo_length(latlon2xy(*p), latlon2xy(*waypoint))
-                if best_dist is None or best_dist > dist:
-                    best_i = i
-                    best_dist = dist
+            best_i, best_dist = self.waypoints.nearest(p)
             if self.closest_waypoint != best_i:
                 print(f'{self.time} ----- Switching to {best_i} at {best_dist} -----')
-                for i, waypoint in enumerate(self.waypoints):
-                    dist = geo_length(latlon2xy(*p), latlon2xy(*waypoint))
+                for i, (waypoint, dist) in enumerate(zip(self.waypoints, self.waypoints.distances(p))):
                     print(i, waypoint, dist)
                 print(f'{self.time} ----------------------')
             if self.last_position is not None:
@@ -203,17 +206,7 @@ class RoboOrienteering(Node):
         self.last_detections = data[:]
 
     def on_depth(self, data):
-        line = 400//2
-        line_end = 400//2 + 30
-        box_width = 160
-        arr = []
-        for index in range(0 , 641 - box_width, 20):
-            mask = data[line:line_end, index:box_width + index] != 0
-            if mask.max():
-                dist = int(np.percentile( data[line:line_end, index:box_width + index][mask], 5))
-            else:
-                dist = 0
-            arr.append(dist)
+        arr = self.depth_scan.scan(data)
         self.publish('scan', arr)
         self.scan = arr
 
@@ -260,7 +253,7 @@ class RoboOrienteering(Node):
         ax.scatter(x_center, y_center)
 
         radius = 0.0001
-        for c in self.waypoints + self.debug_all_waypoints:
+        for c in list(self.waypoints) + self.debug_all_waypoints:
             circle = Circle(c, radius, fill=False, edgecolor='r', linestyle='--')
             ax.add_patch(circle)
             ax.set_aspect('equal')